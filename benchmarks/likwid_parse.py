@@ -0,0 +1,96 @@
+#!/usr/bin/env python3
+"""
+Measure the throughput of the likwid output parser.
+
+We generate a synthetic ``likwid-perfctr -O -m`` output with many regions,
+groups and cores and parse it with pprof.likwid.read_likwid_batches:
+
+    python3 benchmarks/likwid_parse.py --regions 200 --cores 64
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+
+def write_likwid_output(out, regions, groups, events, cores):
+    """ Write a synthetic likwid output with the given dimensions. """
+    core_cols = ["Core {:d}".format(i) for i in range(cores)]
+    stat_cols = ["Sum", "Min", "Max", "Avg"]
+    out.write("STRUCT,Info,3\n")
+    out.write("CPU name:,Synthetic CPU\n")
+    out.write("CPU type:,Synthetic\n")
+    out.write("CPU clock:,3.00 GHz\n")
+    for region in range(regions):
+        for group in range(1, groups + 1):
+            out.write("STRUCT,Region {:d},4\n".format(region))
+            out.write("1,region_{:d}\n".format(region))
+            out.write(",".join(["Region Info"] + core_cols) + "\n")
+            out.write(",".join(["RDTSC Runtime [s]"] +
+                               ["{:.6f}".format(0.1 * i)
+                                for i in range(cores)]) + "\n")
+            out.write(",".join(["call count"] + ["1"] * cores) + "\n")
+
+            name = "Group {:d}".format(group)
+            out.write("TABLE,Region {:d},{} Raw,{:d}\n".format(
+                region, name, events))
+            out.write(",".join(["Event", "Counter"] + core_cols) + "\n")
+            for event in range(events):
+                out.write(",".join(["EVENT_{:d}".format(event),
+                                    "PMC{:d}".format(event)] +
+                                   [str(event * i) for i in range(cores)]) +
+                          "\n")
+            out.write("TABLE,Region {:d},{} Raw STAT,{:d}\n".format(
+                region, name, events))
+            out.write(",".join(["Event", "Counter"] + stat_cols) + "\n")
+            for event in range(events):
+                out.write(",".join(["EVENT_{:d} STAT".format(event),
+                                    "PMC{:d}".format(event), "1", "2", "3",
+                                    "4"]) + "\n")
+            out.write("TABLE,Region {:d},{} Metric,{:d}\n".format(
+                region, name, events))
+            out.write(",".join(["Metric"] + core_cols) + "\n")
+            for event in range(events):
+                out.write(",".join(["Metric {:d}".format(event)] +
+                                   ["{:.4f}".format(event / (i + 1.0))
+                                    for i in range(cores)]) + "\n")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--regions", type=int, default=100)
+    parser.add_argument("--groups", type=int, default=2)
+    parser.add_argument("--events", type=int, default=8)
+    parser.add_argument("--cores", type=int, default=32)
+    opts = parser.parse_args()
+
+    sys.path.insert(0, os.path.dirname(os.path.dirname(
+        os.path.abspath(__file__))))
+    from pprof.likwid import read_likwid_batches
+
+    fd, likwid_f = tempfile.mkstemp(prefix="pprof-bench-", suffix=".txt")
+    try:
+        with os.fdopen(fd, 'w') as out:
+            write_likwid_output(out, opts.regions, opts.groups, opts.events,
+                                opts.cores)
+        size = os.path.getsize(likwid_f)
+
+        start = time.monotonic()
+        rows = 0
+        with open(likwid_f, 'r') as likwid_out:
+            for batch in read_likwid_batches(likwid_out):
+                rows += len(batch.value)
+        elapsed = time.monotonic() - start
+    finally:
+        os.remove(likwid_f)
+
+    print("input:      {:10.2f} MiB".format(size / 1048576.0))
+    print("rows:       {:10d}".format(rows))
+    print("time:       {:10.3f} s".format(elapsed))
+    print("throughput: {:10.2f} MiB/s, {:.0f} rows/s".format(
+        size / 1048576.0 / elapsed, rows / elapsed))
+
+
+if __name__ == "__main__":
+    main()
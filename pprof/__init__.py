@@ -1,6 +1,7 @@
-from . import run
-from . import build
-from . import log
-from . import test
-from . import gentoo
-from . import generate_config
+"""
+The pprof study framework.
+
+The subcommands of the pprof driver are registered in pprof.driver.main.
+Importing this package has no side effects, it is imported by every
+wrapped binary of an experiment, which has to start fast.
+"""
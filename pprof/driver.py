@@ -1,6 +1,5 @@
 #!/usr/bin/env python3
 from plumbum import cli
-from pprof import *
 from sys import stderr
 import os.path
 import logging
@@ -73,4 +72,7 @@ class PollyProfiling(cli.Application):
 
 def main(*args):
     """Main function."""
+    # Register all subcommands.
+    from pprof import run, build, log, importer, flamegraph, perfdiff, test, \
+        gentoo, generate_config  # pylint: disable=W0612
     return PollyProfiling.run(*args)
@@ -38,7 +38,6 @@ from pprof.project import ProjectRegistry
 from pprof.utils.run import GuardedRunException
 from pprof.settings import config
 from pprof.utils.db import persist_experiment
-import pprof.projects  # pylint: disable=W0611
 
 
 def newline(ostream):
@@ -232,6 +231,14 @@ class Experiment(object, metaclass=ExperimentRegistry):
     """
     NAME = None
 
+    # Experiments that run every project once per core count, see
+    # RuntimeExperiment.run_sweep.
+    SWEEP = False
+
+    # Experiments that only compile the projects. They never call
+    # Project.run, so run_this_project records their run groups.
+    COMPILE_ONLY = False
+
     def __new__(cls, *args, **kwargs):
         """Create a new experiment instance and set some defaults."""
         new_self = super(Experiment, cls).__new__(cls)
@@ -255,6 +262,9 @@ class Experiment(object, metaclass=ExperimentRegistry):
 
     def __init__(self, projects=None, group=None):
         self.projects = {}
+        self.completed = {}
+        self.upcoming = []
+        self.prefetched = {}
         self.setup_commands()
         self.sourcedir = config["sourcedir"]
         self.builddir = path.join(config["builddir"], self.name)
@@ -276,6 +286,8 @@ class Experiment(object, metaclass=ExperimentRegistry):
                 In addition to the project filter, we provide a way to filter
                 whole groups.
         """
+        import pprof.projects  # pylint: disable=W0612
+
         self.projects = {}
 
         projects = ProjectRegistry.projects
@@ -322,6 +334,146 @@ class Experiment(object, metaclass=ExperimentRegistry):
         """
         pass
 
+    def prefetch(self, project):
+        """
+        Download a project in a background process.
+
+        The download may run concurrently with the download of the current
+        project, or with other prefetches of the same source. It relies on
+        the locked downloads of pprof.utils.downloader.
+
+        Args:
+            project (pprof.Project): The project we want to download.
+        """
+        from multiprocessing import get_context
+
+        def fetch():
+            """ Download the project from scratch. """
+            with local.env(PPROF_ENABLE=0):
+                project.clean()
+                project.prepare()
+                project.download()
+
+        worker = get_context("fork").Process(target=fetch,
+                                             name="prefetch " + project.name)
+        worker.start()
+        self.prefetched[project.name] = worker
+
+    def prefetch_upcoming(self):
+        """
+        Start downloading the next projects, while we work on this one.
+
+        We keep up to config["prefetch"] downloads of upcoming projects
+        running in the background. Upcoming projects often share a source,
+        e.g., the PolyBench tarball. This is safe, because the downloader
+        locks every target in ``config["tmpdir"]``: the first download
+        fetches it, all others wait and copy the finished target (see
+        pprof.utils.downloader.source_lock).
+        """
+        depth = int(config["prefetch"])
+        for project_name in self.upcoming[:depth]:
+            prj = self.projects[project_name]
+            if project_name not in self.prefetched and \
+                    not self.is_completed(prj):
+                self.prefetch(prj)
+
+    def settle_prefetch(self):
+        """ Wait until all background downloads have finished. """
+        for worker in self.prefetched.values():
+            worker.join()
+
+    def take_prefetched(self, project):
+        """
+        Take the background download of a project.
+
+        Args:
+            project (pprof.Project): The project we want to build.
+
+        Returns (bool):
+            True, if the project has been downloaded in the background
+            successfully.
+        """
+        worker = self.prefetched.pop(project.name, None)
+        if worker is None:
+            return False
+        worker.join()
+        return worker.exitcode == 0
+
+    def build_project(self, project):
+        """
+        Build the given project from scratch.
+
+        If the build cache holds a build of the same source, with the same
+        flags and toolchain, we restore it instead of configuring and
+        building the project again.
+
+        While we configure and build, the next projects get downloaded in
+        the background. All background downloads have finished, when we
+        return, so they never disturb a measurement.
+
+        Args:
+            project (pprof.Project): The project we want to build.
+        """
+        from pprof.utils.cache import restore_build, store_build
+        from pprof.utils.compiler import count_fallbacks, count_cache_lookups
+        from pprof.utils.db import persist_global_config
+
+        if not self.take_prefetched(project):
+            project.clean()
+            project.prepare()
+            project.download()
+
+        self.prefetch_upcoming()
+        try:
+            if restore_build(project):
+                print("    Restored {} from the build cache.".format(
+                    project.name))
+                return
+
+            project.configure()
+            project.build()
+            store_build(project)
+
+            hits, misses = count_cache_lookups(project.builddir)
+            if hits + misses > 0:
+                print("    Compile cache: {:d} of {:d} lookups hit "
+                      "({:.0%}).".format(hits, hits + misses,
+                                         hits / (hits + misses)))
+
+            fallbacks = count_fallbacks(project.builddir)
+            if fallbacks > 0:
+                print("    {:d} compilations fell back to the original "
+                      "flags.".format(fallbacks))
+            persist_global_config(
+                {"compiler.fallbacks." + project.name: fallbacks})
+        finally:
+            self.settle_prefetch()
+
+    def is_completed(self, project, jobs=None):
+        """
+        Check, if a project has been completed by an earlier run already.
+
+        This only returns True, if we resume an existing experiment.
+
+        Args:
+            project (pprof.Project): The project we check.
+            jobs (int): Check only the run with this core count.
+                By default, we check all configurations of the project.
+
+        Returns (bool):
+            True, if we do not need to run the project (with :jobs: cores)
+            again.
+        """
+        done = self.completed.get(project.name)
+        if not done:
+            return False
+        if jobs is not None:
+            return str(jobs) in done
+        if self.SWEEP:
+            return all([str(i) in done
+                        for i in range(1, int(config["jobs"]) + 1)])
+        return True
+
     def run_this_project(self, project):
         """
         Execute the project wrapped in a database session.
@@ -329,32 +481,130 @@ class Experiment(object, metaclass=ExperimentRegistry):
         Args:
             project (pprof.Project): The project we wrap.
         """
+        if self.is_completed(project):
+            print("    Skipping {}, it completed in an earlier run.".format(
+                project.name))
+            return
+
+        from datetime import datetime
+        begin = datetime.now()
         self.run_project(project)
+        if self.COMPILE_ONLY:
+            self.complete_compilation(project, begin)
+
+    def complete_compilation(self, project, begin):
+        """
+        Mark the compilation of a project as completed.
+
+        Compile-only experiments never create a run group. We record one
+        for the run uuid of the compilation, this allows --resume to skip
+        the project.
+
+        Args:
+            project (pprof.Project): The project we compiled.
+            begin (datetime): When we started with the project.
+        """
+        from pprof.utils.run import begin_run_group, end_run_group
+
+        group, session = begin_run_group(project)
+        group.begin = begin
+        end_run_group(group, session)
+
+    def map_project(self, fun, prj, pname=None):
+        """
+        Apply a function to a single project, inside a new phase.
+
+        Args:
+            fun: The function that is applied to the project.
+            prj (pprof.Project): The project.
+            pname (str): The project phase name.
+        """
+        def maybe_clean_on_error():
+            """ Clean the project, if the user asked for it. """
+            if "clean" in config and config["clean"]:
+                prj.clean()
+
+        with phase(pname, prj.name, maybe_clean_on_error):
+            llvm_libs = path.join(config["llvmdir"], "lib")
+            ld_lib_path = config["ld_library_path"] + ":" + llvm_libs
+            with local.env(LD_LIBRARY_PATH=ld_lib_path,
+                           PPROF_EXPERIMENT=self.name,
+                           PPROF_PROJECT=prj.name):
+                fun(prj)
 
     def map_projects(self, fun, pname=None):
         """
         Map a function over all projects.
 
+        If the user allows more than one parallel project (``config["parallel"]``),
+        the projects are distributed over a pool of worker processes.
+        Otherwise, we process the projects one after another and the
+        upcoming projects can be prefetched (see build_project).
+
+        SWEEP experiments always process their projects one after another.
+        Their sweep covers all cores (``config["jobs"]``), a worker only gets
+        its share of them.
+
         Args:
             fun: The function that is applied to all projects.
             pname (str): The project phase name.
         """
+        from logging import warning
+
+        parallel = int(config["parallel"])
+        if parallel > 1 and self.SWEEP:
+            if pname == "run":
+                warning("{} sweeps over all {} cores, ignoring --parallel "
+                        "{:d}.".format(self.name, config["jobs"], parallel))
+            parallel = 1
+        if parallel > 1 and len(self.projects) > 1:
+            self.map_projects_parallel(fun, pname, parallel)
+            return
+
+        project_names = list(self.projects)
+        for i, project_name in enumerate(project_names):
+            self.upcoming = project_names[i + 1:]
+            self.map_project(fun, self.projects[project_name], pname)
+        self.upcoming = []
+
+    def map_projects_parallel(self, fun, pname, parallel):
+        """
+        Map a function over all projects, using a pool of worker processes.
+
+        The cores (``config["jobs"]``) and the memory of the host form a budget
+        that is shared by all workers. Every project requests an equal share
+        of the cores and ``config["project_memory"]`` MiB of memory. Each
+        worker sees its share of the cores as ``config["jobs"]`` and is
+        pinned to its own set of cpus, concurrent projects never share a
+        cpu.
+
+        Args:
+            fun: The function that is applied to all projects.
+            pname (str): The project phase name.
+            parallel (int): Maximum number of concurrent projects.
+        """
         from functools import partial
+        from logging import error
+        from pprof.utils.schedule import Budget, Scheduler, available_memory
+
+        cores = int(config["jobs"])
+        memory = int(config["memory"]) or available_memory()
+        task_cores = max(1, cores // parallel)
+        task_memory = int(config["project_memory"])
+
+        def isolated(prj):
+            """ Run a single project inside a worker. """
+            config["jobs"] = str(task_cores)
+            self.map_project(fun, prj, pname)
+
+        scheduler = Scheduler(Budget(cores, memory), parallel, pin=True)
         for project_name in self.projects:
             prj = self.projects[project_name]
+            scheduler.submit(project_name, task_cores, task_memory,
+                             partial(isolated, prj))
 
-            def maybe_clean_on_error(project):
-                if "clean" in config and config["clean"]:
-                    project.clean()
-
-            with phase(pname, project_name, partial(maybe_clean_on_error,
-                                                    prj)):
-                llvm_libs = path.join(config["llvmdir"], "lib")
-                ld_lib_path = config["ld_library_path"] + ":" + llvm_libs
-                with local.env(LD_LIBRARY_PATH=ld_lib_path,
-                               PPROF_EXPERIMENT=self.name,
-                               PPROF_PROJECT=prj.name):
-                    fun(prj)
+        for project_name in scheduler.wait():
+            error("PHASE '{}' {} FAILED".format(pname, project_name))
 
     def clean(self):
         """Clean the experiment."""
@@ -374,6 +624,16 @@ class Experiment(object, metaclass=ExperimentRegistry):
 
         self.map_projects(self.prepare_project, "prepare")
 
+    def before_projects(self):
+        """
+        Prepare the run of all projects, e.g., measure host wide values.
+
+        This runs once in the driver process, before the projects are
+        distributed to worker processes. The workers inherit everything we
+        store on the experiment.
+        """
+        pass
+
     def run(self):
         """
         Run the experiment on all registered projects.
@@ -383,6 +643,10 @@ class Experiment(object, metaclass=ExperimentRegistry):
         from datetime import datetime
         from logging import error, info
 
+        if config["resume"]:
+            from pprof.utils.db import completed_run_groups
+            self.completed = completed_run_groups(config["experiment"])
+
         experiment, session = persist_experiment(self)
         if experiment.begin is None:
             experiment.begin = datetime.now()
@@ -391,6 +655,7 @@ class Experiment(object, metaclass=ExperimentRegistry):
 
         try:
             with local.env(PPROF_EXPERIMENT_ID=str(config["experiment"])):
+                self.before_projects()
                 self.map_projects(self.run_this_project, "run")
         except KeyboardInterrupt:
             error("User requested termination.")
@@ -409,21 +674,114 @@ class Experiment(object, metaclass=ExperimentRegistry):
 class RuntimeExperiment(Experiment):
     """ Additional runtime only features for experiments. """
 
+    def run_sweep(self, project, runner, label):
+        """
+        Run a built project once for every core count up to config["jobs"].
+
+        All core counts share the same build. Only the run group of the
+        project and the number of cores we hand to the runner change.
+        The project gets cleaned after the last run. Core counts that
+        completed in an earlier run of this experiment are skipped.
+
+        Args:
+            project (pprof.Project): The project, ready to run.
+            runner: The runner for the project's binaries. It gets called as
+                ``runner(project, experiment, config, jobs, ...)``.
+            label (str): Prefix for the step of each core count.
+        """
+        from uuid import uuid4
+        from pprof.utils.run import partial
+
+        for i in range(1, int(config["jobs"]) + 1):
+            if self.is_completed(project, i):
+                continue
+            project.run_uuid = uuid4()
+            with step("{}: {} cores & uuid {}".format(label, i,
+                                                      project.run_uuid)):
+                project.run(partial(runner, project, self, config, i),
+                            clean=False)
+
+        if not config["keep"]:
+            project.clean()
+
+    def calibrate_papi(self):
+        """
+        Get the PAPI calibration of this host.
+
+        Call this from before_projects, the worker processes of parallel
+        projects then share the calibration of the driver.
+
+        Returns (tuple(plumbum.cmd, str)):
+            The calibration command and the calibration time in nanoseconds,
+            see get_papi_calibration.
+        """
+        bin_path = path.join(config["llvmdir"], "bin")
+        pprof_calibrate = local[path.join(bin_path, "pprof-calibrate")]
+        return (pprof_calibrate,
+                self.get_papi_calibration(None, pprof_calibrate))
+
     def get_papi_calibration(self, project, calibrate_call):
         """
         Get calibration values for PAPI based measurements.
 
+        The calibration is measured once per host, toolchain and PAPI
+        version and cached (see pprof.utils.cache). The first call of an
+        experiment attaches the result to the experiment's global config,
+        all later calls return the same result.
+
         Args:
             project (Project):
                 Unused (deprecated).
             calibrate_call (plumbum.cmd):
                 The calibration command we will use.
+
+        Returns (str):
+            The calibration time in nanoseconds, or None, if the
+            calibration failed.
+        """
+        from pprof.utils.cache import calibration_key, lookup_calibration, \
+            store_calibration
+        from pprof.utils.db import persist_global_config
+
+        if hasattr(self, "papi_calibration"):
+            return self.papi_calibration
+
+        key = calibration_key(calibrate_call)
+        calibration = lookup_calibration(key)
+        if calibration is None:
+            calibration = self.measure_papi_calibration(calibrate_call)
+            store_calibration(key, calibration)
+
+        self.papi_calibration = calibration
+        if calibration is not None:
+            persist_global_config({"papi.calibration.time_ns": calibration,
+                                   "papi.calibration.key": key})
+        return calibration
+
+    def measure_papi_calibration(self, calibrate_call):
+        """
+        Run the calibration command and extract its result.
+
+        Args:
+            calibrate_call (plumbum.cmd):
+                The calibration command we will use.
+
+        Returns (str):
+            The calibration time in nanoseconds, or None, if the command
+            failed or we did not find it in the output.
         """
-        with local.cwd(self.builddir):
-            with local.env(PPROF_USE_DATABASE=0,
-                           PPROF_USE_CSV=0,
-                           PPROF_USE_FILE=0):
-                calib_out = calibrate_call()
+        from logging import error
+        from plumbum import CommandNotFound
+
+        try:
+            with local.cwd(self.builddir):
+                with local.env(PPROF_USE_DATABASE=0,
+                               PPROF_USE_CSV=0,
+                               PPROF_USE_FILE=0):
+                    calib_out = calibrate_call()
+        except (ProcessExecutionError, CommandNotFound, OSError) as ex:
+            error("PAPI calibration failed: {}".format(ex))
+            return None
 
         calib_pattern = regex.compile(
             r'Real time per call \(ns\): (?P<val>[0-9]+.[0-9]+)')
@@ -1,5 +1,5 @@
 """Add your new experiment here, if you want it to be discovered by pprof."""
 __all__ = [
-    "empty", "polly", "compilestats_ewpt", "compilestats", "papi", "polyjit",
-    "raw"
+    "empty", "polly", "compilestats_ewpt", "compilestats", "papi", "perfstat",
+    "polyjit", "raw"
 ]
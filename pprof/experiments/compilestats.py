@@ -8,12 +8,44 @@ by llvm
 """
 
 from pprof.experiment import step, substep, RuntimeExperiment
+from pprof.utils.registry import runner
 from os import path
 
+
+@runner
+def collect_compilestats(project, experiment, config, clang, retcode=0,
+                         stdout="", stderr="", **kwargs):
+    """
+    Collect the LLVM statistics of a single compilation.
+
+    The wrapped compiler runs with '-mllvm -stats' (see
+    pprof.utils.run.with_compile_flags) and hands us its output.
+    """
+    from pprof.utils import run as r
+    from pprof.settings import config as c
+    from pprof.utils.db import persist_compilestats
+    from pprof.utils.schema import CompileStat
+
+    c.update(config)
+    run, session = r.record_exec(clang, project.name, experiment.name,
+                                 project.run_uuid, retcode, stdout, stderr)
+
+    if retcode == 0:
+        stats = []
+        for stat in get_compilestats(stderr):
+            compile_s = CompileStat()
+            compile_s.name = stat["desc"].rstrip()
+            compile_s.component = stat["component"].rstrip()
+            compile_s.value = stat["value"]
+            stats.append(compile_s)
+        persist_compilestats(run, session, stats)
+
+
 class CompilestatsExperiment(RuntimeExperiment):
     """The compilestats experiment."""
 
     NAME = "stats"
+    COMPILE_ONLY = True
 
     def extra_ldflags(self):
         return []
@@ -23,9 +55,8 @@ class CompilestatsExperiment(RuntimeExperiment):
 
     def run_project(self, p):
         """Compile & Run the experiment."""
-        from pprof.utils.schema import CompileStat
         from pprof.settings import config
-        from pprof.utils.run import partial
+        from pprof.utils.run import partial, with_compile_flags
 
         llvm_libs = path.join(config["llvmdir"], "lib")
         p.ldflags = ["-L" + llvm_libs] + self.extra_ldflags()
@@ -33,31 +64,9 @@ class CompilestatsExperiment(RuntimeExperiment):
         with step("Configure Project"):
             p.download()
 
-            def _track_compilestats(project, experiment, config, clang,
-                                    **kwargs):
-                from pprof.utils import run as r
-                from pprof.settings import config as c
-                from pprof.utils.db import persist_compilestats
-                from pprof.utils.run import handle_stdin
-
-                c.update(config)
-                clang = handle_stdin(clang["-mllvm", "-stats"], kwargs)
-
-                run, session, retcode, _, stderr = \
-                    r.guarded_exec(clang, project.name, experiment.name, project.run_uuid)
-
-                if retcode == 0:
-                    stats = []
-                    for stat in get_compilestats(stderr):
-                        compile_s = CompileStat()
-                        compile_s.name = stat["desc"].rstrip()
-                        compile_s.component = stat["component"].rstrip()
-                        compile_s.value = stat["value"]
-                        stats.append(compile_s)
-                    persist_compilestats(run, session, stats)
-
-            p.compiler_extension = partial(_track_compilestats, p, self,
-                                           config)
+            p.compiler_extension = with_compile_flags(
+                partial(collect_compilestats, p, self, config),
+                "-mllvm", "-stats")
             p.configure()
         with step("Build Project"):
             p.build()
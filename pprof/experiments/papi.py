@@ -6,53 +6,22 @@ project with libpprof support to work.
 
 """
 from pprof.experiment import (RuntimeExperiment, step, substep)
+from pprof.experiments.compilestats import collect_compilestats
 from pprof.experiments.raw import run_with_time
-from pprof.utils.run import partial
+from pprof.utils.run import partial, with_compile_flags
 from plumbum import local
 from os import path
 
 
-def get_compilestats(prog_out):
-    """ Get the LLVM compilation stats from :prog_out:. """
-    from parse import compile
-
-    stats_pattern = compile("{value:d} {component} - {desc}\n")
-
-    for line in prog_out.split("\n"):
-        res = stats_pattern.search(line + "\n")
-        if res is not None:
-            yield res
-
-def collect_compilestats(project, experiment, config, clang, **kwargs):
-    """Collect compilestats."""
-    from pprof.utils import run as r
-    from pprof.settings import config as c
-    from pprof.utils.db import persist_compilestats
-    from pprof.utils.run import handle_stdin
-    from pprof.utils.schema import CompileStat
-
-    c.update(config)
-    clang = handle_stdin(clang["-mllvm", "-stats"], kwargs)
-
-    run, session, retcode, _, stderr = \
-        r.guarded_exec(clang, project.name, experiment.name, project.run_uuid)
-
-    if retcode == 0:
-        stats = []
-        for stat in get_compilestats(stderr):
-            compile_s = CompileStat()
-            compile_s.name = stat["desc"].rstrip()
-            compile_s.component = stat["component"].rstrip()
-            compile_s.value = stat["value"]
-            stats.append(compile_s)
-        persist_compilestats(run, session, stats)
-
-
 class PapiScopCoverage(RuntimeExperiment):
     """PAPI-based dynamic SCoP coverage measurement."""
 
     NAME = "papi"
 
+    def before_projects(self):
+        """Calibrate PAPI once, before the projects run."""
+        self.calibrate_papi()
+
     def run(self):
         """Do the postprocessing, after all projects are done."""
         super(PapiScopCoverage, self).run()
@@ -91,18 +60,16 @@ class PapiScopCoverage(RuntimeExperiment):
                         "-polly-detect-keep-going"]
             with substep("reconf & rebuild"):
                 with local.env(PPROF_ENABLE=0):
-                    p.compiler_extension = partial(collect_compilestats, p,
-                                                   self, config)
+                    p.compiler_extension = with_compile_flags(
+                        partial(collect_compilestats, p, self, config),
+                        "-mllvm", "-stats")
                     p.configure()
                     p.build()
             with substep("run"):
                 p.run(partial(run_with_time, p, self, config, 1))
 
         with step("Evaluation"):
-            bin_path = path.join(config["llvmdir"], "bin")
-            pprof_calibrate = local[path.join(bin_path, "pprof-calibrate")]
-            papi_calibration = self.get_papi_calibration(p, pprof_calibrate)
-
+            pprof_calibrate, papi_calibration = self.calibrate_papi()
             self.persist_calibration(p, pprof_calibrate, papi_calibration)
 
 
@@ -141,7 +108,5 @@ class PapiStandardScopCoverage(PapiScopCoverage):
                 p.run(partial(run_with_time, p, self, config, 1))
 
         with step("Evaluation"):
-            bin_path = path.join(config["llvmdir"], "bin")
-            pprof_calibrate = local[path.join(bin_path, "pprof-calibrate")]
-            papi_calibration = self.get_papi_calibration(p, pprof_calibrate)
+            pprof_calibrate, papi_calibration = self.calibrate_papi()
             self.persist_calibration(p, pprof_calibrate, papi_calibration)
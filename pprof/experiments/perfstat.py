@@ -0,0 +1,123 @@
+"""
+The 'perfstat' Experiment.
+
+This experiment runs all projects after compiling them with -O3. Every
+wrapped binary is executed under ``perf stat``, which counts a small set
+of hardware events. Unlike likwid, this needs nothing but the perf tool.
+
+Software events are counted in every run. If the host has no hardware PMU
+(e.g., inside a VM), we count only those. perf skips hardware events it
+cannot count, so we still get the software events then.
+
+Measurements
+------------
+
+For every counted event (see HARDWARE_EVENTS and SOFTWARE_EVENTS):
+    perfstat.<event> - The value of the counter. If perf had to multiplex
+        the counters, this is perf's estimate for the whole run.
+    perfstat.<event>.running - The share of the run time (0..1) the counter
+        was measured, if it was multiplexed.
+"""
+from os import path
+
+from pprof.experiment import step, substep, RuntimeExperiment
+from pprof.utils.registry import runner
+from plumbum import local
+
+HARDWARE_EVENTS = ["cycles", "instructions", "cache-references",
+                   "cache-misses", "branches", "branch-misses"]
+SOFTWARE_EVENTS = ["task-clock", "context-switches", "cpu-migrations",
+                   "page-faults"]
+
+
+def has_hardware_pmu():
+    """ Check, if the kernel exposes a hardware PMU for the cpu. """
+    devices = "/sys/bus/event_source/devices"
+    return any([path.exists(path.join(devices, pmu))
+                for pmu in ["cpu", "cpu_core", "cpu_atom", "armv8_pmuv3"]])
+
+
+@runner
+def run_with_perf_stat(project, experiment, config, jobs, run_f, args,
+                       **kwargs):
+    """
+    Run the given binary under perf stat and store its counters.
+
+    Args:
+        project: The pprof project that has called us.
+        experiment: The pprof experiment which we operate under.
+        config: The pprof configuration we are running with.
+        jobs: The number of cores we are allowed to use. We pin the binary
+            to this number of cores.
+        run_f: The file we want to execute.
+        args: List of arguments that should be passed to the wrapped binary.
+        **kwargs: Dictionary with our keyword args. We support the following
+            entries:
+
+            project_name: The real name of our project. This might not
+                be the same as the configured project name, if we got wrapped
+                with ::pprof.project.wrap_dynamic
+            has_stdin: Signals whether we should take care of stdin.
+    """
+    from pprof.perf import read_perf_stat
+    from pprof.settings import config as c
+    from pprof.utils import run as r
+    from pprof.utils.db import persist_config, persist_metrics
+    from pprof.utils.affinity import cpu_affinity, cpu_list
+    from plumbum.cmd import perf, rm
+
+    c.update(config)
+    project_name = kwargs.get("project_name", project.name)
+    events = SOFTWARE_EVENTS
+    if has_hardware_pmu():
+        events = HARDWARE_EVENTS + SOFTWARE_EVENTS
+    stat_f = run_f + ".perfstat"
+
+    run_cmd = perf["stat", "-x,", "-o", stat_f, "-e", ",".join(events),
+                   "--", run_f]
+    run_cmd = r.handle_stdin(run_cmd[args], kwargs)
+
+    with local.env(OMP_NUM_THREADS=str(jobs)), cpu_affinity(jobs) as cpus:
+        run, session, _, _, _ = \
+            r.guarded_exec(run_cmd, project_name, experiment.name,
+                           project.run_uuid)
+
+    metrics = {}
+    try:
+        with open(stat_f, 'r') as stat_out:
+            for event, value, _, running in read_perf_stat(stat_out):
+                metrics["perfstat." + event] = value
+                if running is not None and running < 1.0:
+                    metrics["perfstat." + event + ".running"] = running
+    finally:
+        rm("-f", stat_f)
+
+    persist_metrics(run, session, metrics)
+    counted = [name[len("perfstat."):] for name in metrics
+               if not name.endswith(".running")]
+    persist_config(run, session, {
+        "cores": str(jobs),
+        "cpuset": cpu_list(cpus),
+        "perfstat.events": ",".join([e for e in events if e in counted])
+    })
+
+
+class PerfStat(RuntimeExperiment):
+    """Count hardware events of all projects with perf stat."""
+
+    NAME = "perfstat"
+
+    def run_project(self, p):
+        """Compile & Run the experiment with -O3 enabled."""
+        from pprof.settings import config
+        from pprof.utils.run import partial
+        llvm_libs = path.join(config["llvmdir"], "lib")
+
+        with step("perf stat -O3"):
+            p.ldflags = ["-L" + llvm_libs]
+            p.cflags = ["-O3", "-fno-omit-frame-pointer"]
+            with substep("reconf & rebuild"):
+                self.build_project(p)
+            with substep("run {}".format(p.name)):
+                p.run(partial(run_with_perf_stat, p, self, config,
+                              config["jobs"]))
@@ -24,6 +24,7 @@ class PollyOpenMP(RuntimeExperiment):
     """Timing experiment with Polly & OpenMP support."""
 
     NAME = "polly-openmp"
+    SWEEP = True
 
     def run_project(self, p):
         """Build & Run each project with Polly & OpenMP support."""
@@ -24,6 +24,7 @@ class PollyOpenMPVectorizer(RuntimeExperiment):
     """Timing experiment with Polly & OpenMP+Vectorizer support."""
 
     NAME = "polly-openmpvect"
+    SWEEP = True
 
     def run_project(self, p):
         from uuid import uuid4
@@ -26,23 +26,16 @@ class Polly(RuntimeExperiment):
     """ The polly experiment. """
 
     NAME = "polly"
+    SWEEP = True
 
     def run_project(self, p):
-        from uuid import uuid4
         from pprof.experiments.raw import run_with_time
-        from pprof.utils.run import partial
 
         llvm_libs = path.join(config["llvmdir"], "lib")
         p.ldflags = ["-L" + llvm_libs]
         p.cflags = ["-O3", "-Xclang", "-load", "-Xclang", "LLVMPolyJIT.so",
                     "-mllvm", "-polly"]
 
-        for i in range(1, int(config["jobs"]) + 1):
-            p.run_uuid = uuid4()
-            with step("time: {} cores & uuid {}".format(i, p.run_uuid)):
-                p.clean()
-                p.prepare()
-                p.download()
-                p.configure()
-                p.build()
-                p.run(partial(run_with_time, p, self, config, i))
+        with step("build {}".format(p.name)):
+            self.build_project(p)
+        self.run_sweep(p, run_with_time, "time")
@@ -25,6 +25,7 @@ class PollyVectorizer(RuntimeExperiment):
     """ The polly experiment with vectorization enabled. """
 
     NAME = "polly-vectorize"
+    SWEEP = True
 
     def run_project(self, p):
         from uuid import uuid4
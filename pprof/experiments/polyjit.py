@@ -4,41 +4,36 @@ The 'polyjit' experiment.
 This experiment uses likwid to measure the performance of all binaries
 when running with polyjit support enabled.
 """
-from pprof.experiments.compilestats import get_compilestats
+from pprof.experiments.compilestats import collect_compilestats
+from pprof.experiments.raw import run_with_time
 from pprof.experiment import step, substep, RuntimeExperiment
-from pprof.utils.run import partial
+from pprof.utils.registry import runner
+from pprof.utils.run import partial, with_compile_flags, parallel_batches
 
 from plumbum import local
 from abc import abstractmethod
 from os import path
 
 
-def collect_compilestats(project, experiment, config, clang, **kwargs):
-    """Collect compilestats."""
+@runner
+def track_module_collection(project, experiment, config, clang, **kwargs):
+    """
+    Compile again and collect the regression test modules.
+
+    PolyJIT stores the modules while it compiles, under the id of the
+    current run (PPROF_DB_RUN_ID). The run has to exist before the
+    compilation starts, so this cannot be a single-pass extension.
+    """
     from pprof.utils import run as r
     from pprof.settings import config as c
-    from pprof.utils.db import persist_compilestats
-    from pprof.utils.run import handle_stdin
-    from pprof.utils.schema import CompileStat
 
     c.update(config)
-    clang = handle_stdin(clang["-mllvm", "-stats"], kwargs)
-
-    run, session, retcode, _, stderr = \
-        r.guarded_exec(clang, project.name, experiment.name, project.run_uuid)
-
-    if retcode == 0:
-        stats = []
-        for stat in get_compilestats(stderr):
-            compile_s = CompileStat()
-            compile_s.name = stat["desc"].rstrip()
-            compile_s.component = stat["component"].rstrip()
-            compile_s.value = stat["value"]
-            stats.append(compile_s)
-        persist_compilestats(run, session, stats)
+    clang = r.handle_stdin(clang["-mllvm", "-polli-collect-modules"], kwargs)
+    r.guarded_exec(clang, project.name, experiment.name, project.run_uuid)
 
 
-def run_raw(project, experiment, config, run_f, args, **kwargs):
+@runner
+def run_raw(project, experiment, config, jobs, run_f, args, **kwargs):
     """
     Run the given binary wrapped with nothing.
 
@@ -46,6 +41,7 @@ def run_raw(project, experiment, config, run_f, args, **kwargs):
         project: The pprof.project.
         experiment: The pprof.experiment.
         config: The pprof.settings.config.
+        jobs: Number of cores we should use for this exection.
         run_f: The file we want to execute.
         args: List of arguments that should be passed to the wrapped binary.
         **kwargs: Dictionary with our keyword args. We support the following
@@ -58,15 +54,24 @@ def run_raw(project, experiment, config, run_f, args, **kwargs):
     """
     from pprof.utils import run as r
     from pprof.settings import config as c
+    from pprof.utils.db import persist_config
+    from pprof.utils.affinity import cpu_affinity, cpu_list
 
     c.update(config)
     project_name = kwargs.get("project_name", project.name)
 
     run_cmd = local[run_f]
     run_cmd = r.handle_stdin(run_cmd[args], kwargs)
-    r.guarded_exec(run_cmd, project_name, experiment.name, project.run_uuid)
+    with cpu_affinity(jobs) as cpus:
+        run, session, _, _, _ = \
+            r.guarded_exec(run_cmd, project_name, experiment.name,
+                           project.run_uuid)
 
+    persist_config(run, session, {"cores": str(jobs),
+                                  "cpuset": cpu_list(cpus)})
 
+
+@runner
 def run_with_papi(project, experiment, config, jobs, run_f, args, **kwargs):
     """
     Run the given file with PAPI support.
@@ -92,6 +97,7 @@ def run_with_papi(project, experiment, config, jobs, run_f, args, **kwargs):
     from pprof.settings import config as c
     from pprof.utils import run as r
     from pprof.utils.db import persist_config
+    from pprof.utils.affinity import cpu_affinity, cpu_list
     from plumbum import local
 
     c.update(config)
@@ -99,18 +105,26 @@ def run_with_papi(project, experiment, config, jobs, run_f, args, **kwargs):
     run_cmd = local[run_f]
     run_cmd = r.handle_stdin(run_cmd[args], kwargs)
 
-    with local.env(POLLI_ENABLE_PAPI=1, OMP_NUM_THREADS=jobs):
+    with local.env(POLLI_ENABLE_PAPI=1, OMP_NUM_THREADS=jobs), \
+            cpu_affinity(jobs) as cpus:
         run, session, _, _, _ = \
             r.guarded_exec(run_cmd, project_name, experiment.name,
                            project.run_uuid)
 
-    persist_config(run, session, {"cores": str(jobs)})
+    persist_config(run, session, {"cores": str(jobs),
+                                  "cpuset": cpu_list(cpus)})
 
 
+@runner
 def run_with_likwid(project, experiment, config, jobs, run_f, args, **kwargs):
     """
     Run the given file wrapped by likwid.
 
+    We measure all groups in ``config["likwid_groups"]``, either one run per
+    group, or all of them in a single, time-multiplexed run (see
+    ``config["likwid_multiplex"]``). Every run is tagged with its groups
+    (``likwid.group``), pprof.utils.db.load_likwid_regions merges them.
+
     Args:
         project: The pprof.project.
         experiment: The pprof.experiment.
@@ -128,87 +142,62 @@ def run_with_likwid(project, experiment, config, jobs, run_f, args, **kwargs):
     """
     from pprof.settings import config as c
     from pprof.utils import run as r
-    from pprof.utils.db import persist_likwid, persist_config
-    from pprof.likwid import get_likwid_perfctr
+    from pprof.utils.db import persist_likwid_batches, persist_config
+    from pprof.likwid import read_likwid_batches, name_groups
+    from pprof.utils.affinity import select_cpus, cpu_list
     from plumbum.cmd import rm
 
     c.update(config)
     project_name = kwargs.get("project_name", project.name)
     likwid_f = project_name + ".txt"
-
-    for group in ["CLOCK"]:
-        likwid_path = path.join(c["likwiddir"], "bin")
-        likwid_perfctr = local[path.join(likwid_path, "likwid-perfctr")]
-        run_cmd = \
-            likwid_perfctr["-O", "-o", likwid_f, "-m",
-                           "-C", "0-{:d}".format(jobs),
-                           "-g", group, run_f]
-        run_cmd = r.handle_stdin(run_cmd[args], kwargs)
+    cpuset = cpu_list(select_cpus(jobs))
+
+    groups = [group.strip() for group in str(c["likwid_groups"]).split(",")
+              if group.strip()]
+    multiplex = str(c["likwid_multiplex"]).lower() not in ["false", "0", "no"]
+    if multiplex and len(groups) > 1:
+        rotations = [groups]
+    else:
+        rotations = [[group] for group in groups]
+    if len(rotations) > 1:
+        r.buffer_stdin(kwargs)
+
+    likwid_path = path.join(c["likwiddir"], "bin")
+    likwid_perfctr = local[path.join(likwid_path, "likwid-perfctr")]
+    for rotation in rotations:
+        group_args = []
+        for group in rotation:
+            group_args += ["-g", group]
+        if len(rotation) > 1:
+            group_args += ["-T", c["likwid_mux_time"]]
+
+        run_cmd = likwid_perfctr["-O", "-o", likwid_f, "-m", "-C", cpuset]
+        run_cmd = r.handle_stdin(run_cmd[group_args][run_f][args], kwargs)
 
         with local.env(POLLI_ENABLE_LIKWID=1):
             run, session, _, _, _ = \
                 r.guarded_exec(run_cmd, project_name, experiment.name,
                                project.run_uuid)
 
-        likwid_measurement = get_likwid_perfctr(likwid_f)
-        """ Use the project_name from the binary, because we
-            might encounter dynamically generated projects.
-        """
-        persist_likwid(run, session, likwid_measurement)
+        with open(likwid_f, 'r') as likwid_out:
+            batches = read_likwid_batches(likwid_out)
+            if len(rotation) > 1:
+                batches = name_groups(batches, rotation)
+            persist_likwid_batches(run, session, batches)
         persist_config(run, session, {
             "cores": str(jobs),
-            "likwid.group": group
+            "cpuset": cpuset,
+            "likwid.group": ",".join(rotation)
         })
         rm("-f", likwid_f)
 
 
-def run_with_time(project, experiment, config, jobs, run_f, args, **kwargs):
-    """
-    Run the given binary wrapped with time.
-
-    Args:
-        project: The pprof.project.
-        experiment: The pprof.experiment.
-        config: The pprof.settings.config.
-        jobs: Number of cores we should use for this exection.
-        run_f: The file we want to execute.
-        args: List of arguments that should be passed to the wrapped binary.
-        **kwargs: Dictionary with our keyword args. We support the following
-            entries:
-
-            project_name: The real name of our project. This might not
-                be the same as the configured project name, if we got wrapped
-                with ::pprof.project.wrap_dynamic
-            has_stdin: Signals whether we should take care of stdin.
-    """
-    from pprof.utils import run as r
-    from pprof.settings import config as c
-    from pprof.utils.db import persist_time, persist_config
-    from plumbum.cmd import time
-
-    c.update(config)
-    project_name = kwargs.get("project_name", project.name)
-    timing_tag = "PPROF-JIT: "
-
-    run_cmd = time["-f", timing_tag + "%U-%S-%e", run_f]
-    run_cmd = r.handle_stdin(run_cmd[args], kwargs)
-
-    with local.env(OMP_NUM_THREADS=str(jobs)):
-        run, session, _, _, stderr = \
-            r.guarded_exec(run_cmd, project_name, experiment.name,
-                           project.run_uuid)
-        timings = r.fetch_time_output(
-            timing_tag, timing_tag + "{:g}-{:g}-{:g}", stderr.split("\n"))
-        if len(timings) == 0:
-            return
-
-    persist_time(run, session, timings)
-    persist_config(run, session, {"cores": str(jobs)})
-
-
+@runner
 def run_with_perf(project, experiment, config, jobs, run_f, args, **kwargs):
     """
-    Run the given binary wrapped with time.
+    Run the given binary with perf and fold its call stacks.
+
+    The folded call stacks are attached to the run of the binary itself.
 
     Args:
         project: The pprof.project.
@@ -226,34 +215,30 @@ def run_with_perf(project, experiment, config, jobs, run_f, args, **kwargs):
             has_stdin: Signals whether we should take care of stdin.
     """
     from pprof.settings import config as c
+    from pprof.perf import perf_script_folded
     from pprof.utils import run as r
     from pprof.utils.db import persist_perf, persist_config
-    from plumbum.cmd import perf
+    from pprof.utils.affinity import cpu_affinity, cpu_list
+    from plumbum.cmd import perf, rm
 
     c.update(config)
     project_name = kwargs.get("project_name", project.name)
-    run_cmd = local[run_f]
+    perf_data = run_f + ".perf.data"
+    run_cmd = perf["record", "-q", "-F", 6249, "-g", "-o", perf_data, run_f]
     run_cmd = r.handle_stdin(run_cmd[args], kwargs)
-    run_cmd = perf["record", "-q", "-F", 6249, "-g", run_cmd]
 
     with local.env(OMP_NUM_THREADS=str(jobs)):
-        run_cmd()
-        run, session, _, _, _ = \
-            r.guarded_exec(local["/bin/true"], project_name, experiment.name,
-                           project.run_uuid)
-
-        fg_path = path.join(c["sourcedir"], "extern/FlameGraph")
-        if path.exists(fg_path):
-            sc_perf = local[path.join(fg_path, "stackcollapse-perf.pl")]
-            flamegraph = local[path.join(fg_path, "flamegraph.pl")]
-
-            fold_cmd = ((perf["script"] | sc_perf) > run_f + ".folded")
-            graph_cmd = (flamegraph[run_f + ".folded"] > run_f + ".svg")
+        with cpu_affinity(jobs) as cpus:
+            run, session, _, _, _ = \
+                r.guarded_exec(run_cmd, project_name, experiment.name,
+                               project.run_uuid)
 
-            fold_cmd()
-            graph_cmd()
-            persist_perf(run, session, run_f + ".svg")
-            persist_config(run, session, {"cores": str(jobs)})
+    try:
+        persist_perf(run, session, perf_script_folded(perf_data))
+        persist_config(run, session, {"cores": str(jobs),
+                                      "cpuset": cpu_list(cpus)})
+    finally:
+        rm("-f", perf_data)
 
 
 class PolyJIT(RuntimeExperiment):
@@ -298,25 +283,16 @@ class PJITRaw(PolyJIT):
     """
 
     NAME = "pj-raw"
+    SWEEP = True
 
     def run_project(self, p):
-        from pprof.settings import config
-
         p = self.init_project(p)
         with local.env(PPROF_ENABLE=0):
-            from uuid import uuid4
-
             p.cflags += ["-fno-omit-frame-pointer"]
 
-            for i in range(1, int(config["jobs"]) + 1):
-                p.run_uuid = uuid4()
-                with step("time: {} cores & uuid {}".format(i, p.run_uuid)):
-                    p.clean()
-                    p.prepare()
-                    p.download()
-                    p.configure()
-                    p.build()
-                    p.run(partial(run_with_time, p, self, config, i))
+            with step("build {}".format(p.name)):
+                self.build_project(p)
+            self.run_sweep(p, run_with_time, "time")
 
 
 class PJITperf(PolyJIT):
@@ -325,23 +301,16 @@ class PJITperf(PolyJIT):
     """
 
     NAME = "pj-perf"
+    SWEEP = True
 
     def run_project(self, p):
-        from pprof.settings import config
         p = self.init_project(p)
         with local.env(PPROF_ENABLE=0):
-            from uuid import uuid4
-
             p.cflags += ["-fno-omit-frame-pointer"]
-            for i in range(1, int(config["jobs"]) + 1):
-                p.run_uuid = uuid4()
-                with step("perf: {} cores & uuid {}".format(i, p.run_uuid)):
-                    p.clean()
-                    p.prepare()
-                    p.download()
-                    p.configure()
-                    p.build()
-                    p.run(partial(run_with_perf, p, self, config, i))
+
+            with step("build {}".format(p.name)):
+                self.build_project(p)
+            self.run_sweep(p, run_with_perf, "perf")
 
 
 class PJITlikwid(PolyJIT):
@@ -355,30 +324,16 @@ class PJITlikwid(PolyJIT):
     """
 
     NAME = "pj-likwid"
+    SWEEP = True
 
     def run_project(self, p):
-        from pprof.settings import config
-
         p = self.init_project(p)
         with local.env(PPROF_ENABLE=0):
-            from uuid import uuid4
-
             p.cflags = ["-DLIKWID_PERFMON"] + p.cflags
 
-            for i in range(1, int(config["jobs"]) + 1):
-                with step("{} cores & uuid {}".format(i, p.run_uuid)):
-                    p.clean()
-                    p.prepare()
-                    p.download()
-                    p.configure()
-                    p.build()
-
-                    p.run_uuid = uuid4()
-                    run_with_likwid.config = config
-                    run_with_likwid.experiment = self
-                    run_with_likwid.project = p
-                    run_with_likwid.jobs = i
-                    p.run(partial(run_with_likwid, p, self, config, i))
+            with step("build {}".format(p.name)):
+                self.build_project(p)
+            self.run_sweep(p, run_with_likwid, "likwid")
 
 
 class PJITRegression(PolyJIT):
@@ -406,31 +361,15 @@ class PJITRegression(PolyJIT):
 
         p = self.init_project(p)
         with local.env(PPROF_ENABLE=0):
-
-            def _track_compilestats(project, experiment, config, clang,
-                                    **kwargs):
-                """ Compile the project and track the compilestats. """
-                from pprof.utils import run as r
-                from pprof.settings import config as c
-                from pprof.utils.run import handle_stdin
-
-                c.update(config)
-                clang = handle_stdin(clang["-mllvm", "-polli-collect-modules"],
-                                     kwargs)
-                pname = project.name
-                ename = experiment.name
-                ruuid = project.run_uuid
-                r.guarded_exec(clang, pname, ename, ruuid)
-
             with step("Extract regression test modules."):
                 p.clean()
                 p.prepare()
                 p.download()
-                p.compiler_extension = partial(_track_compilestats, p, self,
-                                               config)
+                p.compiler_extension = partial(track_module_collection, p,
+                                               self, config)
                 p.configure()
                 p.build()
-                p.run(partial(run_raw, p, self, config, 1))
+                p.run(parallel_batches(partial(run_raw, p, self, config, 1)))
 
 
 class PJITcs(PolyJIT):
@@ -442,10 +381,10 @@ class PJITcs(PolyJIT):
     """
 
     NAME = "pj-cs"
+    COMPILE_ONLY = True
 
     def run_project(self, p):
         from pprof.settings import config
-        from pprof.utils.schema import CompileStat
 
         p = self.init_project(p)
         with local.env(PPROF_ENABLE=0):
@@ -455,33 +394,10 @@ class PJITcs(PolyJIT):
             p.prepare()
             p.download()
             with substep("Configure Project"):
-
-                def _track_compilestats(project, experiment, config, clang,
-                                        **kwargs):
-                    from pprof.utils import run as r
-                    from pprof.settings import config as c
-                    from pprof.utils.db import persist_compilestats
-                    from pprof.utils.run import handle_stdin
-
-                    c.update(config)
-                    clang = handle_stdin(clang["-mllvm", "-stats"], kwargs)
-
-                    run, session, retcode, _, stderr = \
-                        r.guarded_exec(clang, project.name, experiment.name, project.run_uuid)
-
-                    if retcode == 0:
-                        stats = []
-                        for stat in get_compilestats(stderr):
-                            compile_s = CompileStat()
-                            compile_s.name = stat["desc"].rstrip()
-                            compile_s.component = stat["component"].rstrip()
-                            compile_s.value = stat["value"]
-                            stats.append(compile_s)
-                        persist_compilestats(run, session, stats)
-
                 p.run_uuid = uuid4()
-                p.compiler_extension = partial(_track_compilestats, p, self,
-                                               config)
+                p.compiler_extension = with_compile_flags(
+                    partial(collect_compilestats, p, self, config),
+                    "-mllvm", "-stats")
                 p.configure()
 
         with substep("Build Project"):
@@ -500,6 +416,11 @@ class PJITpapi(PolyJIT):
     """
 
     NAME = "pj-papi"
+    SWEEP = True
+
+    def before_projects(self):
+        """Calibrate PAPI once, before the projects run."""
+        self.calibrate_papi()
 
     def run(self):
         """Do the postprocessing, after all projects are done."""
@@ -528,21 +449,17 @@ class PJITpapi(PolyJIT):
 
         p = self.init_project(p)
         with local.env(PPROF_ENABLE=1):
-            from uuid import uuid4
-
             p.cflags = ["-mllvm", "-instrument"] + p.cflags
             p.ldflags = p.ldflags + ["-lpprof"]
 
-            for i in range(1, int(config["jobs"]) + 1):
-                with step("{} cores & uuid {}".format(i, p.run_uuid)):
-                    p.clean()
-                    p.prepare()
-                    p.download()
-                    with local.env(PPROF_ENABLE=0):
-                        p.compiler_extension = partial(collect_compilestats, p,
-                                                       self, config)
-                        p.configure()
-                        p.build()
-
-                    p.run_uuid = uuid4()
-                    p.run(partial(run_with_papi, p, self, config, i))
+            with step("build {}".format(p.name)):
+                with local.env(PPROF_ENABLE=0):
+                    p.compiler_extension = with_compile_flags(
+                        partial(collect_compilestats, p, self, config),
+                        "-mllvm", "-stats")
+                    self.build_project(p)
+            self.run_sweep(p, run_with_papi, "papi")
+
+        with step("Evaluation"):
+            pprof_calibrate, papi_calibration = self.calibrate_papi()
+            self.persist_calibration(p, pprof_calibrate, papi_calibration)
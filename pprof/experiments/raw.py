@@ -2,28 +2,40 @@
 The 'raw' Experiment.
 
 This experiment is the basic experiment in the pprof study. It simply runs
-all projects after compiling it with -O3. The binaries are wrapped
-with the time command and results are written to the database.
+all projects after compiling it with -O3. We collect the resource usage
+of the binaries (see pprof.utils.run.rusage_metrics) and write the results
+to the database.
 
 This forms the baseline numbers for the other experiments.
 
 Measurements
 ------------
 
-3 Metrics are generated during this experiment:
+11 Metrics are generated during this experiment:
     time.user_s - The time spent in user space in seconds (aka virtual time)
     time.system_s - The time spent in kernel space in seconds (aka system time)
     time.real_s - The time spent overall in seconds (aka Wall clock)
+    rusage.maxrss_kib - The maximum resident set size in KiB
+    rusage.maxrss_floor_kib - The lowest rusage.maxrss_kib we can observe:
+        the peak resident set size of the pprof process that ran the binary
+    rusage.minflt - Page faults serviced without I/O
+    rusage.majflt - Page faults that required I/O
+    rusage.nvcsw - Voluntary context switches
+    rusage.nivcsw - Involuntary context switches
+    rusage.inblock - Block input operations
+    rusage.oublock - Block output operations
 """
 
 from pprof.experiment import step, substep, RuntimeExperiment
+from pprof.utils.registry import runner
 from plumbum import local
 from os import path
 
 
+@runner
 def run_with_time(project, experiment, config, jobs, run_f, args, **kwargs):
     """
-    Run the given binary wrapped with time.
+    Run the given binary and collect its resource usage.
 
     Args:
         project: The pprof project that has called us.
@@ -31,8 +43,7 @@ def run_with_time(project, experiment, config, jobs, run_f, args, **kwargs):
         config: The pprof configuration we are running with.
         jobs: The number of cores we are allowed to use. This may differ
             from the actual amount of available cores, obey it.
-            We should enforce this from the outside. However, at the moment we
-            do not do this.
+            We pin the binary to this number of cores.
         run_f: The file we want to execute.
         args: List of arguments that should be passed to the wrapped binary.
         **kwargs: Dictionary with our keyword args. We support the following
@@ -45,27 +56,44 @@ def run_with_time(project, experiment, config, jobs, run_f, args, **kwargs):
     """
     from pprof.utils import run as r
     from pprof.settings import config as c
-    from pprof.utils.db import persist_time, persist_config
-    from plumbum.cmd import time
+    from pprof.utils.db import persist_config, persist_metrics
+    from pprof.utils.affinity import cpu_affinity, cpu_list
 
     c.update(config)
     project_name = kwargs.get("project_name", project.name)
-    timing_tag = "PPROF-TIME: "
 
-    run_cmd = time["-f", timing_tag + "%U-%S-%e", run_f]
+    if int(c["repeat_max"]) > 1:
+        r.buffer_stdin(kwargs)
+    run_cmd = local[run_f]
     run_cmd = r.handle_stdin(run_cmd[args], kwargs)
+    runs = []
 
-    with local.env(OMP_NUM_THREADS=str(jobs)):
-        run, session, _, _, stderr = \
+    def measure():
+        """ Take a single timing sample. """
+        usage = {}
+        run, session, _, _, _ = \
             r.guarded_exec(run_cmd, project_name, experiment.name,
-                           project.run_uuid)
-        timings = r.fetch_time_output(
-            timing_tag, timing_tag + "{:g}-{:g}-{:g}", stderr.split("\n"))
-        if len(timings) == 0:
-            return
+                           project.run_uuid, usage=usage)
 
-    persist_time(run, session, timings)
-    persist_config(run, session, {"cores": str(jobs)})
+        persist_metrics(run, session, usage)
+        persist_config(run, session, {"cores": str(jobs),
+                                      "cpuset": cpu_list(cpus),
+                                      "repetition": str(len(runs))})
+        runs.append((run, session))
+        return usage["time.real_s"]
+
+    with local.env(OMP_NUM_THREADS=str(jobs)), cpu_affinity(jobs) as cpus:
+        samples = r.repeat_until_stable(measure)
+
+    if len(samples) > 1:
+        stats = r.sample_statistics(samples)
+        run, session = runs[-1]
+        persist_metrics(run, session, {
+            "time.real_s.samples": len(samples),
+            "time.real_s.mean": stats["mean"],
+            "time.real_s.stddev": stats["stddev"],
+            "time.real_s.ci": stats["ci"]
+        })
 
 
 class RawRuntime(RuntimeExperiment):
@@ -83,8 +111,6 @@ class RawRuntime(RuntimeExperiment):
             p.ldflags = ["-L" + llvm_libs]
             p.cflags = ["-O3", "-fno-omit-frame-pointer"]
             with substep("reconf & rebuild"):
-                p.download()
-                p.configure()
-                p.build()
+                self.build_project(p)
             with substep("run {}".format(p.name)):
                 p.run(partial(run_with_time, p, self, config, config["jobs"]))
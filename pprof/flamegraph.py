@@ -0,0 +1,62 @@
+#!/usr/bin/env python3
+""" Render flamegraphs from the call stacks in the PPROF database. """
+
+from plumbum import cli
+from pprof.driver import PollyProfiling
+
+
+@PollyProfiling.subcommand("flamegraph")
+class PprofFlamegraph(cli.Application):
+    """ Render the flamegraph of runs, recorded with perf (e.g., pj-perf). """
+
+    _outdir = "."
+    _folded = False
+
+    @cli.switch(["-o", "--outdir"],
+                str,
+                help="Directory we write the flamegraphs to.")
+    def outdir(self, outdir):
+        """ Set the output directory. """
+        self._outdir = outdir
+
+    @cli.switch(["--folded"],
+                help="Write the folded call stacks instead of an SVG.")
+    def folded(self):
+        """ Write the folded call stacks, as stackcollapse-perf.pl does. """
+        self._folded = True
+
+    def main(self, *run_ids):
+        """ Run the flamegraph command. """
+        from os import path
+        from pprof.perf import folded_lines, render_flamegraph
+        from pprof.utils.db import load_perf
+        from pprof.utils import schema as s
+
+        if not run_ids:
+            print("No run ids given.")
+            return 1
+
+        session = s.Session()
+        for run_id in run_ids:
+            run = session.query(s.Run).filter(s.Run.id == int(run_id)).first()
+            if run is None:
+                print("{}: no such run.".format(run_id))
+                continue
+
+            folded = load_perf(session, run.id)
+            if folded is None:
+                print("{}: no call stacks recorded.".format(run_id))
+                continue
+
+            if self._folded:
+                out_f = path.join(self._outdir, "{}.folded".format(run_id))
+                content = "\n".join(folded_lines(folded)) + "\n"
+            else:
+                out_f = path.join(self._outdir, "{}.svg".format(run_id))
+                content = render_flamegraph(
+                    folded, title="{} @ {} - {}".format(
+                        run.project_name, run.experiment_name, run.command))
+            with open(out_f, 'w') as out:
+                out.write(content)
+            print("{}: {}".format(run_id, out_f))
+        session.close()
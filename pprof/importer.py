@@ -0,0 +1,23 @@
+#!/usr/bin/env python3
+""" Import offline result spools into the PPROF database. """
+
+from plumbum import cli
+from pprof.driver import PollyProfiling
+
+
+@PollyProfiling.subcommand("import")
+class PprofImport(cli.Application):
+    """ Import result spools, written with PPROF_SPOOL_DIR, into the db. """
+
+    def main(self, *spools):
+        """ Run the import command. """
+        from pprof.utils.spool import import_spool
+
+        if not spools:
+            print("No spool files given.")
+            return 1
+
+        for spool in spools:
+            imported, skipped = import_spool(spool)
+            print("{}: {} runs imported, {} runs skipped.".format(
+                spool, imported, skipped))
@@ -2,153 +2,260 @@
 Likwid helper functions.
 
 Extract information from likwid's CSV output.
+
+The output of ``likwid-perfctr -O -m`` consists of STRUCT and TABLE blocks.
+A STRUCT block of a region names the region and holds the region info (run
+time, call count) per core. The TABLE blocks that follow hold the raw event
+counts ('Event' tables, with an extra 'Counter' column) and the derived
+metrics ('Metric' tables) of a group, per core. The STAT variants of both
+tables hold Sum/Min/Max/Avg columns instead of cores, we store them like
+cores.
+
+We read the output line by line and yield column-oriented batches of a
+bounded size, the output never has to fit into memory.
 """
+from collections import namedtuple
+
+# A batch of measurements, as numpy arrays of equal length. group holds the
+# name of the likwid group of every measurement ('' for the region info).
+LikwidBatch = namedtuple("LikwidBatch",
+                         ["group", "region", "metric", "core", "value"])
 
+# Rows of a region STRUCT that do not hold measurements.
+REGION_INFO_KEYS = ["1", "Region Info", "Event", "Metric", "CPU clock"]
 
-def fetch_cols(fstream, split_char=','):
+
+def table_group(name):
     """
-    Fetch columns from likwid's output stream.
+    Get the group name from the name of a TABLE block.
 
     Args:
-        fstream: The filestream with likwid's output.
-        split_car (str): The character we split on, default ','
+        name (str): The name of the table, e.g., 'Group 1 Metric STAT'.
 
-    Returns (list(str)):
-        A list containing the elements of fstream, after splitting at
-        split_char.
+    Returns (str):
+        The group name, e.g., 'Group 1'.
     """
-    return fstream.readline().strip().split(split_char)
+    for suffix in [" STAT", " Raw", " Metric"]:
+        if name.endswith(suffix):
+            name = name[:-len(suffix)]
+    return name
 
 
-def read_struct(fstream):
+def to_values(cells):
     """
-    Read a likwid struct from the text stream.
+    Convert likwid's cells to floats.
 
     Args:
-        fstream: Likwid's filestream.
+        cells (list(str)): The cells.
 
-    Returns (dict(str: str)):
-        A dict containing all likwid's struct info as key/value pairs.
+    Returns (tuple(numpy.ndarray, numpy.ndarray)):
+        The values and a mask of the cells that hold a number.
     """
-    line = fstream.readline().strip()
-    fragments = line.split(",")
-    fragments = [x for x in fragments if x is not None]
-    partition = dict()
-    if not len(fragments) >= 3:
-        return None
-
-    partition["struct"] = fragments[0]
-    partition["info"] = fragments[1]
-    partition["num_lines"] = fragments[2]
-
-    struct = None
-    if partition is not None and partition["struct"] == "STRUCT":
-        num_lines = int(partition["num_lines"].strip())
-        struct = {}
-        for _ in range(num_lines):
-            cols = fetch_cols(fstream)
-            struct.update({cols[0]: cols[1:]})
-    return struct
-
-
-def read_table(fstream):
+    import numpy as np
+
+    filled = np.array(cells, dtype=str)
+    filled[filled == ""] = "nan"
+    try:
+        values = filled.astype(np.float64)
+    except ValueError:
+        def to_float(cell):
+            """ Convert a single cell, everything else is not a number. """
+            try:
+                return float(cell)
+            except ValueError:
+                return float("nan")
+        values = np.array([to_float(cell) for cell in cells],
+                          dtype=np.float64)
+    return (values, ~np.isnan(values))
+
+
+class BatchBuilder(object):
+    """ Collect the cells of likwid's blocks into column batches. """
+
+    def __init__(self):
+        self.groups = []
+        self.regions = []
+        self.metrics = []
+        self.cores = []
+        self.cells = []
+
+    def __len__(self):
+        return len(self.cells)
+
+    def add_block(self, group, region, cores, rows, offset):
+        """
+        Add the rows of a block.
+
+        Args:
+            group (str): The group of the block.
+            region (str): The region the block belongs to.
+            cores (list(str)): The names of the value columns.
+            rows (list(list(str))): The rows of the block, the first column
+                holds the name of the metric.
+            offset (int): Number of columns between the name and the values.
+        """
+        columns = [i for i, core in enumerate(cores) if core]
+        core_names = [cores[i] for i in columns]
+        width = len(cores)
+        for row in rows:
+            values = row[1 + offset:1 + offset + width]
+            values += [""] * (width - len(values))
+            self.cells += [values[i] for i in columns]
+            self.metrics += [row[0]] * len(columns)
+            self.cores += core_names
+        num = len(rows) * len(columns)
+        self.groups += [group] * num
+        self.regions += [region] * num
+
+    def build(self):
+        """
+        Convert the collected cells to a batch and start a new one.
+
+        Returns (LikwidBatch):
+            All collected measurements that hold a number.
+        """
+        import numpy as np
+
+        values, mask = to_values(self.cells)
+        batch = LikwidBatch(*[np.array(column, dtype=object)[mask]
+                              for column in [self.groups, self.regions,
+                                             self.metrics, self.cores]] +
+                            [values[mask]])
+        self.__init__()
+        return batch
+
+
+def read_blocks(lines):
     """
-    Read a likwid table info from the text stream.
+    Split likwid's output into its blocks.
 
     Args:
-        fstream: Likwid's filestream.
+        lines: An iterable over the lines of likwid's output.
 
-    Returns (dict(str: str)):
-        A dict containing likwid's table info as key/value pairs.
+    Returns:
+        A generator over all blocks as (kind, name, rows), where kind is
+        'STRUCT' or 'TABLE' and rows holds the split lines of the block. The
+        header of a TABLE is its first row.
     """
-    pos = fstream.tell()
-    line = fstream.readline().strip()
-    fragments = line.split(",")
-    fragments = [x for x in fragments if x is not None]
-    partition = dict()
-    if not len(fragments) >= 4:
-        return None
-
-    partition["table"] = fragments[0]
-    partition["group"] = fragments[1]
-    partition["set"] = fragments[2]
-    partition["num_lines"] = fragments[3]
-
-    struct = None
-    if partition is not None and partition["table"] == "TABLE":
-        num_lines = int(partition["num_lines"].strip())
-        struct = {}
-        header = fetch_cols(fstream)
-
-        struct.update({header[0]: header[1:]})
+    lines = iter(lines)
+    for line in lines:
+        fragments = line.strip().split(",")
+        if fragments[0] == "STRUCT" and len(fragments) >= 3:
+            num_lines = int(fragments[2].strip())
+        elif fragments[0] == "TABLE" and len(fragments) >= 4:
+            num_lines = int(fragments[3].strip()) + 1
+        else:
+            continue
+
+        rows = []
         for _ in range(num_lines):
-            cols = fetch_cols(fstream)
-            struct.update({cols[0]: cols[1:]})
-    else:
-        fstream.seek(pos)
+            row = next(lines, None)
+            if row is None:
+                break
+            rows.append(row.strip().split(","))
+        name = fragments[2] if fragments[0] == "TABLE" else fragments[1]
+        yield (fragments[0], name, rows)
 
-    return struct
 
-
-def read_structs(fstream):
+def read_likwid_batches(lines, batch_size=65536):
     """
-    Read all structs from likwid's file stream.
+    Parse likwid's output into batches of measurements.
 
     Args:
-        fstream: Likwid's output file stream.
+        lines: An iterable over the lines of likwid's output, e.g., the
+            opened output file.
+        batch_size (int): Number of cells we collect, before we convert them
+            to a batch. Blocks are never split between batches.
 
     Returns:
-        A generator that can be used to iterate over all structs in the fstream.
+        A generator over LikwidBatches.
     """
-    struct = read_struct(fstream)
-    while struct is not None:
-        yield struct
-        struct = read_struct(fstream)
-
-
-def read_tables(fstream):
+    builder = BatchBuilder()
+    region = None
+    for kind, name, rows in read_blocks(lines):
+        if not rows:
+            continue
+        if kind == "STRUCT":
+            struct = {row[0]: row[1:] for row in rows}
+            if "Region Info" not in struct:
+                # The info struct about the machine.
+                continue
+            region = ([name] + struct.get("1", [])[:2])[-1]
+            data = [row for row in rows if row[0] not in REGION_INFO_KEYS]
+            builder.add_block("", region, struct["Region Info"], data, 0)
+        elif region is not None:
+            header = rows[0]
+            offset = 1 if header[0] == "Event" else 0
+            data = [row for row in rows[1:]
+                    if row[0] not in REGION_INFO_KEYS]
+            builder.add_block(table_group(name), region, header[1 + offset:],
+                              data, offset)
+
+        if len(builder) >= batch_size:
+            yield builder.build()
+    if len(builder):
+        yield builder.build()
+
+
+def name_groups(batches, groups):
     """
-    Read all tables from likwid's file stream.
+    Name the measurements of a multiplexed likwid run after their groups.
+
+    likwid numbers the groups of a multi-group run ('Group 1', ...) in the
+    order of the '-g' options. We replace the numbers with the group names
+    and prefix the metrics of every group with the group name, e.g.,
+    'MEM:Memory bandwidth [MBytes/s]'. Events that every group measures,
+    like the fixed counters, stay apart this way. Measurements that occur
+    more than once, e.g., the region info of every group, are kept once.
 
     Args:
-        fstream: Likwid's output file stream.
+        batches: The batches of a multiplexed run, see read_likwid_batches.
+        groups (list(str)): The groups, in the order of the '-g' options.
 
     Returns:
-        A generator that can be used to iterate over all tables in the fstream.
+        A generator over the renamed LikwidBatches.
     """
-    table = read_table(fstream)
-    while table is not None:
-        yield table
-        table = read_table(fstream)
-
-
-def get_measurements(region, core_info, data, extra_offset=0):
+    import numpy as np
+
+    names = {"Group {:d}".format(i + 1): group
+             for i, group in enumerate(groups)}
+    seen = set()
+    for batch in batches:
+        group = np.array([names.get(g, g) for g in batch.group.tolist()],
+                         dtype=object)
+        metric = np.array([g + ":" + m if g else m
+                           for g, m in zip(group.tolist(),
+                                           batch.metric.tolist())],
+                          dtype=object)
+        keep = []
+        for key in zip(batch.region.tolist(), metric.tolist(),
+                       batch.core.tolist()):
+            keep.append(key not in seen)
+            seen.add(key)
+        keep = np.array(keep, dtype=bool)
+        yield LikwidBatch(group[keep], batch.region[keep], metric[keep],
+                          batch.core[keep], batch.value[keep])
+
+
+def merge_regions(rows):
     """
-    Get the complete measurement info from likwid's region info.
+    Merge likwid measurements of several groups into one view per region.
 
     Args:
-        region: The region we took a measurement in.
-        core_info: The core information.
-        data: The raw data.
-        extra_offset (int): default = 0
+        rows: An iterable over (group, region, metric, core, value). The
+            metrics of multiplexed runs carry their group already (see
+            name_groups).
 
-    Returns (list((region, metric, core, value))):
-        A list of measurement tuples, a tuple contains the information about
-        the region, the metric, the core and the actual value.
+    Returns (dict(str, dict(str, dict(str, float)))):
+        Maps every region to its metrics, as 'GROUP:metric', and every
+        metric to its value per core.
     """
-    measurements = []
-    clean_core_info = [x for x in core_info if x]
-    cores = len(clean_core_info)
-    for k in data:
-        if k not in ["1", "Region Info", "Event", "Metric", "CPU clock"]:
-            slot = data[k]
-            for i in range(cores):
-                core = core_info[i]
-                idx = extra_offset + i
-                if core and slot[idx]:
-                    measurements.append((region, k, core, slot[idx]))
-
-    return measurements
+    view = {}
+    for group, region, metric, core, value in rows:
+        if group and not metric.startswith(group + ":"):
+            metric = group + ":" + metric
+        view.setdefault(region, {}).setdefault(metric, {})[core] = value
+    return view
 
 
 def get_likwid_perfctr(infile):
@@ -156,29 +263,16 @@ def get_likwid_perfctr(infile):
     Get a complete list of all measurements.
 
     Args:
-        infile: The filestream containing all likwid output.
+        infile: The file containing all likwid output.
 
-    Returns:
-        A list of all measurements extracted from likwid's file stream.
+    Returns (list((region, metric, core, value))):
+        A list of all measurements extracted from likwid's output.
     """
     measurements = []
     with open(infile, 'r') as in_file:
-        read_struct(in_file)
-        for region_struct in read_structs(in_file):
-            region = region_struct["1"][1]
-            core_info = region_struct["Region Info"]
-            measurements += \
-                get_measurements(region, core_info, region_struct)
-
-            for table_struct in read_tables(in_file):
-                core_info = None
-                if "Event" in table_struct:
-                    offset = 1
-                    core_info = table_struct["Event"][offset:]
-                    measurements += get_measurements(region, core_info,
-                                                     table_struct, offset)
-                elif "Metric" in table_struct:
-                    core_info = table_struct["Metric"]
-                    measurements += get_measurements(region, core_info,
-                                                     table_struct)
+        for batch in read_likwid_batches(in_file):
+            measurements += list(zip(batch.region.tolist(),
+                                     batch.metric.tolist(),
+                                     batch.core.tolist(),
+                                     batch.value.tolist()))
     return measurements
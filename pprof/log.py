@@ -20,6 +20,7 @@ def print_runs(query):
 def print_logs(query, types=None):
     """ Print status logs. """
     from pprof.utils.schema import RunLog
+    from pprof.utils.db import load_log_blob
 
     if query is None:
         return
@@ -28,15 +29,17 @@ def print_logs(query, types=None):
 
     for run, log in query:
         print(("{} @ {} - {} id: {} group: {} status: {}".format(
-            run.finished, run.experiment_name, run.project_name,
+            run.end, run.experiment_name, run.project_name,
             run.experiment_group, run.run_group, log.status)))
         print(("command: {}".format(run.command)))
         if "stderr" in types:
             print("StdErr:")
-            print((log.stderr))
+            print((load_log_blob(query.session, run.id, "stderr") or
+                   log.stderr))
         if "stdout" in types:
             print("StdOut:")
-            print((log.stdout))
+            print((load_log_blob(query.session, run.id, "stdout") or
+                   log.stdout))
         print()
 
 
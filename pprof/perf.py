@@ -0,0 +1,437 @@
+"""
+Linux perf helper functions.
+
+Fold the call stacks of ``perf script`` into counted stacks, store them
+compactly and render them as flamegraph on demand.
+
+A folded profile maps a call stack (a tuple of frames, root first) to the
+number of samples that hit it. The first frame of every stack is the name of
+the command, like stackcollapse-perf.pl does it.
+"""
+import re
+
+HEADER_PATTERN = re.compile(r"^(\S.*?)\s+(\d+)(?:/\d+)?\s")
+
+
+def parse_frame(line):
+    """
+    Get the function name of a stack frame in the output of perf script.
+
+    Args:
+        line (str): A frame, e.g., '    4005d6 main+0x26 (/tmp/a.out)'.
+
+    Returns (str):
+        The function name, without offset. Unknown symbols are named after
+        their shared object, e.g., '[libc-2.21.so]'.
+    """
+    from os import path
+
+    fragments = line.strip().split(None, 1)
+    if len(fragments) < 2:
+        return "[unknown]"
+
+    symbol = fragments[1]
+    dso = ""
+    if symbol.endswith(")") and " (" in symbol:
+        symbol, dso = symbol.rsplit(" (", 1)
+        dso = dso[:-1]
+    if "+0x" in symbol:
+        symbol = symbol[:symbol.rindex("+0x")]
+    if symbol == "[unknown]" and dso and dso != "[unknown]":
+        symbol = "[{}]".format(path.basename(dso))
+    return symbol.replace(";", ":")
+
+
+def fold_stacks(lines):
+    """
+    Fold the call stacks in the output of perf script.
+
+    The lines are consumed one by one, the output of perf script never has
+    to fit into memory.
+
+    Args:
+        lines: An iterable over the lines of ``perf script``.
+
+    Returns (dict(tuple(str), int)):
+        The folded profile.
+    """
+    folded = {}
+    comm = None
+    frames = []
+
+    def flush():
+        """ Count the stack of the current sample. """
+        if comm is not None:
+            stack = tuple([comm] + list(reversed(frames)))
+            folded[stack] = folded.get(stack, 0) + 1
+
+    for line in lines:
+        if not line.strip():
+            flush()
+            comm = None
+            frames = []
+        elif line[0] in " \t":
+            if comm is not None:
+                frames.append(parse_frame(line))
+        elif not line.startswith("#"):
+            flush()
+            match = HEADER_PATTERN.match(line)
+            comm = match.group(1).replace(" ", "_") if match else None
+            frames = []
+    flush()
+    return folded
+
+
+def perf_script_folded(perf_data):
+    """
+    Fold the call stacks of a perf recording.
+
+    Args:
+        perf_data (str): The file perf record wrote.
+
+    Returns (dict(tuple(str), int)):
+        The folded profile.
+    """
+    from subprocess import PIPE
+    from io import TextIOWrapper
+    from plumbum.cmd import perf  # pylint: disable=E0401
+
+    proc = perf["script", "-i", perf_data].popen(stdout=PIPE)
+    folded = fold_stacks(TextIOWrapper(proc.stdout, errors="replace"))
+    proc.wait()
+    return folded
+
+
+def encode_folded(folded):
+    """
+    Encode a folded profile compactly.
+
+    Every frame name is stored once, stacks refer to frames by their index.
+
+    Args:
+        folded (dict(tuple(str), int)): The folded profile.
+
+    Returns (bytes):
+        The profile as JSON document.
+    """
+    import json
+
+    frames = {}
+    stacks = []
+    for stack in sorted(folded):
+        stacks.append([[frames.setdefault(frame, len(frames))
+                        for frame in stack], folded[stack]])
+    names = sorted(frames, key=frames.get)
+    return json.dumps({"frames": names, "stacks": stacks},
+                      separators=(',', ':')).encode("utf-8")
+
+
+def decode_folded(data):
+    """
+    Decode a folded profile, written by encode_folded.
+
+    Args:
+        data (bytes): The encoded profile.
+
+    Returns (dict(tuple(str), int)):
+        The folded profile.
+    """
+    import json
+
+    doc = json.loads(data.decode("utf-8"))
+    frames = doc["frames"]
+    return {tuple([frames[i] for i in stack]): count
+            for stack, count in doc["stacks"]}
+
+
+def folded_lines(folded):
+    """
+    Format a folded profile in the text format of the FlameGraph tools.
+
+    Args:
+        folded (dict(tuple(str), int)): The folded profile.
+
+    Returns (list(str)):
+        One line per stack, e.g., 'a.out;main;foo 42'.
+    """
+    return ["{} {:d}".format(";".join(stack), folded[stack])
+            for stack in sorted(folded)]
+
+
+def build_tree(folded):
+    """
+    Merge the stacks of a folded profile into a call tree.
+
+    Args:
+        folded (dict(tuple(str), int)): The folded profile.
+
+    Returns (dict):
+        The root of the tree. Every node has the number of samples that hit
+        it or its callees ('value') and its callees ('children').
+    """
+    root = {"value": 0, "children": {}}
+    for stack, count in folded.items():
+        root["value"] += count
+        node = root
+        for frame in stack:
+            node = node["children"].setdefault(
+                frame, {"value": 0, "children": {}})
+            node["value"] += count
+    return root
+
+
+def frame_color(name):
+    """ Pick a stable, warm color for a frame. """
+    from zlib import crc32
+
+    seed = crc32(name.encode("utf-8"))
+    return "rgb({:d},{:d},{:d})".format(205 + seed % 50, (seed >> 8) % 230,
+                                        (seed >> 16) % 55)
+
+
+def render_flamegraph(folded, title="Flame Graph", width=1200,
+                      frame_height=16, min_width=0.1, colors=None):
+    """
+    Render a folded profile as flamegraph.
+
+    Args:
+        folded (dict(tuple(str), int)): The folded profile.
+        title (str): The title of the image.
+        width (int): The width of the image in pixels.
+        frame_height (int): The height of a single frame in pixels.
+        min_width (float): Frames narrower than this (in pixels) are omitted.
+        colors (callable): Maps the stack of a frame (a tuple of frames) to
+            its fill color. Defaults to a color derived from the name.
+
+    Returns (str):
+        The flamegraph as SVG document.
+    """
+    from xml.sax.saxutils import escape
+
+    root = build_tree(folded)
+    total = max(1, root["value"])
+    scale = (width - 20.0) / total
+
+    rects = []
+
+    def layout(node, stack, x_pos, depth):
+        """ Place the callees of :node:, from left to right. """
+        for name in sorted(node["children"]):
+            child = node["children"][name]
+            child_width = child["value"] * scale
+            if child_width >= min_width:
+                rects.append((stack + (name, ), child["value"], x_pos, depth,
+                              child_width))
+                layout(child, stack + (name, ), x_pos, depth + 1)
+            x_pos += child_width
+
+    layout(root, (), 10.0, 0)
+    depth = max([rect[3] for rect in rects] + [0]) + 1
+    height = (depth + 3) * frame_height
+
+    lines = ['<?xml version="1.0" standalone="no"?>',
+             '<svg version="1.1" width="{:d}" height="{:d}" '
+             'xmlns="http://www.w3.org/2000/svg">'.format(width, height),
+             '<style>text {{ font-family: Verdana; font-size: {:d}px; }}'
+             '</style>'.format(frame_height - 4),
+             '<text x="{:.1f}" y="{:d}" text-anchor="middle">{}</text>'.format(
+                 width / 2.0, frame_height, escape(title))]
+    for stack, value, x_pos, level, rect_width in rects:
+        name = stack[-1]
+        y_pos = height - (level + 2) * frame_height
+        fill = colors(stack) if colors is not None else frame_color(name)
+        label = escape(name[:max(0, int(rect_width / 7) - 2)])
+        if len(label) < len(escape(name)) and len(label) > 2:
+            label = label[:-2] + ".."
+        lines.append(
+            '<g><title>{} ({:d} samples, {:.2f}%)</title>'
+            '<rect x="{:.1f}" y="{:d}" width="{:.1f}" height="{:d}" '
+            'fill="{}" rx="2" ry="2"/>'
+            '<text x="{:.1f}" y="{:d}">{}</text></g>'.format(
+                escape(name), value, 100.0 * value / total, x_pos, y_pos,
+                rect_width, frame_height - 1, fill, x_pos + 3,
+                y_pos + frame_height - 4, label if rect_width > 21 else ""))
+    lines.append('</svg>')
+    return "\n".join(lines)
+
+
+def merge_folded(profiles):
+    """
+    Add up the samples of several folded profiles.
+
+    Args:
+        profiles (list(dict(tuple(str), int))): The folded profiles.
+
+    Returns (dict(tuple(str), int)):
+        The merged profile.
+    """
+    merged = {}
+    for folded in profiles:
+        for stack, count in folded.items():
+            merged[stack] = merged.get(stack, 0) + count
+    return merged
+
+
+def frame_shares(profiles):
+    """
+    Compute the inclusive and the self share of every frame.
+
+    The profiles are aligned on the union of their stacks. The aggregation
+    runs vectorized over all profiles at once: every (stack, frame) pair
+    contributes the samples of its stack to the frame. A recursive frame
+    counts only once per stack.
+
+    Args:
+        profiles (list(dict(tuple(str), int))): The folded profiles.
+
+    Returns (tuple(list(str), numpy.ndarray, numpy.ndarray)):
+        The names of all frames and their inclusive and self shares, as
+        arrays of shape (len(profiles), len(names)). A share is the fraction
+        of the samples of a profile.
+    """
+    import numpy as np
+
+    stacks = sorted(set().union(*[set(folded) for folded in profiles]))
+    counts = np.array([[folded.get(stack, 0) for stack in stacks]
+                       for folded in profiles], dtype=np.float64)
+    counts = counts.reshape(len(profiles), len(stacks))
+
+    frames = {}
+    stack_ids = []
+    frame_ids = []
+    leaf_ids = []
+    for i, stack in enumerate(stacks):
+        ids = set([frames.setdefault(frame, len(frames)) for frame in stack])
+        stack_ids += [i] * len(ids)
+        frame_ids += sorted(ids)
+        leaf_ids.append(frames[stack[-1]])
+    names = sorted(frames, key=frames.get)
+
+    inclusive = np.zeros((len(profiles), len(names)))
+    exclusive = np.zeros((len(profiles), len(names)))
+    np.add.at(inclusive.T, np.array(frame_ids, dtype=np.intp),
+              counts[:, np.array(stack_ids, dtype=np.intp)].T)
+    np.add.at(exclusive.T, np.array(leaf_ids, dtype=np.intp), counts.T)
+
+    totals = counts.sum(axis=1)
+    totals[totals == 0] = 1
+    return (names, inclusive / totals[:, None], exclusive / totals[:, None])
+
+
+def rank_frames(profile_a, profile_b, key="inclusive", limit=20):
+    """
+    Rank the frames whose share changed most between two profiles.
+
+    Args:
+        profile_a (dict(tuple(str), int)): The baseline profile.
+        profile_b (dict(tuple(str), int)): The profile we compare.
+        key (str): Rank by the change of the 'inclusive' or the 'self' share.
+        limit (int): Number of frames we report.
+
+    Returns (list(tuple(str, float, float, float, float))):
+        The frame, its inclusive share in both profiles and its self share
+        in both profiles, ordered by the absolute change.
+    """
+    import numpy as np
+
+    names, inclusive, exclusive = frame_shares([profile_a, profile_b])
+    shares = inclusive if key == "inclusive" else exclusive
+    order = np.argsort(-np.abs(shares[1] - shares[0]), kind="mergesort")
+    return [(names[i], float(inclusive[0, i]), float(inclusive[1, i]),
+             float(exclusive[0, i]), float(exclusive[1, i]))
+            for i in order[:limit]]
+
+
+def prefix_shares(folded):
+    """
+    Compute the inclusive share of every stack prefix of a profile.
+
+    Args:
+        folded (dict(tuple(str), int)): The folded profile.
+
+    Returns (dict(tuple(str), float)):
+        Maps every prefix to the fraction of samples that contain it.
+    """
+    total = float(max(1, sum(folded.values())))
+    shares = {}
+    for stack, count in folded.items():
+        for depth in range(1, len(stack) + 1):
+            prefix = stack[:depth]
+            shares[prefix] = shares.get(prefix, 0.0) + count / total
+    return shares
+
+
+def render_diff_flamegraph(profile_a, profile_b,
+                           title="Differential Flame Graph"):
+    """
+    Render a differential flamegraph.
+
+    The frames are laid out like the flamegraph of :profile_b:. A frame is
+    red, if its share grew compared to :profile_a:, blue, if it shrank. The
+    saturation shows the size of the change.
+
+    Args:
+        profile_a (dict(tuple(str), int)): The baseline profile.
+        profile_b (dict(tuple(str), int)): The profile we compare.
+        title (str): The title of the image.
+
+    Returns (str):
+        The flamegraph as SVG document.
+    """
+    shares_a = prefix_shares(profile_a)
+    shares_b = prefix_shares(profile_b)
+    largest = max([abs(shares_b[p] - shares_a.get(p, 0.0))
+                   for p in shares_b] + [1e-9])
+
+    def color(stack):
+        """ Color a frame by the change of its share. """
+        delta = shares_b.get(stack, 0.0) - shares_a.get(stack, 0.0)
+        fade = int(210 * (1.0 - min(1.0, abs(delta) / largest)))
+        if delta > 0:
+            return "rgb(255,{:d},{:d})".format(fade, fade)
+        return "rgb({:d},{:d},255)".format(fade, fade)
+
+    return render_flamegraph(profile_b, title=title, colors=color)
+
+
+def read_perf_stat(lines, separator=","):
+    """
+    Parse the CSV output of ``perf stat -x,``.
+
+    Every line holds a single counter: the value, its unit, the event, the
+    time the counter was enabled, the percentage of that time it was
+    actually running and, optionally, a derived metric. If perf had to
+    multiplex the counters, the value is already scaled up to the full run
+    time; the running share tells how much of it was measured.
+
+    Args:
+        lines: An iterable over the lines of the output.
+        separator (str): The separator we passed to perf stat.
+
+    Returns:
+        A generator over (event, value, unit, running) for every counter
+        that was counted. running is the share of the run time (0..1) the
+        counter was measured, or None, if perf did not report it.
+    """
+    for line in lines:
+        line = line.strip()
+        if not line or line.startswith("#"):
+            continue
+        fields = line.split(separator)
+        if len(fields) < 3 or fields[0].startswith("<"):
+            # <not counted> or <not supported>
+            continue
+        try:
+            value = float(fields[0])
+        except ValueError:
+            continue
+
+        running = None
+        if len(fields) > 4:
+            try:
+                running = float(fields[4]) / 100.0
+            except ValueError:
+                running = None
+        if running == 0.0:
+            continue
+        yield (fields[2], value, fields[1], running)
@@ -0,0 +1,116 @@
+#!/usr/bin/env python3
+""" Compare the perf profiles of a project in two experiments. """
+
+from plumbum import cli
+from pprof.driver import PollyProfiling
+
+
+def load_profiles(session, experiment_id, project_name):
+    """
+    Load the folded call stacks of a project in an experiment.
+
+    Args:
+        session: The db transaction we belong to.
+        experiment_id (str): The experiment UUID.
+        project_name (str): The name of the project.
+
+    Returns (dict(str, dict(tuple(str), int))):
+        Maps the core count of the runs (the 'cores' config, or None) to
+        the merged call stacks of all runs with this core count.
+    """
+    from sqlalchemy import and_
+    from pprof.perf import merge_folded
+    from pprof.utils.db import load_perf
+    from pprof.utils import schema as s
+
+    query = session.query(s.Run.id, s.Config.value) \
+        .join(s.Metadata, s.Metadata.run_id == s.Run.id) \
+        .outerjoin(s.Config, and_(s.Config.run_id == s.Run.id,
+                                  s.Config.name == "cores")) \
+        .filter(s.Run.experiment_group == experiment_id) \
+        .filter(s.Run.project_name == project_name) \
+        .filter(s.Metadata.name == "perf.folded")
+
+    profiles = {}
+    for run_id, cores in query:
+        profiles.setdefault(cores, []).append(load_perf(session, run_id))
+    return {cores: merge_folded(profiles[cores]) for cores in profiles}
+
+
+def print_ranking(ranking, key):
+    """ Print a ranking of frames, see pprof.perf.rank_frames. """
+    print("{:>9} {:>9} {:>9} {:>9}  {}".format(
+        "incl. A", "incl. B", "self A", "self B", "frame"))
+    for name, incl_a, incl_b, self_a, self_b in ranking:
+        print("{:8.2f}% {:8.2f}% {:8.2f}% {:8.2f}%  {}".format(
+            100 * incl_a, 100 * incl_b, 100 * self_a, 100 * self_b, name))
+    print("(ranked by the change of the {} share)".format(key))
+
+
+@PollyProfiling.subcommand("perfdiff")
+class PprofPerfDiff(cli.Application):
+    """ Compare the perf profiles (e.g., pj-perf) of two experiments. """
+
+    _outdir = "."
+    _key = "inclusive"
+    _limit = 20
+
+    @cli.switch(["-o", "--outdir"],
+                str,
+                help="Directory we write the differential flamegraphs to.")
+    def outdir(self, outdir):
+        """ Set the output directory. """
+        self._outdir = outdir
+
+    @cli.switch(["-s", "--sort"],
+                cli.Set("inclusive", "self"),
+                help="Rank frames by the change of their inclusive or self "
+                     "share.")
+    def sort(self, key):
+        """ Set the share we rank by. """
+        self._key = key
+
+    @cli.switch(["-n", "--limit"],
+                int,
+                help="Number of frames we report.")
+    def limit(self, limit):
+        """ Set the number of frames we report. """
+        self._limit = limit
+
+    def main(self, experiment_a, experiment_b, project):
+        """ Run the perfdiff command. """
+        from os import path
+        from pprof.perf import (merge_folded, rank_frames,
+                                render_diff_flamegraph)
+        from pprof.utils import schema as s
+
+        session = s.Session()
+        profiles_a = load_profiles(session, experiment_a, project)
+        profiles_b = load_profiles(session, experiment_b, project)
+        session.close()
+        if not profiles_a or not profiles_b:
+            print("No call stacks recorded for {} in both experiments.".format(
+                project))
+            return 1
+
+        pairs = [("all", merge_folded(list(profiles_a.values())),
+                  merge_folded(list(profiles_b.values())))]
+        pairs += [(cores, profiles_a[cores], profiles_b[cores])
+                  for cores in sorted(set(profiles_a) & set(profiles_b),
+                                      key=str)
+                  if len(profiles_a) > 1 or len(profiles_b) > 1]
+
+        for cores, profile_a, profile_b in pairs:
+            print("{} - cores: {}".format(project, cores))
+            print_ranking(rank_frames(profile_a, profile_b, self._key,
+                                      self._limit), self._key)
+
+            svg_f = path.join(self._outdir, "{}-{}.diff.svg".format(project,
+                                                                     cores))
+            with open(svg_f, 'w') as svg:
+                svg.write(render_diff_flamegraph(
+                    profile_a, profile_b,
+                    title="{}: {} vs. {} (cores: {})".format(
+                        project, experiment_a, experiment_b, cores)))
+            print(svg_f)
+            print()
@@ -3,6 +3,7 @@ Project handling for the pprof study.
 """
 from os import path, listdir
 from abc import abstractmethod
+from collections import namedtuple
 from plumbum import local
 from plumbum.cmd import mv, chmod, rm, mkdir, rmdir  # pylint: disable=E0401
 from pprof.settings import config
@@ -11,6 +12,11 @@ from pprof.utils.db import persist_project
 PROJECT_BIN_F_EXT = ".bin"
 PROJECT_BLOB_F_EXT = ".postproc"
 
+# A single execution of a binary, see Project.run_batch.
+# binary: The file we execute, args: The list of arguments,
+# stdin: A file we feed into stdin, or None.
+Invocation = namedtuple("Invocation", ["binary", "args", "stdin"])
+
 
 class ProjectRegistry(type):
     """Registry for pprof projects."""
@@ -103,7 +109,61 @@ class Project(object, metaclass=ProjectRegistry):
         with local.cwd(self.builddir):
             run(exp)
 
-    def run(self, experiment):
+    def run_batch(self, experiment, invocations, parallel=1,
+                  keep_going=False):
+        """
+        Run many invocations of this project's binaries with one runner.
+
+        Instead of a wrapped binary per invocation, we call the runner of the
+        experiment directly for every invocation. All runs share a single db
+        session (see pprof.utils.db.batch_session). Call this from
+        run_tests, the runs belong to the run group of the project.
+
+        Args:
+            experiment: The runner we run this project under, see run_tests.
+            invocations (list(Invocation)): The invocations, in order.
+                Relative paths are resolved against the current directory.
+            parallel (int): Execute up to this many invocations in parallel,
+                if the runner allows it (see
+                pprof.utils.run.parallel_batches). Every worker commits its
+                runs on its own.
+            keep_going (bool): Continue with the next invocation, if one
+                fails.
+
+        Raises:
+            GuardedRunException: If an invocation fails and not :keep_going:.
+        """
+        from functools import partial
+        from pprof.utils.db import batch_session
+        from pprof.utils.run import GuardedRunException, run_invocations
+        from pprof.utils.schedule import Budget, Scheduler
+
+        invocations = [Invocation(str(local.path(inv.binary)), inv.args,
+                                  None if inv.stdin is None
+                                  else str(local.path(inv.stdin)))
+                       for inv in invocations]
+
+        def run_chunk(chunk):
+            """ Run a list of invocations under a single session. """
+            with batch_session():
+                run_invocations(experiment, chunk, keep_going)
+
+        workers = min(int(parallel), len(invocations))
+        if workers <= 1 or not getattr(experiment, "parallel_batches", False):
+            run_chunk(invocations)
+            return
+
+        scheduler = Scheduler(Budget(workers, 0), workers)
+        for i in range(workers):
+            scheduler.submit("{}-batch-{:d}".format(self.name, i), 1, 0,
+                             partial(run_chunk, invocations[i::workers]))
+        failed = scheduler.wait()
+        if failed:
+            raise GuardedRunException(
+                RuntimeError("Failed batches: " + ", ".join(failed)), None,
+                None)
+
+    def run(self, experiment, clean=True):
         """
         Run the tests of this project.
 
@@ -112,6 +172,9 @@ class Project(object, metaclass=ProjectRegistry):
 
         Args:
             experiment: The experiment we run this project under
+            clean (bool): Clean the build directory after the run, unless
+                the user wants to keep it. Disable this, if you want to run
+                the same build again.
         """
         from pprof.utils.run import GuardedRunException
         from pprof.utils.run import (begin_run_group, end_run_group,
@@ -132,7 +195,7 @@ class Project(object, metaclass=ProjectRegistry):
                 except KeyboardInterrupt as key_int:
                     fail_run_group(group, session)
                     raise key_int
-        if not config["keep"]:
+        if clean and not config["keep"]:
             self.clean()
 
     def clean(self):
@@ -161,6 +224,10 @@ class Project(object, metaclass=ProjectRegistry):
                 is required is ::
                     f(cc, **kwargs)
                 where cc is the original compiler command.
+                If the extension declares the flags it needs in the
+                compilation (see pprof.utils.run.with_compile_flags), it is
+                called with the outcome of the compilation instead ::
+                    f(cc, retcode=..., stdout=..., stderr=..., **kwargs)
 
         """
         self._compiler_extension = func
@@ -224,14 +291,44 @@ def strip_path_prefix(ipath, prefix):
     return ipath[len(prefix):] if ipath.startswith(prefix) else ipath
 
 
+def wrapper_env():
+    """
+    Get the environment of a wrapped binary.
+
+    Wrapped binaries are executed outside of the pprof driver, they get
+    their settings from this environment. Wrapped binaries do not create
+    the tables in the database, the driver did it already.
+
+    Returns (dict(str, str)):
+        Maps environment variables to their values.
+    """
+    return {
+        "PPROF_DB_HOST": str(config["db_host"]),
+        "PPROF_DB_PORT": str(config["db_port"]),
+        "PPROF_DB_NAME": str(config["db_name"]),
+        "PPROF_DB_USER": str(config["db_user"]),
+        "PPROF_DB_PASS": str(config["db_pass"]),
+        "PPROF_DB_BACKEND": str(config["db_backend"]),
+        "PPROF_DB_PATH": str(config["db_path"]),
+        "PPROF_DB_CREATE": "false",
+        "PPROF_SPOOL_DIR": str(config["spool_dir"]),
+        "PPROF_LIKWID_DIR": str(config["likwiddir"]),
+        "LD_LIBRARY_PATH": str(config["ld_library_path"])
+    }
+
+
 def wrap(name, runner, sprefix=None):
     """ Wrap the binary :name: with the function :runner:.
 
     This module generates a python tool that replaces :name:
     The function in runner only accepts the replaced binaries
-    name as argument. We use the cloudpickle package to
-    perform the serialization, make sure :runner: can be serialized
-    with it and you're fine.
+    name as argument. The runner is stored as a plain data spec, it has to
+    be a registered runner (see pprof.utils.registry), or a
+    pprof.utils.run.partial of one.
+
+    If :name: has been wrapped before, we keep the real binary and only
+    replace the runner. This way a single build can be run many times with
+    different runners.
 
     Args:
         name: Binary we want to wrap
@@ -240,54 +337,35 @@ def wrap(name, runner, sprefix=None):
     Returns:
         A plumbum command, ready to launch.
     """
-    import dill
+    from pprof.utils.registry import dump_runner
 
     name_absolute = path.abspath(name)
     real_f = name_absolute + PROJECT_BIN_F_EXT
-    mv(name_absolute, real_f)
+    if not path.exists(real_f):
+        mv(name_absolute, real_f)
 
     blob_f = name_absolute + PROJECT_BLOB_F_EXT
-    with open(blob_f, 'wb') as blob:
-        dill.dump(runner, blob, protocol=-1, recurse=True)
+    dump_runner(runner, blob_f)
 
     with open(name_absolute, 'w') as wrapper:
         lines = '''#!/usr/bin/env python3
 #
-
-from plumbum import cli, local
-from os import path
+import os
 import sys
-import dill
 
 run_f = "{runf}"
 args = sys.argv[1:]
-f = None
-if path.exists("{blobf}"):
-    with local.env(PPROF_DB_HOST="{db_host}",
-               PPROF_DB_PORT="{db_port}",
-               PPROF_DB_NAME="{db_name}",
-               PPROF_DB_USER="{db_user}",
-               PPROF_DB_PASS="{db_pass}",
-               PPROF_LIKWID_DIR="{likwiddir}",
-               LD_LIBRARY_PATH="{ld_lib_path}",
-               PPROF_CMD=run_f + " ".join(args)):
-        with open("{blobf}", "rb") as p:
-            f = dill.load(p)
-        if f is not None:
-            if not sys.stdin.isatty():
-                f(run_f, args, has_stdin = True)
-            else:
-                f(run_f, args)
-        else:
-            sys.exit(1)
-
-'''.format(db_host=config["db_host"],
-           db_port=config["db_port"],
-           db_name=config["db_name"],
-           db_user=config["db_user"],
-           db_pass=config["db_pass"],
-           likwiddir=config["likwiddir"],
-           ld_lib_path=config["ld_library_path"],
+if os.path.exists("{blobf}"):
+    os.environ.update({env})
+    os.environ["PPROF_CMD"] = " ".join([run_f] + args)
+
+    from pprof.utils.registry import load_runner
+    f = load_runner("{blobf}")
+    if not sys.stdin.isatty():
+        f(run_f, args, has_stdin = True)
+    else:
+        f(run_f, args)
+'''.format(env=repr(wrapper_env()),
            blobf=strip_path_prefix(blob_f, sprefix),
            runf=strip_path_prefix(real_f, sprefix))
         wrapper.write(lines)
@@ -311,66 +389,38 @@ def wrap_dynamic(name, runner, sprefix=None):
     Returns: plumbum command, readty to launch.
 
     """
-    import dill
+    from pprof.utils.registry import dump_runner
 
     name_absolute = path.abspath(name)
     blob_f = name_absolute + PROJECT_BLOB_F_EXT
-    with open(blob_f, 'wb') as blob:
-        blob.write(dill.dumps(runner))
+    dump_runner(runner, blob_f)
 
     with open(name_absolute, 'w') as wrapper:
         lines = '''#!/usr/bin/env python3
 #
-
-from pprof.project import Project
-from pprof.experiment import Experiment
-from plumbum import cli, local
-from os import path, getenv
+import os
 import sys
-import dill
 
 if not len(sys.argv) >= 2:
-    os.stderr.write("Not enough arguments provided!\\n")
-    os.stderr.write("Got: " + sys.argv + "\\n")
+    sys.stderr.write("Not enough arguments provided!\\n")
+    sys.stderr.write("Got: " + str(sys.argv) + "\\n")
     sys.exit(1)
 
-f = None
 run_f = sys.argv[1]
 args = sys.argv[2:]
-project_name = path.basename(run_f)
-if path.exists("{blobf}"):
-    with local.env(PPROF_DB_HOST="{db_host}",
-               PPROF_DB_PORT="{db_port}",
-               PPROF_DB_NAME="{db_name}",
-               PPROF_DB_USER="{db_user}",
-               PPROF_DB_PASS="{db_pass}",
-               PPROF_PROJECT=project_name,
-               PPROF_LIKWID_DIR="{likwiddir}",
-               LD_LIBRARY_PATH="{ld_lib_path}",
-               PPROF_CMD=run_f):
-        with open("{blobf}", "rb") as p:
-            f = dill.load(p)
-        if f is not None:
-            exp_name = getenv("PPROF_EXPERIMENT", "unknown")
-            domain_name = getenv("PPROF_DOMAIN", "unknown")
-            group_name = getenv("PPROF_GROUP", "unknwon")
-            e = Experiment(exp_name, [], group_name)
-            p = Project(e, project_name, domain_name, group_name)
-
-            if not sys.stdin.isatty():
-                f(run_f, args, has_stdin = True, project_name = project_name)
-            else:
-                f(run_f, args, project_name = project_name)
-        else:
-            sys.exit(1)
-
-'''.format(db_host=config["db_host"],
-           db_port=config["db_port"],
-           db_name=config["db_name"],
-           db_user=config["db_user"],
-           db_pass=config["db_pass"],
-           likwiddir=config["likwiddir"],
-           ld_lib_path=config["ld_library_path"],
+project_name = os.path.basename(run_f)
+if os.path.exists("{blobf}"):
+    os.environ.update({env})
+    os.environ["PPROF_PROJECT"] = project_name
+    os.environ["PPROF_CMD"] = run_f
+
+    from pprof.utils.registry import load_runner
+    f = load_runner("{blobf}")
+    if not sys.stdin.isatty():
+        f(run_f, args, has_stdin = True, project_name = project_name)
+    else:
+        f(run_f, args, project_name = project_name)
+'''.format(env=repr(wrapper_env()),
            blobf=strip_path_prefix(blob_f, sprefix))
         wrapper.write(lines)
     chmod("+x", name_absolute)
@@ -108,27 +108,18 @@ class Lapack(PprofGroup):
                 run(make["-j", config["jobs"], "-f", "Makeblat3"])
 
     def run_tests(self, experiment):
-        from pprof.project import wrap
-        from pprof.utils.run import run
+        from pprof.project import Invocation
 
         lapack_dir = path.join(self.builddir, self.src_dir)
         with local.cwd(lapack_dir):
             with local.cwd(path.join("BLAS")):
-                xblat2s = wrap("xblat2s", experiment)
-                xblat2d = wrap("xblat2d", experiment)
-                xblat2c = wrap("xblat2c", experiment)
-                xblat2z = wrap("xblat2z", experiment)
-
-                xblat3s = wrap("xblat3s", experiment)
-                xblat3d = wrap("xblat3d", experiment)
-                xblat3c = wrap("xblat3c", experiment)
-                xblat3z = wrap("xblat3z", experiment)
-
-                run((xblat2s < "sblat2.in"))
-                run((xblat2d < "dblat2.in"))
-                run((xblat2c < "cblat2.in"))
-                run((xblat2z < "zblat2.in"))
-                run((xblat3s < "sblat3.in"))
-                run((xblat3d < "dblat3.in"))
-                run((xblat3c < "cblat3.in"))
-                run((xblat3z < "zblat3.in"))
+                self.run_batch(experiment, [
+                    Invocation("xblat2s", [], "sblat2.in"),
+                    Invocation("xblat2d", [], "dblat2.in"),
+                    Invocation("xblat2c", [], "cblat2.in"),
+                    Invocation("xblat2z", [], "zblat2.in"),
+                    Invocation("xblat3s", [], "sblat3.in"),
+                    Invocation("xblat3d", [], "dblat3.in"),
+                    Invocation("xblat3c", [], "cblat3.in"),
+                    Invocation("xblat3z", [], "zblat3.in")
+                ], parallel=config["jobs"])
@@ -1,6 +1,6 @@
 from pprof.projects.pprof.group import PprofGroup
 from os import path
-from plumbum import FG, local
+from plumbum import local
 from plumbum.cmd import cp, chmod, find
 
 
@@ -79,9 +79,9 @@ class Povray(PprofGroup):
         cp("-ar", path.join(self.testdir, "test"), self.builddir)
 
     def run_tests(self, experiment):
-        from plumbum.cmd import mkdir
-        from pprof.project import wrap
-        from pprof.utils.run import run
+        from plumbum.cmd import mkdir, head, grep, sed
+        from pprof.project import Invocation
+        from pprof.settings import config
 
         povray_dir = path.join(self.builddir, self.src_dir)
         povray_binary = path.join(povray_dir, "unix", self.name)
@@ -91,18 +91,20 @@ class Povray(PprofGroup):
         scene_dir = path.join(self.builddir, "share", "povray-3.6", "scenes")
         mkdir(tmpdir, retcode=None)
 
-        povray = wrap(povray_binary, experiment)
-
         pov_files = find(scene_dir, "-name", "*.pov").splitlines()
+        invocations = []
         for pov_f in pov_files:
-            from plumbum.cmd import head, grep, sed
-            with local.env(POVRAY=povray_binary,
-                           INSTALL_DIR=self.builddir,
-                           OUTPUT_DIR=tmpdir,
-                           POVINI=povini):
-                options = ((((head["-n", "50", "\"" + pov_f + "\""]
-                              | grep["-E", "'^//[ ]+[-+]{1}[^ -]'"])
-                             | head["-n", "1"]) | sed["s?^//[ ]*??"]) & FG)
-                run(povray["+L" + scene_dir, "+L" + tmpdir, "-i" + pov_f, "-o"
-                           + tmpdir, options, "-p"],
-                    retcode=None)
+            options = (head["-n", "50", pov_f]
+                       | grep["-E", "^//[ ]+[-+]{1}[^ -]"]
+                       | head["-n", "1"]
+                       | sed["s?^//[ ]*??"])(retcode=None).split()
+            invocations.append(Invocation(
+                povray_binary, ["+L" + scene_dir, "+L" + tmpdir, "-i" + pov_f,
+                                "-o" + tmpdir] + options + ["-p"], None))
+
+        with local.env(POVRAY=povray_binary,
+                       INSTALL_DIR=self.builddir,
+                       OUTPUT_DIR=tmpdir,
+                       POVINI=povini):
+            self.run_batch(experiment, invocations, parallel=config["jobs"],
+                           keep_going=True)
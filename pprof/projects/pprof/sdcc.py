@@ -46,5 +46,5 @@ class SDCC(PprofGroup):
         from pprof.project import wrap
         from pprof.utils.run import run
 
-        exp = wrap(self.run_f, experiment(self.run_f))
+        exp = wrap(self.run_f, experiment)
         run(exp)
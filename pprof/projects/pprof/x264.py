@@ -54,9 +54,9 @@ class X264(PprofGroup):
             run(make["clean", "all", "-j", config["jobs"]])
 
     def run_tests(self, experiment):
-        from pprof.project import wrap
+        from pprof.project import Invocation
         x264_dir = path.join(self.builddir, self.src_dir)
-        exp = wrap(path.join(x264_dir, "x264"), experiment)
+        x264 = path.join(x264_dir, "x264")
 
         tests = [
             "--crf 30 -b1 -m1 -r1 --me dia --no-cabac --direct temporal --ssim --no-weightb",
@@ -69,8 +69,12 @@ class X264(PprofGroup):
             "--frames 50 -q0 -m2 -r1 --me hex --no-cabac",
         ]
 
+        invocations = []
         for ifile in self.inputfiles:
             testfile = path.join(self.testdir, ifile)
-            for i in range(len(tests)):
-                run(exp[testfile, self.inputfiles[ifile], "--threads", "1",
-                        "-o", "/dev/null", tests[i].split(" ")])
+            for test in tests:
+                invocations.append(Invocation(
+                    x264, [testfile] + self.inputfiles[ifile] +
+                    ["--threads", "1", "-o", "/dev/null"] + test.split(" "),
+                    None))
+        self.run_batch(experiment, invocations, parallel=config["jobs"])
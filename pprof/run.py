@@ -56,6 +56,16 @@ class PprofRun(cli.Application):
     def experiment_tag(self, description):
         config["experiment_description"] = description
 
+    @cli.switch(["--resume"],
+                str,
+                requires=["--experiment"],
+                help="Resume the experiment with the given ID, skip all "
+                     "projects & configurations that completed already")
+    def resume(self, experiment_id):
+        from uuid import UUID
+        config["experiment"] = UUID(experiment_id)
+        config["resume"] = True
+
     @cli.switch(["-P", "--project"],
                 str,
                 list=True,
@@ -84,6 +94,14 @@ class PprofRun(cli.Application):
     def keep(self):
         config["keep"] = True
 
+    @cli.switch(["--parallel"],
+                int,
+                requires=["--experiment"],
+                help="Number of projects we process concurrently. "
+                     "Experiments that sweep over the core count ignore it")
+    def parallel(self, num):
+        config["parallel"] = num
+
     @cli.switch(["-G", "--group"],
                 str,
                 requires=["--experiment"],
@@ -23,6 +23,14 @@ def available_cpu_count():
     Returns:
         Number of avaialable CPUs.
     """
+    # Python 3.3+, the affinity mask respects cpusets as well
+    try:
+        res = len(os.sched_getaffinity(0))
+        if res > 0:
+            return res
+    except AttributeError:
+        pass
+
     # cpuset
     # cpuset may restrict the number of *available* processors
     try:
@@ -190,11 +198,63 @@ CONFIG_METADATA = [
         "desc": "Prefix to which the likwid library was installed.",
         "env": "PPROF_LIKWID_DIR",
         "default": "/usr/"
+    }, {
+        "name": "likwid_groups",
+        "desc": "Comma separated list of the likwid performance groups we "
+                "measure, e.g., 'CLOCK,MEM,L3,FLOPS_DP,BRANCH'.",
+        "env": "PPROF_LIKWID_GROUPS",
+        "default": "CLOCK"
+    }, {
+        "name": "likwid_multiplex",
+        "desc": "Measure all likwid groups in a single run, with likwid's "
+                "time-multiplexed multi-group mode, instead of one run per "
+                "group.",
+        "env": "PPROF_LIKWID_MULTIPLEX",
+        "default": False
+    }, {
+        "name": "likwid_mux_time",
+        "desc": "Time each likwid group is measured in multiplexed mode, "
+                "before we switch to the next one.",
+        "env": "PPROF_LIKWID_MUX_TIME",
+        "default": "200ms"
     }, {
         "name": "tmpdir",
         "desc": "Temporary dir. This will be used for caching downloads.",
         "env": "PPROF_TMP_DIR",
         "default": os.path.join(os.getcwd(), "tmp")
+    }, {
+        "name": "build_cache",
+        "desc": "Cache directory for finished project builds, e.g., "
+                "tmp/build-cache. The build cache is disabled, if empty.",
+        "env": "PPROF_BUILD_CACHE",
+        "default": ""
+    }, {
+        "name": "build_cache_size",
+        "desc": "Maximum size (MiB) of the build cache.",
+        "env": "PPROF_BUILD_CACHE_SIZE",
+        "default": 20480
+    }, {
+        "name": "compile_cache",
+        "desc": "Cache directory for the object files of wrapped "
+                "compilers. Leave empty to disable the compile cache.",
+        "env": "PPROF_COMPILE_CACHE",
+        "default": os.path.join(os.getcwd(), "tmp", "compile-cache")
+    }, {
+        "name": "compile_cache_size",
+        "desc": "Maximum size (MiB) of the compile cache.",
+        "env": "PPROF_COMPILE_CACHE_SIZE",
+        "default": 10240
+    }, {
+        "name": "papi_calibration_cache",
+        "desc": "Cache directory for PAPI calibration results of this "
+                "host. Leave empty to calibrate in every experiment.",
+        "env": "PPROF_PAPI_CALIBRATION_CACHE",
+        "default": os.path.join(os.getcwd(), "tmp", "papi-calibration")
+    }, {
+        "name": "papi_calibration_ttl",
+        "desc": "Hours a cached PAPI calibration result stays valid.",
+        "env": "PPROF_PAPI_CALIBRATION_TTL",
+        "default": 168
     }, {
         "name": "path",
         "desc": "Additional PATH variable for pprof.",
@@ -217,6 +277,50 @@ CONFIG_METADATA = [
         "desc": "Number of jobs that can be used for building and running.",
         "env": "PPROF_MAKE_JOBS",
         "default": str(available_cpu_count())
+    }, {
+        "name": "parallel",
+        "desc": "Number of projects that can be processed concurrently.",
+        "env": "PPROF_PARALLEL",
+        "default": 1
+    }, {
+        "name": "memory",
+        "desc": "Memory (MiB) that can be used by concurrent projects. "
+                "0 uses the available memory of the host.",
+        "env": "PPROF_MEMORY",
+        "default": 0
+    }, {
+        "name": "project_memory",
+        "desc": "Memory (MiB) we reserve for a single concurrent project.",
+        "env": "PPROF_PROJECT_MEMORY",
+        "default": 2048
+    }, {
+        "name": "prefetch",
+        "desc": "Number of upcoming projects we download in the background, "
+                "while the current project builds. 0 disables prefetching.",
+        "env": "PPROF_PREFETCH",
+        "default": 1
+    }, {
+        "name": "repeat_max",
+        "desc": "Maximum number of repetitions of a timed run. Repetitions "
+                "stop earlier, if the confidence interval is tight enough.",
+        "env": "PPROF_REPEAT_MAX",
+        "default": 1
+    }, {
+        "name": "repeat_min",
+        "desc": "Minimum number of repetitions of a timed run.",
+        "env": "PPROF_REPEAT_MIN",
+        "default": 3
+    }, {
+        "name": "repeat_ci",
+        "desc": "Stop repeating a timed run, if the relative half width of "
+                "the 95% confidence interval of time.real_s drops below this.",
+        "env": "PPROF_REPEAT_CI",
+        "default": 0.02
+    }, {
+        "name": "repeat_budget",
+        "desc": "Time budget (seconds) for the repetitions of a timed run.",
+        "env": "PPROF_REPEAT_BUDGET",
+        "default": 600
     }, {
         "name": "experiment",
         "desc":
@@ -224,6 +328,28 @@ CONFIG_METADATA = [
         "runs in the database.",
         "env": "PPROF_EXPERIMENT_ID",
         "default": uuid4()
+    }, {
+        "name": "resume",
+        "desc": "Resume the experiment with the UUID given in 'experiment'. "
+                "Skip everything that completed already.",
+        "default": False
+    }, {
+        "name": "db_backend",
+        "desc": "The storage backend for our results: 'postgresql' or "
+                "'sqlite'.",
+        "env": "PPROF_DB_BACKEND",
+        "default": "postgresql"
+    }, {
+        "name": "db_path",
+        "desc": "The database file of the 'sqlite' backend.",
+        "env": "PPROF_DB_PATH",
+        "default": os.path.join(os.getcwd(), "pprof.sqlite")
+    }, {
+        "name": "db_create",
+        "desc": "Create missing tables, when we connect to the database. "
+                "Wrapped binaries skip this, the driver did it for them.",
+        "env": "PPROF_DB_CREATE",
+        "default": True
     }, {
         "name": "db_host",
         "desc": "Host address of the database to connect to.",
@@ -251,6 +377,32 @@ CONFIG_METADATA = [
         "The password for the PostgreSQL user used to connect to the database with.",
         "env": "PPROF_DB_PASS",
         "default": "pprof"
+    }, {
+        "name": "log_limit",
+        "desc": "Keep this many KiB of the head and of the tail of a run's "
+                "stdout/stderr in the log. Longer outputs are stored "
+                "compressed and out of line.",
+        "env": "PPROF_LOG_LIMIT",
+        "default": 64
+    }, {
+        "name": "compile_server",
+        "desc": "Serve the calls of wrapped compilers from a long-lived "
+                "compile server, instead of a fresh interpreter per call.",
+        "env": "PPROF_COMPILE_SERVER",
+        "default": True
+    }, {
+        "name": "compile_server_timeout",
+        "desc": "Shut the compile server down after this many idle "
+                "seconds.",
+        "env": "PPROF_COMPILE_SERVER_TIMEOUT",
+        "default": 60
+    }, {
+        "name": "spool_dir",
+        "desc": "Write all results to a node-local spool in this directory, "
+                "instead of the database. Import the spool later with "
+                "'pprof import'. Leave empty to use the database directly.",
+        "env": "PPROF_SPOOL_DIR",
+        "default": ""
     }, {
         "name": "slurm_script",
         "desc":
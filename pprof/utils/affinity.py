@@ -0,0 +1,125 @@
+"""
+CPU affinity helpers for measured runs.
+
+Runners receive the number of cores (``jobs``) they are allowed to use.
+The helpers in this module turn this number into an explicit set of CPUs
+and pin the measured process to it.
+
+CPUs are selected topology-aware: We fill the physical cores of one
+package (socket) first, before we move on to the next package. Hardware
+threads (SMT siblings) of a physical core are only used after every
+physical core has been used once.
+
+CPUs are always selected from the cpus this process may run on. Concurrent
+project workers are pinned to disjoint cpus by their scheduler (see
+pprof.utils.schedule), so their runners never select the same cpus.
+"""
+import os
+from contextlib import contextmanager
+
+
+def read_topology_id(cpu, name, default):
+    """
+    Read a topology attribute of a cpu from sysfs.
+
+    Args:
+        cpu (int): The cpu we query.
+        name (str): The name of the attribute, e.g., 'core_id'.
+        default (int): Returned, if the attribute is not available.
+
+    Returns (int):
+        The value of the attribute.
+    """
+    attr = "/sys/devices/system/cpu/cpu{:d}/topology/{}".format(cpu, name)
+    try:
+        with open(attr, 'r') as attr_f:
+            return int(attr_f.read().strip())
+    except (IOError, ValueError):
+        return default
+
+
+def allowed_cpus():
+    """ Get the cpus this process may run on. """
+    try:
+        return sorted(os.sched_getaffinity(0))
+    except AttributeError:
+        return list(range(os.cpu_count() or 1))
+
+
+def select_cpus(jobs):
+    """
+    Select the cpus for a run with :jobs: cores.
+
+    Args:
+        jobs (int): The number of cores we want to use.
+
+    Returns (list(int)):
+        A list of at most :jobs: cpus, ordered as described in the module
+        documentation.
+    """
+    cpus = allowed_cpus()
+    packages = {}
+    for cpu in cpus:
+        package = read_topology_id(cpu, "physical_package_id", 0)
+        core = read_topology_id(cpu, "core_id", cpu)
+        packages.setdefault(package, {}).setdefault(core, []).append(cpu)
+
+    order = []
+    level = 0
+    while len(order) < len(cpus):
+        for package in sorted(packages):
+            cores = packages[package]
+            for core in sorted(cores):
+                if level < len(cores[core]):
+                    order.append(cores[core][level])
+        level += 1
+
+    return order[:max(1, int(jobs))]
+
+
+def cpu_list(cpus):
+    """
+    Format a list of cpus in the notation of taskset/likwid, e.g., '0-3,8'.
+
+    Args:
+        cpus (list(int)): The cpus.
+
+    Returns (str):
+        The cpus as comma separated list of ranges.
+    """
+    ranges = []
+    for cpu in sorted(cpus):
+        if ranges and ranges[-1][1] == cpu - 1:
+            ranges[-1][1] = cpu
+        else:
+            ranges.append([cpu, cpu])
+    return ",".join(["{:d}".format(lo) if lo == hi else
+                     "{:d}-{:d}".format(lo, hi) for lo, hi in ranges])
+
+
+@contextmanager
+def cpu_affinity(jobs):
+    """
+    Pin this process, and every process it spawns, to :jobs: cores.
+
+    The original affinity is restored as soon as we leave the context.
+    On platforms without sched_setaffinity we do not pin at all.
+
+    Args:
+        jobs (int): The number of cores we want to use.
+
+    Yields (list(int)):
+        The cpus we pinned ourselves to.
+    """
+    cpus = select_cpus(jobs)
+    try:
+        original = os.sched_getaffinity(0)
+        os.sched_setaffinity(0, cpus)
+    except AttributeError:
+        yield cpus
+        return
+
+    try:
+        yield cpus
+    finally:
+        os.sched_setaffinity(0, original)
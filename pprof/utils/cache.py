@@ -0,0 +1,358 @@
+"""
+Content addressed caches for build artifacts.
+
+A cache is a flat directory of entries, each stored under the hash of the
+inputs that produced it. The size of a cache is bounded: after every store
+we evict the least recently used entries until the cache fits into its limit
+again. A successful lookup counts as a use.
+
+Build trees of projects are cached as tar archives, see ``build_key``,
+``restore_build`` and ``store_build``. Object files of single compiler
+invocations are cached by the wrapped compilers, see ``compile_cache`` and
+pprof.utils.compile_server.
+
+PAPI calibration results only depend on the host, the toolchain and the
+PAPI build. They are cached per host for a limited time, see
+``calibration_key``, ``lookup_calibration`` and ``store_calibration``.
+"""
+import os
+from os import path
+from plumbum import local
+from pprof.settings import config
+
+
+class FileCache(object):
+    """ A size bounded LRU cache of files in a single directory. """
+
+    def __init__(self, root, limit):
+        """
+        Create a new cache.
+
+        Args:
+            root (str): The directory of the cache.
+            limit (int): Maximum size of all entries in MiB.
+        """
+        self.root = root
+        self.limit = limit * 1024 * 1024
+        if not path.exists(root):
+            os.makedirs(root, exist_ok=True)
+
+    def path(self, key):
+        """ Get the path of the entry for :key:. """
+        return path.join(self.root, key)
+
+    def lookup(self, key):
+        """
+        Look for an entry in the cache.
+
+        Args:
+            key (str): The key of the entry.
+
+        Returns (str):
+            Path of the entry, or None, if there is no entry for :key:.
+        """
+        entry = self.path(key)
+        if not path.exists(entry):
+            return None
+        os.utime(entry, None)
+        return entry
+
+    def store(self, key, writer):
+        """
+        Store a new entry in the cache.
+
+        The entry is written to a temporary file first and moved into place
+        afterwards. Concurrent readers never see incomplete entries.
+
+        Args:
+            key (str): The key of the entry.
+            writer (callable): Gets called with a path, it should write
+                the contents of the new entry to it.
+
+        Returns (str):
+            Path of the new entry.
+        """
+        from tempfile import mkstemp
+
+        tmp_fd, tmp_path = mkstemp(dir=self.root, prefix=".tmp-")
+        os.close(tmp_fd)
+        try:
+            writer(tmp_path)
+            os.replace(tmp_path, self.path(key))
+        finally:
+            if path.exists(tmp_path):
+                os.remove(tmp_path)
+        self.evict()
+        return self.path(key)
+
+    def evict(self):
+        """ Remove the least recently used entries, until we fit the limit. """
+        entries = []
+        for name in os.listdir(self.root):
+            if name.startswith("."):
+                continue
+            try:
+                stat = os.stat(path.join(self.root, name))
+            except OSError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, name))
+
+        total = sum([size for _, size, _ in entries])
+        for _, size, name in sorted(entries):
+            if total <= self.limit:
+                break
+            try:
+                os.remove(path.join(self.root, name))
+            except OSError:
+                pass
+            total -= size
+
+
+def hash_file(filename, sha):
+    """ Update the hash :sha: with the contents of :filename:, if it exists. """
+    if filename is None or not path.exists(filename):
+        return
+    with open(filename, 'rb') as in_f:
+        for chunk in iter(lambda: in_f.read(1 << 16), b''):
+            sha.update(chunk)
+
+
+def build_key(project):
+    """
+    Get the cache key for the build of a project.
+
+    The key covers the project (name, source uri and the module that
+    defines it), the source we downloaded, the flags and the revision of
+    the toolchain. A downloaded file (``src_file``) is hashed completely,
+    a downloaded directory (``src_dir``) by the hash pprof keeps next to it
+    in ``config["tmpdir"]``.
+
+    Build trees are not relocatable (Makefiles, libtool wrappers and
+    configure caches hold absolute paths), so the key covers the build
+    directory of the project as well. The build directory contains the name
+    of the experiment: The cache only serves re-runs of the same experiment
+    (e.g., sweeps, --resume, repeated studies), never another experiment.
+
+    Args:
+        project (pprof.Project): The project, after it has been downloaded.
+
+    Returns (str):
+        The key for the build of this project, or None, if the project
+        must not be cached. Projects with a compiler extension have to be
+        compiled for real, as the extension records the compilation.
+        Projects without a downloaded source we can hash are never cached.
+    """
+    import hashlib
+    import sys
+    from pprof.utils import versions
+
+    if project.compiler_extension is not None:
+        return None
+
+    sha = hashlib.sha256()
+    src_uri = getattr(project, "src_uri", "")
+    for part in [project.name, str(src_uri), project.builddir,
+                 str(project.cflags), str(project.ldflags), config["llvmdir"],
+                 versions.LLVM_VERSION, versions.CLANG_VERSION,
+                 versions.POLLY_VERSION, versions.POLLI_VERSION]:
+        sha.update(str(part).encode("utf-8"))
+
+    module = sys.modules.get(type(project).__module__)
+    hash_file(getattr(module, "__file__", None), sha)
+
+    hashed = False
+    for attr in ["src_file", "src_dir"]:
+        src = getattr(project, attr, None)
+        if src is None:
+            continue
+        src_path = path.join(config["tmpdir"], src)
+        if path.isfile(src_path):
+            hash_file(src_path, sha)
+            hashed = True
+        elif path.isfile(src_path + ".hash"):
+            hash_file(src_path + ".hash", sha)
+            hashed = True
+    if not hashed:
+        return None
+
+    return project.name + "-" + sha.hexdigest()
+
+
+def build_cache():
+    """
+    Get the build cache, as configured by the user.
+
+    Returns (FileCache):
+        The build cache, or None, if the user disabled it.
+    """
+    if not config["build_cache"]:
+        return None
+    return FileCache(config["build_cache"], int(config["build_cache_size"]))
+
+
+def compile_cache():
+    """
+    Get the object file cache of the wrapped compilers.
+
+    Returns (FileCache):
+        The compile cache, or None, if the user disabled it.
+    """
+    if not config["compile_cache"]:
+        return None
+    return FileCache(config["compile_cache"],
+                     int(config["compile_cache_size"]))
+
+
+def restore_build(project):
+    """
+    Restore the build tree of a project from the build cache.
+
+    Args:
+        project (pprof.Project): The project, after it has been downloaded.
+
+    Returns (bool):
+        True, if we found the build in the cache and restored it.
+    """
+    from plumbum.cmd import tar
+
+    cache = build_cache()
+    key = build_key(project)
+    if cache is None or key is None:
+        return False
+
+    entry = cache.lookup(key + ".tar")
+    if entry is None:
+        return False
+
+    tar("xf", entry, "-C", project.builddir)
+    return True
+
+
+def store_build(project):
+    """
+    Store the build tree of a project in the build cache.
+
+    Args:
+        project (pprof.Project): The project, after it has been built.
+    """
+    from plumbum.cmd import tar
+
+    cache = build_cache()
+    key = build_key(project)
+    if cache is None or key is None:
+        return
+
+    cache.store(key + ".tar",
+                lambda tmp: tar("cf", tmp, "-C", project.builddir, "."))
+
+
+def papi_version():
+    """
+    Get the version of the PAPI library we link against.
+
+    Returns (str):
+        The output of papi_version, or an empty string, if it is not
+        available.
+    """
+    from plumbum.commands.processes import CommandNotFound
+
+    try:
+        return local["papi_version"](retcode=None).strip()
+    except CommandNotFound:
+        return ""
+
+
+def calibration_key(calibrate_call):
+    """
+    Get the cache key for the PAPI calibration of this host.
+
+    The key covers the host name, the toolchain (llvmdir and the revisions
+    of its components), the PAPI version and the calibration binary itself.
+
+    Args:
+        calibrate_call (plumbum.cmd): The calibration command.
+
+    Returns (str):
+        The key of the calibration result.
+    """
+    import hashlib
+    import socket
+    from pprof.utils import versions
+
+    sha = hashlib.sha256()
+    for part in [config["llvmdir"], versions.LLVM_VERSION,
+                 versions.CLANG_VERSION, versions.POLLY_VERSION,
+                 versions.POLLI_VERSION, papi_version()]:
+        sha.update(str(part).encode("utf-8"))
+    executable = getattr(calibrate_call, "executable", None)
+    if executable is not None:
+        hash_file(str(executable), sha)
+
+    return "papi-" + socket.gethostname() + "-" + sha.hexdigest()
+
+
+def calibration_cache():
+    """
+    Get the cache of PAPI calibration results.
+
+    Returns (FileCache):
+        The calibration cache, or None, if the user disabled it.
+    """
+    if not config["papi_calibration_cache"]:
+        return None
+    return FileCache(config["papi_calibration_cache"], 1)
+
+
+def lookup_calibration(key):
+    """
+    Look for a valid calibration result in the calibration cache.
+
+    Args:
+        key (str): The key of the calibration, see calibration_key.
+
+    Returns (str):
+        The calibration time in nanoseconds, or None, if there is no entry
+        for :key: or the entry has expired.
+    """
+    import json
+    import time
+
+    cache = calibration_cache()
+    if cache is None:
+        return None
+
+    entry = cache.lookup(key + ".json")
+    result = None
+    if entry is not None:
+        try:
+            with open(entry, 'r') as entry_f:
+                calibration = json.load(entry_f)
+            ttl = float(config["papi_calibration_ttl"]) * 3600
+            if time.time() - calibration["created"] < ttl:
+                result = calibration["time_ns"]
+        except (IOError, ValueError, KeyError):
+            result = None
+    return result
+
+
+def store_calibration(key, calibration):
+    """
+    Store a calibration result in the calibration cache.
+
+    Args:
+        key (str): The key of the calibration, see calibration_key.
+        calibration (str): The calibration time in nanoseconds.
+    """
+    import json
+    import time
+
+    cache = calibration_cache()
+    if cache is None or calibration is None:
+        return
+
+    def write(tmp):
+        """ Write the entry, with its time of creation. """
+        with open(tmp, 'w') as entry_f:
+            json.dump({"time_ns": calibration, "created": time.time()},
+                      entry_f)
+    cache.store(key + ".json", write)
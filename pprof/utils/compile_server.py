@@ -0,0 +1,694 @@
+"""
+A compile server for the wrapped compilers of pprof.
+
+Build systems call the compiler thousands of times, e.g., once for every
+configure probe and once for every translation unit. If every call starts a
+fresh python interpreter that imports pprof and plumbum, the wrapper
+dominates the build time.
+
+Instead, ``lt_clang``/``lt_clang_cxx`` generate a tiny client shim that runs
+with ``python3 -S`` and imports nothing but a few standard modules. The shim
+connects to a long-lived compile server over a Unix socket, hands over its
+arguments, working directory, environment and its stdin/stdout/stderr file
+descriptors and waits for the exit code. The server forks a worker for every
+request. The worker runs in the caller's working directory and environment,
+injects the hidden flags, calls the real compiler and runs the compiler
+extension (see ``Project.compiler_extension``).
+
+The server of a wrapper is started by the first call of its shim, that call
+falls back to the slow path: it runs ``compile_and_record`` in a fresh
+interpreter. The server shuts down after ``config["compile_server_timeout"]``
+seconds without requests.
+"""
+import json
+import os
+import socket
+import struct
+import sys
+from pprof.settings import config
+
+SPEC_F_EXT = ".json"
+HEADER = struct.Struct("!I")
+
+
+def socket_path(filepath):
+    """
+    Get the socket of the compile server for a wrapper.
+
+    Unix socket paths are short, so the socket lives in the temporary
+    directory and is named after the hash of the wrapper's path.
+
+    Args:
+        filepath (str): The absolute path of the wrapper.
+
+    Returns (str):
+        The path of the socket.
+    """
+    import hashlib
+    from tempfile import gettempdir
+
+    digest = hashlib.sha1(filepath.encode("utf-8")).hexdigest()[:16]
+    return os.path.join(gettempdir(), "pprof-cc-{}.sock".format(digest))
+
+
+def load_spec(spec_path):
+    """ Load the specification of a wrapped compiler. """
+    with open(spec_path, 'r') as spec_f:
+        return json.load(spec_f)
+
+
+def load_extension(blob_path):
+    """
+    Load the compiler extension of a wrapped compiler.
+
+    Args:
+        blob_path (str): The file that holds the spec of the extension.
+
+    Returns (callable):
+        The compiler extension, or None, if there is no extension.
+    """
+    from pprof.utils.registry import load_runner
+
+    if not os.path.exists(blob_path):
+        return None
+    return load_runner(blob_path)
+
+
+def really_exec(cmd):
+    """ Execute a compiler command, its output goes straight to ours. """
+    from logging import getLogger
+    from plumbum import ProcessExecutionError
+    from plumbum.cmd import timeout
+    from plumbum.commands.modifiers import TEE
+    from pprof.utils.run import GuardedRunException
+
+    log = getLogger("clang")
+    try:
+        log.info("Trying - %s", str(cmd))
+        return (timeout["2m", cmd.formulate()] & TEE)
+    except (GuardedRunException, ProcessExecutionError) as ex:
+        log.error("Failed to execute - %s", str(cmd))
+        raise ex
+
+
+def compiler_command(input_files, cc, cflags, ldflags, flags, extra):
+    """ Get the compiler command with the hidden flags injected. """
+    if len(input_files) > 0:
+        if "-c" in flags:
+            return cc["-Qunused-arguments", cflags, ldflags, flags, extra]
+        return cc["-Qunused-arguments", cflags, flags, ldflags, extra]
+    return cc["-Qunused-arguments", flags]
+
+
+SOURCE_F_EXTS = [".c", ".cc", ".cpp", ".cxx", ".c++", ".C", ".i", ".ii"]
+
+# Flags that make the compiler do more than producing the object file, e.g.,
+# store PolyJIT's regression test modules in the database. A cache hit would
+# skip these side effects, so we always compile for real.
+SIDE_EFFECT_FLAGS = ["-polli-collect-modules"]
+
+
+def cacheable(flags):
+    """
+    Check, if the compile cache can handle a compiler invocation.
+
+    We cache plain compilations of a single source file to an object file.
+    Everything that reads stdin or writes more than the object file, e.g.,
+    dependency files, or has other side effects (SIDE_EFFECT_FLAGS) is
+    compiled for real.
+
+    Args:
+        flags (list(str)): The arguments of the build system.
+
+    Returns (str):
+        The path of the object file we produce, or None, if we cannot cache
+        this invocation.
+    """
+    if "-c" not in flags or "-" in flags:
+        return None
+    if has_side_effects(flags):
+        return None
+    for flag in flags:
+        if flag.startswith("-M") or flag in ["-E", "-S", "-save-temps"]:
+            return None
+
+    output = None
+    sources = []
+    args = iter(flags)
+    for flag in args:
+        if flag == "-o":
+            output = next(args, None)
+        elif flag.startswith("-o"):
+            output = flag[2:]
+        elif not flag.startswith("-") and \
+                os.path.splitext(flag)[1] in SOURCE_F_EXTS:
+            sources.append(flag)
+
+    if len(sources) != 1 or output == "-":
+        return None
+    if output is None:
+        output = os.path.splitext(os.path.basename(sources[0]))[0] + ".o"
+    return output
+
+
+def has_side_effects(flags):
+    """ Check, if a compilation with :flags: does more than compiling. """
+    return any([flag in SIDE_EFFECT_FLAGS for flag in flags])
+
+
+def file_identity(filename):
+    """ Identify a file by its path, size and modification time. """
+    try:
+        stat = os.stat(filename)
+    except OSError:
+        return filename + ":missing"
+    return "{}:{:d}:{}".format(filename, stat.st_size, stat.st_mtime)
+
+
+def compile_key(spec, cc, flags, extra):
+    """
+    Get the key of a compiler invocation in the compile cache.
+
+    The key covers the preprocessed source, all flags (except the name of
+    the object file) and the identity of clang and of the plugins it loads.
+
+    Returns (str):
+        The key, or None, if we could not preprocess the source.
+    """
+    import hashlib
+    import subprocess
+
+    pre_flags = []
+    args = iter(flags)
+    for flag in args:
+        if flag == "-o":
+            next(args, None)
+        elif flag != "-c" and not flag.startswith("-o"):
+            pre_flags.append(flag)
+
+    all_flags = [str(x) for x in spec["cflags"] + spec["ldflags"] +
+                 pre_flags + (extra or [])]
+    preprocess = cc["-Qunused-arguments", all_flags, "-E"]
+
+    sha = hashlib.sha256()
+    proc = preprocess.popen(stdin=subprocess.DEVNULL,
+                            stderr=subprocess.DEVNULL)
+    for chunk in iter(lambda: proc.stdout.read(1 << 16), b''):
+        sha.update(chunk)
+    if proc.wait() != 0:
+        return None
+
+    sha.update("\0".join(all_flags).encode("utf-8"))
+    for tool in [spec["cc"]] + spec.get("plugins", []):
+        sha.update(file_identity(tool).encode("utf-8"))
+    return sha.hexdigest()
+
+
+def restore_object(cache, key, output):
+    """
+    Restore an object file and the output of its compilation.
+
+    Returns (tuple(str, str)):
+        The stdout and stderr of the cached compilation, or None, if we
+        have no complete entry for :key:.
+    """
+    import json
+    import shutil
+
+    obj_entry = cache.lookup(key + ".o")
+    out_entry = cache.lookup(key + ".out")
+    if obj_entry is None or out_entry is None:
+        return None
+
+    shutil.copyfile(obj_entry, output)
+    with open(out_entry, 'r') as out_f:
+        outputs = json.load(out_f)
+    return (outputs["stdout"], outputs["stderr"])
+
+
+def store_object(cache, key, output, stdout, stderr):
+    """ Store an object file and the output of its compilation. """
+    import json
+    import shutil
+
+    def write_outputs(tmp):
+        """ Write stdout/stderr of the compilation. """
+        with open(tmp, 'w') as out_f:
+            json.dump({"stdout": stdout, "stderr": stderr}, out_f)
+
+    cache.store(key + ".out", write_outputs)
+    cache.store(key + ".o", lambda tmp: shutil.copyfile(output, tmp))
+
+
+def cached_compile(spec, input_files, cc, flags, extra):
+    """
+    Compile, unless the compile cache has the result already.
+
+    On a hit, we restore the object file and replay the output of the
+    cached compilation, e.g., LLVM's statistics for the compiler extension.
+
+    Returns (tuple(int, plumbum.cmd, str, str)):
+        Just like call_original_compiler.
+    """
+    from pprof.utils.cache import compile_cache
+
+    cflags, ldflags = spec["cflags"], spec["ldflags"]
+    cache = compile_cache()
+    output = None
+    if cache is not None and not has_side_effects(cflags + (extra or [])):
+        output = cacheable(flags)
+    key = compile_key(spec, cc, flags, extra) if output else None
+    if key is None:
+        return call_original_compiler(input_files, cc, cflags, ldflags,
+                                      flags, extra, spec.get("memo"))
+
+    command = compiler_command(input_files, cc, cflags, ldflags, flags,
+                               extra or [])
+    outputs = restore_object(cache, key, output)
+    record_lookup(spec.get("lookups"), outputs is not None)
+    if outputs is not None:
+        stdout, stderr = outputs
+        sys.stdout.write(stdout)
+        sys.stderr.write(stderr)
+        return (0, command, stdout, stderr)
+
+    retcode, final_cc, stdout, stderr = call_original_compiler(
+        input_files, cc, cflags, ldflags, flags, extra, spec.get("memo"))
+    if retcode == 0 and str(final_cc) == str(command) and \
+            os.path.exists(output):
+        store_object(cache, key, output, stdout, stderr)
+    return (retcode, final_cc, stdout, stderr)
+
+
+def fallback_key(input_files, cflags, ldflags, extra):
+    """ Identify the inputs & the hidden flags of a compiler invocation. """
+    import hashlib
+
+    parts = [os.path.abspath(x) for x in input_files] + ["\0"] + \
+        [str(x) for x in cflags + ldflags + (extra or [])]
+    return hashlib.sha1("\0".join(parts).encode("utf-8")).hexdigest()
+
+
+def known_fallbacks(memo):
+    """
+    Read the fallback memo of a build.
+
+    Args:
+        memo (str): The memo file.
+
+    Returns (set(str)):
+        The keys (see fallback_key) of all invocations that needed the
+        fallback to the original flags.
+    """
+    try:
+        with open(memo, 'r') as memo_f:
+            return set(memo_f.read().split())
+    except IOError:
+        return set()
+
+
+def remember_fallback(memo, key):
+    """ Add an invocation to the fallback memo of a build. """
+    import fcntl
+
+    with open(memo, 'a') as memo_f:
+        fcntl.flock(memo_f, fcntl.LOCK_EX)
+        memo_f.write(key + "\n")
+        fcntl.flock(memo_f, fcntl.LOCK_UN)
+
+
+def record_lookup(log, hit):
+    """
+    Add a lookup of the compile cache to the lookup log of a build.
+
+    Every lookup appends a single byte, 'h' for a hit and 'm' for a miss.
+    Appends of a single byte are atomic, concurrent compilations need no
+    lock.
+
+    Args:
+        log (str): The lookup log of this build, or None.
+        hit (bool): True, if the lookup was a hit.
+    """
+    if log is None:
+        return
+    log_fd = os.open(log, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+    try:
+        os.write(log_fd, b"h" if hit else b"m")
+    finally:
+        os.close(log_fd)
+
+
+def known_lookups(log):
+    """
+    Read the lookup log of a build.
+
+    Args:
+        log (str): The lookup log.
+
+    Returns (tuple(int, int)):
+        The number of hits and the number of misses.
+    """
+    try:
+        with open(log, 'r') as log_f:
+            content = log_f.read()
+    except IOError:
+        return (0, 0)
+    return (content.count("h"), content.count("m"))
+
+
+def call_original_compiler(input_files, cc, cflags, ldflags, flags,
+                           extra=None, memo=None):
+    """
+    Call the real compiler with the hidden flags injected.
+
+    If the compilation fails with the hidden flags, we retry with the flags
+    of the build system only. We remember this decision in the memo file,
+    the next time we compile the same inputs with the same hidden flags we
+    skip the failing attempt.
+
+    Args:
+        extra (list(str)): Flags the compiler extension needs, these are
+            kept in the retry.
+        memo (str): The fallback memo of this build.
+
+    Returns (tuple(int, plumbum.cmd, str, str)):
+        The exit code, the compiler command we executed and its stdout and
+        stderr.
+    """
+    from logging import getLogger
+    from plumbum import ProcessExecutionError
+    from pprof.utils.run import GuardedRunException
+
+    log = getLogger("clang")
+    extra = extra or []
+    key = fallback_key(input_files, cflags, ldflags, extra)
+    if memo is not None and input_files and key in known_fallbacks(memo):
+        final_command = cc[flags, ldflags, extra]
+        log.info("Known fallback - %s", str(final_command))
+        retcode, stdout, stderr = really_exec(final_command)
+        return (retcode, final_command, stdout, stderr)
+
+    try:
+        final_command = compiler_command(input_files, cc, cflags, ldflags,
+                                         flags, extra)
+        retcode, stdout, stderr = really_exec(final_command)
+
+    except (GuardedRunException, ProcessExecutionError):
+        log.warning("Fallback to original flags and retry.")
+        final_command = cc[flags, ldflags, extra]
+        log.warning("New Command: %s", str(final_command))
+        retcode, stdout, stderr = really_exec(final_command)
+        if memo is not None and input_files:
+            remember_fallback(memo, key)
+
+    return (retcode, final_command, stdout, stderr)
+
+
+def compile_and_record(spec, flags, extension=None):
+    """
+    Compile with the hidden flags and run the compiler extension.
+
+    This is the job of a wrapped compiler. It runs inside a worker of the
+    compile server or, on the slow path, in a fresh interpreter.
+
+    Args:
+        spec (dict): The specification of the wrapped compiler.
+        flags (list(str)): The arguments of the build system.
+        extension (callable): The compiler extension, if we loaded it
+            already. Otherwise we load it from the wrapper's blob.
+
+    Returns (int):
+        The exit code of the compiler.
+    """
+    from plumbum import local
+
+    config.update(spec["config"])
+    cc = local[spec["cc"]]
+    input_files = [x for x in flags if not x.startswith('-')]
+
+    # FIXME: This is just a quick workaround.
+    if "conftest.c" in input_files:
+        extension = None
+    elif extension is None:
+        extension = load_extension(spec["blob"])
+
+    # A single-pass extension gets the outcome of our compilation, instead
+    # of compiling the translation unit again.
+    extra = getattr(extension, "compile_flags", None)
+    retcode, final_cc, stdout, stderr = cached_compile(
+        spec, input_files, cc, flags, extra)
+
+    if extension is not None:
+        kwargs = {}
+        if not sys.stdin.isatty():
+            kwargs["has_stdin"] = True
+        if extra is not None:
+            kwargs.update(retcode=retcode, stdout=stdout, stderr=stderr)
+        with local.env(PPROF_CMD=str(final_cc), **spec["env"]):
+            extension(final_cc, **kwargs)
+    return retcode
+
+
+def recv_request(conn):
+    """
+    Receive a request of a client shim.
+
+    Returns (tuple(dict, list(int))):
+        The request and the file descriptors (stdin, stdout, stderr) of the
+        client.
+    """
+    import array
+
+    fds = array.array("i")
+    msg, ancdata, _, _ = conn.recvmsg(
+        HEADER.size, socket.CMSG_LEN(3 * fds.itemsize))
+    for level, kind, data in ancdata:
+        if level == socket.SOL_SOCKET and kind == socket.SCM_RIGHTS:
+            fds.frombytes(data[:len(data) - (len(data) % fds.itemsize)])
+
+    while len(msg) < HEADER.size:
+        msg += conn.recv(HEADER.size - len(msg))
+    length = HEADER.unpack(msg)[0]
+    payload = b""
+    while len(payload) < length:
+        chunk = conn.recv(length - len(payload))
+        if not chunk:
+            raise IOError("Incomplete request from compiler shim.")
+        payload += chunk
+    return (json.loads(payload.decode("utf-8")), list(fds))
+
+
+class CompileServer(object):
+    """ Serve the compile requests of one wrapped compiler. """
+
+    def __init__(self, spec_path):
+        """
+        Args:
+            spec_path (str): The specification of the wrapped compiler.
+        """
+        self.spec_path = spec_path
+        self.spec = load_spec(spec_path)
+        self.extension = None
+        self.extension_mtime = None
+
+    def extension_for_request(self):
+        """
+        Get the compiler extension, reload it if the wrapper changed.
+
+        The extension is loaded once and then shared with all workers,
+        unless the wrapper has been regenerated in the meantime.
+        """
+        blob = self.spec["blob"]
+        mtime = os.path.getmtime(blob) if os.path.exists(blob) else None
+        if mtime != self.extension_mtime:
+            self.extension = load_extension(blob)
+            self.extension_mtime = mtime
+        return self.extension
+
+    def handle(self, conn):
+        """
+        Handle one request inside a forked worker.
+
+        Args:
+            conn (socket.socket): The connection to the client shim.
+        """
+        from plumbum import local
+
+        request, fds = recv_request(conn)
+        retcode = 1
+        try:
+            for target, fd in enumerate(fds[:3]):
+                if fd != target:
+                    os.dup2(fd, target)
+                    os.close(fd)
+            os.environ.clear()
+            os.environ.update(request["env"])
+            local.env.clear()
+            local.env.update(**request["env"])
+            local.cwd.chdir(request["cwd"])
+
+            self.spec = load_spec(self.spec_path)
+            retcode = compile_and_record(self.spec, request["argv"],
+                                         self.extension)
+        except Exception as ex:  # pylint: disable=W0703
+            sys.stderr.write("pprof compile server: {}\n".format(ex))
+        finally:
+            sys.stdout.flush()
+            sys.stderr.flush()
+            conn.sendall("{:d}\n".format(retcode).encode("ascii"))
+            conn.close()
+
+    def serve(self, sock_path, idle_timeout):
+        """
+        Accept requests, until we were idle for :idle_timeout: seconds.
+
+        Only one server may serve a socket, all other servers exit silently.
+        """
+        import fcntl
+        import select
+
+        lock_f = open(sock_path + ".lock", 'w')
+        try:
+            fcntl.flock(lock_f, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except IOError:
+            return
+
+        if os.path.exists(sock_path):
+            os.remove(sock_path)
+        server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        server.bind(sock_path)
+        server.listen(128)
+
+        workers = set()
+        try:
+            while True:
+                ready, _, _ = select.select([server], [], [], idle_timeout)
+                workers = reap(workers)
+                if not ready:
+                    if workers:
+                        continue
+                    break
+
+                conn, _ = server.accept()
+                self.extension_for_request()
+                pid = os.fork()
+                if pid == 0:
+                    server.close()
+                    try:
+                        self.handle(conn)
+                    finally:
+                        os._exit(0)  # pylint: disable=W0212
+                conn.close()
+                workers.add(pid)
+        finally:
+            os.remove(sock_path)
+            server.close()
+            lock_f.close()
+
+
+def reap(workers):
+    """ Collect all finished workers, return the ones still running. """
+    running = set()
+    for pid in workers:
+        try:
+            done, _ = os.waitpid(pid, os.WNOHANG)
+        except ChildProcessError:
+            continue
+        if done == 0:
+            running.add(pid)
+    return running
+
+
+SHIM_TEMPLATE = '''#!{python} -S
+#
+# pprof compiler shim. Talks to the compile server of this wrapper, see
+# pprof.utils.compile_server.
+import json
+import os
+import socket
+import struct
+import sys
+
+SOCK = "{sock}"
+SPEC = "{spec}"
+SERVER = {server}
+
+
+def slow_path():
+    os.execv("{python}", ["{python}", "-m", "pprof.utils.compile_server",
+                          "exec", SPEC] + sys.argv[1:])
+
+
+def start_server():
+    pid = os.fork()
+    if pid == 0:
+        os.setsid()
+        if os.fork() == 0:
+            null = os.open(os.devnull, os.O_RDWR)
+            for fd in [0, 1, 2]:
+                os.dup2(null, fd)
+            os.execv("{python}", ["{python}", "-m",
+                                  "pprof.utils.compile_server", "serve",
+                                  SPEC])
+        os._exit(0)
+    os.waitpid(pid, 0)
+
+
+if not SERVER:
+    slow_path()
+
+conn = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+try:
+    conn.connect(SOCK)
+except (IOError, OSError):
+    start_server()
+    slow_path()
+
+payload = json.dumps({{"argv": sys.argv[1:], "cwd": os.getcwd(),
+                       "env": dict(os.environ)}}).encode("utf-8")
+fds = struct.pack("3i", 0, 1, 2)
+reply = b""
+try:
+    conn.sendmsg([struct.pack("!I", len(payload))],
+                 [(socket.SOL_SOCKET, socket.SCM_RIGHTS, fds)])
+    conn.sendall(payload)
+    while not reply.endswith(b"\\n"):
+        chunk = conn.recv(16)
+        if not chunk:
+            break
+        reply += chunk
+except (IOError, OSError):
+    pass
+
+if not reply.endswith(b"\\n"):
+    # The server went away, e.g., it shut down after its idle timeout
+    # while we connected. Compile without it.
+    conn.close()
+    slow_path()
+sys.exit(int(reply))
+'''
+
+
+def main(argv):
+    """
+    Entry point of the compile server and of the slow path.
+
+        python3 -m pprof.utils.compile_server serve <spec>
+        python3 -m pprof.utils.compile_server exec <spec> <compiler args>
+    """
+    import logging
+
+    logging.getLogger("clang").addHandler(
+        logging.StreamHandler(stream=sys.stderr))
+    mode, spec_path = argv[0], argv[1]
+    spec = load_spec(spec_path)
+    if mode == "serve":
+        config.update(spec["config"])
+        CompileServer(spec_path).serve(spec["socket"],
+                                       float(spec["timeout"]))
+        return 0
+    return compile_and_record(spec, argv[2:])
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
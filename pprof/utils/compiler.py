@@ -14,6 +14,7 @@ to the real clang/clang++ given the additional cflags&ldflags.
 
 The wrapper-script generated for both functions can be found inside:
     * print_libtool_sucks_wrapper()
+It is a small client of a compile server, see pprof.utils.compile_server.
 
 The remaining methods:
     * llvm()
@@ -26,6 +27,9 @@ configured llvm/clang source directories.
 """
 from pprof.settings import config
 
+FALLBACK_F_EXT = ".fallbacks"
+LOOKUP_F_EXT = ".lookups"
+
 
 def lt_clang(cflags, ldflags, func=None):
     """
@@ -37,7 +41,8 @@ def lt_clang(cflags, ldflags, func=None):
     Args:
         cflags: The CFLAGS we want to hide.
         ldflags: The LDFLAGS we want to hide.
-        func (optional): A function that will be pickled alongside the compiler.
+        func (optional): A registered runner that will be stored alongside
+            the compiler.
             It will be called before the actual compilation took place. This
             way you can intercept the compilation process with arbitrary python
             code.
@@ -61,7 +66,8 @@ def lt_clang_cxx(cflags, ldflags, func=None):
     Args:
         cflags: The CFLAGS we want to hide.
         ldflags: The LDFLAGS we want to hide.
-        func (optional): A function that will be pickled alongside the compiler.
+        func (optional): A registered runner that will be stored alongside
+            the compiler.
             It will be called before the actual compilation took place. This
             way you can intercept the compilation process with arbitrary python
             code.
@@ -93,113 +99,59 @@ def print_libtool_sucks_wrapper(filepath, cflags, ldflags, compiler, func):
         Command of the new compiler we can call.
     """
     from plumbum.cmd import chmod
-    import dill
-    from pprof.project import PROJECT_BLOB_F_EXT
-    from os.path import abspath
-
-    blob_f = abspath(filepath + PROJECT_BLOB_F_EXT)
+    import json
+    import sys
+    from pprof.project import PROJECT_BLOB_F_EXT, wrapper_env
+    from pprof.utils.registry import dump_runner
+    from pprof.utils.compile_server import SHIM_TEMPLATE, SPEC_F_EXT, \
+        socket_path
+    from os import path, remove
+
+    filepath = path.abspath(filepath)
+    blob_f = filepath + PROJECT_BLOB_F_EXT
     if func is not None:
-        with open(blob_f, 'wb') as blob:
-            blob.write(dill.dumps(func))
+        dump_runner(func, blob_f)
+
+    spec_f = filepath + SPEC_F_EXT
+    spec = {
+        "cc": str(compiler()),
+        "cflags": [str(flag) for flag in cflags],
+        "ldflags": [str(flag) for flag in ldflags],
+        "blob": blob_f,
+        "socket": socket_path(filepath),
+        "timeout": config["compile_server_timeout"],
+        "plugins": [path.join(llvm_libs(), "LLVMPolyJIT.so")],
+        "memo": filepath + FALLBACK_F_EXT,
+        "lookups": filepath + LOOKUP_F_EXT,
+        "env": wrapper_env(),
+        "config": {
+            "db_host": config["db_host"],
+            "db_port": config["db_port"],
+            "db_name": config["db_name"],
+            "db_user": config["db_user"],
+            "db_pass": config["db_pass"],
+            "db_backend": config["db_backend"],
+            "db_path": config["db_path"],
+            "spool_dir": config["spool_dir"],
+            "compile_cache": config["compile_cache"],
+            "compile_cache_size": config["compile_cache_size"],
+            "db_create": False
+        }
+    }
+    with open(spec_f, 'w') as spec_file:
+        json.dump(spec, spec_file)
+    # The lookup log counts the lookups of this build only.
+    if path.exists(spec["lookups"]):
+        remove(spec["lookups"])
 
     with open(filepath, 'w') as wrapper:
-        lines = '''#!/usr/bin/env python3
-#
-
-from plumbum import ProcessExecutionError, local, FG
-from plumbum.commands.modifiers import TEE
-from pprof.utils.run import GuardedRunException
-from os import path
-import logging
-import dill
-
-from pprof.settings import config
-config["db_host"] = "{db_host}"
-config["db_port"] = "{db_port}"
-config["db_name"] = "{db_name}"
-config["db_user"] = "{db_user}"
-config["db_pass"] = "{db_pass}"
-
-cc=local[\"{CC}\"]
-cflags={CFLAGS}
-ldflags={LDFLAGS}
-
-from sys import argv
-import os
-import sys
-
-log = logging.getLogger("clang")
-log.addHandler(logging.StreamHandler(stream=sys.stderr))
-
-def really_exec(cmd):
-    from plumbum.cmd import timeout
-    try:
-        log.info("Trying - %s", str(cmd))
-        return ( timeout["2m", cmd.formulate()] & TEE )
-    except (GuardedRunException, ProcessExecutionError) as e:
-        log.error("Failed to execute - %s", str(cmd))
-        raise e
-
-
-def call_original_compiler(input_files, cc, cflags, ldflags, flags):
-    final_command = None
-    retcode=0
-    try:
-        if len(input_files) > 0:
-            if "-c" in flags:
-                final_command = cc["-Qunused-arguments", cflags, ldflags, flags]
-            else:
-                final_command = cc["-Qunused-arguments", cflags, flags, ldflags]
-        else:
-            final_command = cc["-Qunused-arguments", flags]
-
-        retcode, stdout, stderr = really_exec(final_command)
-
-    except (GuardedRunException, ProcessExecutionError) as e:
-        log.warn("Fallback to original flags and retry.")
-        final_command = cc[flags, ldflags]
-        log.warn("New Command: %s", str(final_command))
-        retcode, _, _ = really_exec(final_command)
-
-    return (retcode, final_command)
-
-
-input_files = [ x for x in argv[1:] if not '-' is x[0] ]
-flags = argv[1:]
-f = None
-
-retcode, final_cc = call_original_compiler(input_files, cc, cflags, ldflags,
-                                           flags)
-
-with local.env(PPROF_DB_HOST="{db_host}",
-           PPROF_DB_PORT="{db_port}",
-           PPROF_DB_NAME="{db_name}",
-           PPROF_DB_USER="{db_user}",
-           PPROF_DB_PASS="{db_pass}"):
-    """ FIXME: This is just a quick workaround. """
-    if "conftest.c" not in input_files:
-        with local.env(PPROF_CMD=str(final_cc)):
-            if path.exists("{blobf}"):
-                with open("{blobf}", "rb") as p:
-                    f = dill.load(p)
-
-            if f is not None:
-                if not sys.stdin.isatty():
-                    f(final_cc, has_stdin = True)
-                else:
-                    f(final_cc)
-    sys.exit(retcode)
-'''.format(CC=str(compiler()),
-           CFLAGS=cflags,
-           LDFLAGS=ldflags,
-           blobf=blob_f,
-           db_host=config["db_host"],
-           db_name=config["db_name"],
-           db_user=config["db_user"],
-           db_pass=config["db_pass"],
-           db_port=config["db_port"])
-        wrapper.write(lines)
-        chmod("+x", filepath)
+        wrapper.write(SHIM_TEMPLATE.format(
+            python=sys.executable,
+            sock=spec["socket"],
+            spec=spec_f,
+            server=bool(config["compile_server"] not in
+                        [False, "0", "false", "False", "no"])))
+    chmod("+x", filepath)
 
 
 def llvm():
@@ -259,3 +211,65 @@ def clang():
     from os import path
     from plumbum import local
     return local[path.join(llvm(), "clang")]
+
+
+def wrapper_files(builddir, ext):
+    """
+    Find the files of all wrapped compilers below a build directory.
+
+    Args:
+        builddir (str): The build directory of a project.
+        ext (str): The extension of the files we want, e.g., FALLBACK_F_EXT.
+
+    Returns (list(str)):
+        The paths of all files with the extension :ext:.
+    """
+    from os import path, walk
+
+    return [path.join(root, name) for root, _, files in walk(builddir)
+            for name in files if name.endswith(ext)]
+
+
+def count_fallbacks(builddir):
+    """
+    Count the compilations that needed the fallback to the original flags.
+
+    Every wrapped compiler keeps a memo of these compilations next to its
+    wrapper script, see pprof.utils.compile_server.
+
+    Args:
+        builddir (str): The build directory of a project, we search all
+            wrappers below it.
+
+    Returns (int):
+        The number of compilations that needed the fallback.
+    """
+    from pprof.utils.compile_server import known_fallbacks
+
+    return sum([len(known_fallbacks(memo))
+                for memo in wrapper_files(builddir, FALLBACK_F_EXT)])
+
+
+def count_cache_lookups(builddir):
+    """
+    Count the lookups of the compile cache during a build.
+
+    Every wrapped compiler logs its lookups next to its wrapper script, see
+    pprof.utils.compile_server. The log starts empty, when the wrapper is
+    generated, so we only count the lookups of the last build.
+
+    Args:
+        builddir (str): The build directory of a project, we search all
+            wrappers below it.
+
+    Returns (tuple(int, int)):
+        The number of hits and the number of misses.
+    """
+    from pprof.utils.compile_server import known_lookups
+
+    hits, misses = 0, 0
+    for log in wrapper_files(builddir, LOOKUP_F_EXT):
+        log_hits, log_misses = known_lookups(log)
+        hits += log_hits
+        misses += log_misses
+    return (hits, misses)
@@ -1,6 +1,44 @@
 """Database support module for the pprof study."""
+from contextlib import contextmanager
 from pprof.settings import config
 
+# The sessions of all active batches, see batch_session.
+BATCH_SESSIONS = []
+
+
+@contextmanager
+def batch_session():
+    """
+    Share a single db session between all runs created in this context.
+
+    Runners commit the session of a run several times (begin, end,
+    persist_*). Every commit of a database session is a real, short
+    transaction: the run exists before its binary starts (programs that
+    report under PPROF_DB_RUN_ID need it) and no transaction stays open
+    while a binary runs. A spool session defers all commits and writes the
+    whole batch with a single append, when we leave the context.
+
+    Yields:
+        The shared session.
+    """
+    from pprof.utils import schema
+    from pprof.utils import spool
+
+    if spool.spool_enabled():
+        session = spool.SpoolSession(deferred=True)
+    else:
+        session = schema.Session()
+
+    BATCH_SESSIONS.append(session)
+    try:
+        yield session
+    finally:
+        BATCH_SESSIONS.pop()
+        if isinstance(session, spool.SpoolSession):
+            session.deferred = False
+        session.commit()
+        session.close()
+
 
 def create_run(cmd, prj, exp, grp):
     """
@@ -19,16 +57,25 @@ def create_run(cmd, prj, exp, grp):
 
     Returns:
         The inserted tuple representing the run and the session opened with
-        the new run. Don't forget to commit it at some point.
+        the new run. Don't forget to commit it at some point. Inside a
+        batch_session, all runs share the session of the batch.
     """
     from pprof.utils import schema as s
+    from pprof.utils import spool
 
-    session = s.Session()
     run = s.Run(command=str(cmd),
                 project_name=prj,
                 experiment_name=exp,
                 run_group=str(grp),
                 experiment_group=str(config["experiment"]))
+    if spool.spool_enabled():
+        session = BATCH_SESSIONS[-1] if BATCH_SESSIONS \
+            else spool.SpoolSession()
+        run.id = spool.local_run_id()
+    elif BATCH_SESSIONS:
+        session = BATCH_SESSIONS[-1]
+    else:
+        session = s.Session()
     session.add(run)
     session.flush()
 
@@ -52,8 +99,12 @@ def create_run_group(prj):
         the transaction object.
     """
     from pprof.utils import schema
+    from pprof.utils import spool
 
-    session = schema.Session()
+    if spool.spool_enabled():
+        session = spool.SpoolSession()
+    else:
+        session = schema.Session()
     group = schema.RunGroup(id=prj.run_uuid,
                             project=prj.name,
                             experiment=config["experiment"])
@@ -71,9 +122,15 @@ def persist_project(project):
         project: The project we want to persist.
     """
     from pprof.utils import schema
-    session = schema.Session()
-    db_project = session.query(schema.Project).filter(schema.Project.name ==
-                                                      project.name).first()
+    from pprof.utils import spool
+
+    if spool.spool_enabled():
+        session = spool.SpoolSession()
+        db_project = schema.Project()
+    else:
+        session = schema.Session()
+        db_project = session.query(schema.Project).filter(
+            schema.Project.name == project.name).first()
     if db_project is None:
         db_project = schema.Project()
     db_project.name = project.name
@@ -97,12 +154,15 @@ def persist_experiment(experiment):
         experiment: The experiment we want to persist.
     """
     from pprof.utils import schema
-
-    session = schema.Session()
-
-    db_exp = session.query(schema.Experiment).filter(schema.Experiment.id ==
-                                                     config[
-                                                         'experiment']).first()
+    from pprof.utils import spool
+
+    if spool.spool_enabled():
+        session = spool.SpoolSession()
+        db_exp = None
+    else:
+        session = schema.Session()
+        db_exp = session.query(schema.Experiment).filter(
+            schema.Experiment.id == config['experiment']).first()
     if db_exp is None:
         db_exp = schema.Experiment()
     db_exp.name = experiment.name
@@ -114,6 +174,61 @@ def persist_experiment(experiment):
     return (db_exp, session)
 
 
+def completed_run_groups(experiment_id):
+    """
+    Get the configurations of an experiment that completed successfully.
+
+    Args:
+        experiment_id: The experiment UUID we look at.
+
+    Returns (dict(str, set(str))):
+        Maps every project that completed at least one run group to the core
+        counts (the 'cores' config of its runs) of its completed run groups.
+        A run group without a core count is recorded as None.
+    """
+    from sqlalchemy import and_
+    from pprof.utils import schema as s
+
+    session = s.Session()
+    query = session.query(s.RunGroup.project, s.Config.value) \
+        .outerjoin(s.Run, s.Run.run_group == s.RunGroup.id) \
+        .outerjoin(s.Config, and_(s.Config.run_id == s.Run.id,
+                                  s.Config.name == "cores")) \
+        .filter(s.RunGroup.experiment == experiment_id) \
+        .filter(s.RunGroup.status == 'completed') \
+        .distinct()
+
+    completed = {}
+    for project, cores in query:
+        completed.setdefault(project, set()).add(cores)
+    session.close()
+    return completed
+
+
+def bulk_insert(session, table, rows, batch_size=1000):
+    """
+    Insert many rows into a table with as few round trips as possible.
+
+    The rows are sent as multi-row INSERT statements of up to
+    :batch_size: rows each, instead of one statement per ORM object.
+
+    Args:
+        session: The db transaction we belong to.
+        table: The mapped class of the table, e.g., schema.Metric.
+        rows (list(dict)): The rows we want to insert, as column -> value.
+        batch_size (int): Maximum number of rows per statement.
+    """
+    from pprof.utils.spool import SpoolSession
+
+    if isinstance(session, SpoolSession):
+        session.insert(table, rows)
+        return
+
+    for i in range(0, len(rows), batch_size):
+        batch = rows[i:i + batch_size]
+        session.execute(table.__table__.insert().values(batch))
+
+
 def persist_likwid(run, session, measurements):
     """
     Persist all likwid results.
@@ -125,62 +240,141 @@ def persist_likwid(run, session, measurements):
     """
     from pprof.utils import schema as s
 
-    for (region, name, core, value) in measurements:
-        db_measurement = s.Likwid(metric=name,
-                                  region=region,
-                                  value=value,
-                                  core=core,
-                                  run_id=run.id)
-        session.add(db_measurement)
+    bulk_insert(session, s.Likwid, [{"metric": name,
+                                     "region": region,
+                                     "value": value,
+                                     "core": core,
+                                     "run_id": run.id}
+                                    for (region, name, core, value)
+                                    in measurements])
     session.commit()
 
 
-def persist_time(run, session, timings):
+def persist_likwid_batches(run, session, batches):
     """
-    Persist the run results in the database.
+    Persist likwid results, as they come out of the parser.
+
+    Every batch goes to the database as a single bulk insert, we never hold
+    more than one batch in memory.
+
+    Args:
+        run: The run we attach our measurements to.
+        session: The db transaction we belong to.
+        batches: The batches of measurements, see
+            pprof.likwid.read_likwid_batches.
+    """
+    from pprof.utils import schema as s
+
+    for batch in batches:
+        bulk_insert(session, s.Likwid, [
+            {"metric": metric, "region": region, "value": value,
+             "core": core, "run_id": run.id}
+            for (region, metric, core, value) in zip(
+                batch.region.tolist(), batch.metric.tolist(),
+                batch.core.tolist(), batch.value.tolist())])
+    session.commit()
+
+
+def load_likwid_regions(session, run_group):
+    """
+    Load the likwid results of a run group as one view per region.
+
+    Every run of a group rotation is tagged with its group (the
+    'likwid.group' config), the view merges the groups of all runs.
 
     Args:
-        run: The run we attach this timing results to.
         session: The db transaction we belong to.
-        timings: The timing measurements we want to store.
+        run_group (str): The run group, i.e., the UUID of a project run.
+
+    Returns (dict(str, dict(str, dict(str, float)))):
+        See pprof.likwid.merge_regions.
+    """
+    from sqlalchemy import and_
+    from pprof.likwid import merge_regions
+    from pprof.utils import schema as s
+
+    query = session.query(s.Config.value, s.Likwid.region, s.Likwid.metric,
+                          s.Likwid.core, s.Likwid.value) \
+        .join(s.Run, s.Run.id == s.Likwid.run_id) \
+        .outerjoin(s.Config, and_(s.Config.run_id == s.Run.id,
+                                  s.Config.name == "likwid.group")) \
+        .filter(s.Run.run_group == str(run_group))
+    return merge_regions([("" if group is None or "," in group else group,
+                           region, metric, core, value)
+                          for group, region, metric, core, value in query])
+
+
+def persist_metrics(run, session, metrics):
+    """
+    Persist a set of named metrics.
+
+    Args:
+        run: The run we attach the metrics to.
+        session: The db transaction we belong to.
+        metrics (dict(str, float)): The metrics we want to store.
     """
     from pprof.utils import schema as s
 
-    for timing in timings:
-        session.add(s.Metric(name="time.user_s",
-                             value=timing[0],
-                             run_id=run.id))
-        session.add(s.Metric(name="time.system_s",
-                             value=timing[1],
-                             run_id=run.id))
-        session.add(s.Metric(name="time.real_s",
-                             value=timing[2],
-                             run_id=run.id))
+    bulk_insert(session, s.Metric, [{"name": name,
+                                     "value": metrics[name],
+                                     "run_id": run.id} for name in metrics])
     session.commit()
 
 
-def persist_perf(run, session, svg_path):
+def persist_perf(run, session, folded):
     """
-    Persist the flamegraph in the database.
+    Persist the folded call stacks of a perf recording.
 
-    The flamegraph exists as a SVG image on disk until we persist it in the
-    database.
+    The stacks are stored once as compressed blob (see pprof.perf for the
+    encoding), the run refers to it with its 'perf.folded' metadata.
+    Flamegraphs are rendered from them on demand, see ``pprof flamegraph``.
 
     Args:
         run: The run we attach these perf measurements to.
         session: The db transaction we belong to.
-        svg_path: The path to the SVG file we want to store.
+        folded (dict(tuple(str), int)): The folded call stacks.
     """
+    import os
+    from tempfile import mkstemp
+    from pprof.perf import encode_folded
     from pprof.utils import schema as s
 
-    with open(svg_path, 'r') as svg_file:
-        svg_data = svg_file.read()
-        session.add(s.Metadata(name="perf.flamegraph",
-                               value=svg_data,
-                               run_id=run.id))
+    fd, folded_path = mkstemp(prefix="pprof-", suffix=".folded")
+    try:
+        with os.fdopen(fd, 'wb') as folded_f:
+            folded_f.write(encode_folded(folded))
+        blob_id = persist_blob(session, folded_path)
+    finally:
+        os.remove(folded_path)
+
+    session.add(s.Metadata(name="perf.folded", value=blob_id, run_id=run.id))
     session.commit()
 
 
+def load_perf(session, run_id):
+    """
+    Load the folded call stacks of a run.
+
+    Args:
+        session: The db transaction we belong to.
+        run_id (int): The id of the run.
+
+    Returns (dict(tuple(str), int)):
+        The folded call stacks, or None, if the run has none.
+    """
+    from pprof.perf import decode_folded
+    from pprof.utils import schema as s
+
+    ref = session.query(s.Metadata).filter(
+        s.Metadata.run_id == run_id, s.Metadata.name == "perf.folded").first()
+    if ref is None:
+        return None
+    data = load_blob(session, ref.value)
+    if data is None:
+        return None
+    return decode_folded(data)
+
+
 def persist_compilestats(run, session, stats):
     """
     Persist the run results in the database.
@@ -190,9 +384,13 @@ def persist_compilestats(run, session, stats):
         session: The db transaction we belong to.
         stats: The stats we want to store in the database.
     """
-    for stat in stats:
-        stat.run_id = run.id
-        session.add(stat)
+    from pprof.utils import schema as s
+
+    bulk_insert(session, s.CompileStat, [{"name": stat.name,
+                                          "component": stat.component,
+                                          "value": stat.value,
+                                          "run_id": run.id}
+                                         for stat in stats])
     session.commit()
 
 
@@ -207,8 +405,163 @@ def persist_config(run, session, cfg):
     """
     from pprof.utils import schema as s
 
-    for cfg_elem in cfg:
-        session.add(s.Config(name=cfg_elem,
-                             value=cfg[cfg_elem],
-                             run_id=run.id))
+    bulk_insert(session, s.Config, [{"name": cfg_elem,
+                                     "value": cfg[cfg_elem],
+                                     "run_id": run.id} for cfg_elem in cfg])
+    session.commit()
+
+
+def persist_blob(session, blob_path):
+    """
+    Store the contents of a file as a compressed blob.
+
+    The file is hashed & compressed in chunks, it never has to fit into
+    memory uncompressed. If a blob with the same contents exists already,
+    we do not store it again. Concurrent writers of the same blob do not
+    conflict, the first one wins.
+
+    Args:
+        session: The db transaction we belong to.
+        blob_path (str): The file we want to store.
+
+    Returns (str):
+        The id of the blob.
+    """
+    import hashlib
+    import zlib
+    from pprof.utils import schema as s
+    from pprof.utils.spool import SpoolSession
+
+    sha = hashlib.sha256()
+    compressor = zlib.compressobj(6)
+    chunks = []
+    size = 0
+    with open(blob_path, 'rb') as blob_f:
+        for chunk in iter(lambda: blob_f.read(1 << 16), b''):
+            sha.update(chunk)
+            size += len(chunk)
+            chunks.append(compressor.compress(chunk))
+    chunks.append(compressor.flush())
+    blob_id = sha.hexdigest()
+
+    row = {"id": blob_id, "size": size, "encoding": "zlib",
+           "data": b"".join(chunks)}
+    if isinstance(session, SpoolSession):
+        session.insert(s.Blob, [row])
+    elif session.query(s.Blob.id).filter(s.Blob.id == blob_id).first() is None:
+        insert_blob(session, row)
+    return blob_id
+
+
+def insert_blob(session, row):
+    """
+    Insert a blob, unless another writer stored it in the meantime.
+
+    Args:
+        session: The db transaction we belong to.
+        row (dict): The blob, as column -> value.
+    """
+    from sqlalchemy.exc import IntegrityError
+    from pprof.utils import schema as s
+
+    insert = s.Blob.__table__.insert()
+    if session.get_bind().dialect.name == "sqlite":
+        session.execute(insert.prefix_with("OR IGNORE"), row)
+        return
+
+    try:
+        with session.begin_nested():
+            session.execute(insert, row)
+    except IntegrityError:
+        # A concurrent writer stored the same contents first.
+        pass
+
+
+def load_blob(session, blob_id):
+    """
+    Load the uncompressed contents of a blob.
+
+    Args:
+        session: The db transaction we belong to.
+        blob_id (str): The id of the blob.
+
+    Returns (bytes):
+        The contents of the blob, or None, if there is no such blob.
+    """
+    import zlib
+    from pprof.utils import schema as s
+
+    blob = session.query(s.Blob).filter(s.Blob.id == blob_id).first()
+    if blob is None:
+        return None
+    if blob.encoding == "zlib":
+        return zlib.decompress(blob.data)
+    return blob.data
+
+
+def persist_log_blob(run, session, stream, log_path):
+    """
+    Store the complete output of a run out of line.
+
+    Args:
+        run: The run the output belongs to.
+        session: The db transaction we belong to.
+        stream (str): The name of the output, 'stdout' or 'stderr'.
+        log_path (str): The file that captured the output.
+    """
+    from pprof.utils import schema as s
+
+    blob_id = persist_blob(session, log_path)
+    bulk_insert(session, s.LogBlob, [{"run_id": run.id,
+                                      "stream": stream,
+                                      "blob_id": blob_id}])
+
+
+def load_log_blob(session, run_id, stream):
+    """
+    Load the complete output of a run.
+
+    Args:
+        session: The db transaction we belong to.
+        run_id (int): The id of the run.
+        stream (str): The name of the output, 'stdout' or 'stderr'.
+
+    Returns (str):
+        The complete output, or None, if the log holds the complete output
+        already.
+    """
+    from pprof.utils import schema as s
+
+    ref = session.query(s.LogBlob).filter(s.LogBlob.run_id == run_id,
+                                          s.LogBlob.stream == stream).first()
+    if ref is None:
+        return None
+    data = load_blob(session, ref.blob_id)
+    if data is None:
+        return None
+    return data.decode("utf-8", errors="replace")
+
+
+def persist_global_config(cfg):
+    """
+    Persist experiment wide key-value pairs.
+
+    Args:
+        cfg (dict(str, str)): The configuration we want to persist.
+    """
+    from pprof.utils import schema as s
+    from pprof.utils import spool
+
+    if spool.spool_enabled():
+        session = spool.SpoolSession()
+        store = session.add
+    else:
+        session = s.Session()
+        store = session.merge
+
+    for name in cfg:
+        store(s.GlobalConfig(experiment_group=config["experiment"],
+                             name=name,
+                             value=str(cfg[name])))
     session.commit()
+    session.close()
@@ -9,10 +9,38 @@ in PPROF_TMP_DIR, nothing will be downloaded at all.
 
 Supported methods:
         Copy, CopyNoFail, Wget, Git, Svn, Rsync
+
+Several processes may fetch the same source at the same time, e.g.,
+concurrent projects that share a tarball. Every fetch of a target holds an
+exclusive lock on it (see source_lock), downloads never overlap and nobody
+copies a half-written target.
 """
+from contextlib import contextmanager
 from pprof.settings import config
 
 
+@contextmanager
+def source_lock(tgt_name, tgt_root):
+    """
+    Hold an exclusive lock on a download target.
+
+    Args:
+        tgt_name (str): The name of the target in :tgt_root:.
+        tgt_root (str): The directory of the target.
+    """
+    import fcntl
+    import os
+
+    if not os.path.exists(tgt_root):
+        os.makedirs(tgt_root, exist_ok=True)
+    with open(os.path.join(tgt_root, tgt_name + ".lock"), 'a') as lock_f:
+        fcntl.flock(lock_f, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock_f, fcntl.LOCK_UN)
+
+
 def get_hash_of_dirs(directory):
     """
     Recursively hash the contents of the given directory.
@@ -141,17 +169,22 @@ def Wget(src_url, tgt_name, tgt_root=None):
     if tgt_root is None:
         tgt_root = config["tmpdir"]
 
+    import os
     from os import path
     from plumbum.cmd import wget
 
     src_path = path.join(tgt_root, tgt_name)
-    if not source_required(tgt_name, tgt_root):
+    with source_lock(tgt_name, tgt_root):
+        if source_required(tgt_name, tgt_root):
+            part_path = "{}.part-{:d}".format(src_path, os.getpid())
+            try:
+                wget(src_url, "-O", part_path)
+                os.replace(part_path, src_path)
+            finally:
+                if path.exists(part_path):
+                    os.remove(part_path)
+            update_hash(tgt_name, tgt_root)
         Copy(src_path, ".")
-        return
-
-    wget(src_url, "-O", src_path)
-    update_hash(tgt_name, tgt_root)
-    Copy(src_path, ".")
 
 
 def Git(src_url, tgt_name, tgt_root=None):
@@ -171,13 +204,11 @@ def Git(src_url, tgt_name, tgt_root=None):
     from plumbum.cmd import git
 
     src_dir = path.join(tgt_root, tgt_name)
-    if not source_required(tgt_name, tgt_root):
+    with source_lock(tgt_name, tgt_root):
+        if source_required(tgt_name, tgt_root):
+            git("clone", "--depth", "1", src_url, src_dir)
+            update_hash(tgt_name, tgt_root)
         Copy(src_dir, ".")
-        return
-
-    git("clone", "--depth", "1", src_url, src_dir)
-    update_hash(tgt_name, tgt_root)
-    Copy(src_dir, ".")
 
 
 def Svn(url, fname, to=None):
@@ -197,13 +228,11 @@ def Svn(url, fname, to=None):
     from plumbum.cmd import svn
 
     src_dir = path.join(to, fname)
-    if not source_required(fname, to):
+    with source_lock(fname, to):
+        if source_required(fname, to):
+            svn("co", url, src_dir)
+            update_hash(fname, to)
         Copy(src_dir, ".")
-        return
-
-    svn("co", url, src_dir)
-    update_hash(fname, to)
-    Copy(src_dir, ".")
 
 
 def Rsync(url, tgt_name, tgt_root=None):
@@ -223,10 +252,8 @@ def Rsync(url, tgt_name, tgt_root=None):
     from plumbum.cmd import rsync
 
     src_dir = path.join(tgt_root, tgt_name)
-    if not source_required(tgt_name, tgt_root):
+    with source_lock(tgt_name, tgt_root):
+        if source_required(tgt_name, tgt_root):
+            rsync("-a", url, src_dir)
+            update_hash(tgt_name, tgt_root)
         Copy(src_dir, ".")
-        return
-
-    rsync("-a", url, src_dir)
-    update_hash(tgt_name, tgt_root)
-    Copy(src_dir, ".")
@@ -0,0 +1,194 @@
+"""
+Registry of runners for wrapped binaries and compilers.
+
+A runner is a module-level function, decorated with ``@runner``, that runs
+instead of a wrapped binary (see pprof.project.wrap) or after a wrapped
+compiler (see Project.compiler_extension). Experiments bind the parameters
+of a runner with pprof.utils.run.partial.
+
+The wrappers do not pickle the runner. They store a small JSON spec: the
+registered name of the runner and its bound parameters as plain data.
+Projects and experiments are reduced to the few attributes a runner needs
+and come back as lightweight stand-ins (``Ref``). The wrapper resolves the
+runner by importing its module.
+"""
+import json
+from importlib import import_module
+from uuid import UUID
+
+RUNNERS = {}
+
+PROJECT_ATTRS = ["name", "domain", "group_name", "run_uuid", "builddir",
+                 "sourcedir", "testdir", "run_f", "bin_f", "cflags",
+                 "ldflags"]
+EXPERIMENT_ATTRS = ["name"]
+
+
+class RegistryError(Exception):
+    """ A runner cannot be stored as spec. """
+    pass
+
+
+def runner(func):
+    """
+    Register a function as runner.
+
+    Args:
+        func: A module-level function.
+
+    Returns:
+        The function itself.
+    """
+    name = "{}.{}".format(func.__module__, func.__name__)
+    RUNNERS[name] = func
+    func.runner_name = name
+    return func
+
+
+def resolve(name):
+    """
+    Get a registered runner.
+
+    Args:
+        name (str): The registered name of the runner.
+
+    Returns:
+        The runner function.
+    """
+    if name not in RUNNERS:
+        import_module(name.rpartition(".")[0])
+    return RUNNERS[name]
+
+
+class Ref(object):
+    """ Stand-in for a project or an experiment inside a wrapper. """
+
+    def __init__(self, **attrs):
+        self.__dict__.update(attrs)
+
+    def __repr__(self):
+        return "Ref({})".format(getattr(self, "name", "?"))
+
+
+def encode(value):
+    """
+    Convert a bound parameter of a runner to plain data.
+
+    Args:
+        value: The parameter.
+
+    Returns:
+        A JSON compatible representation of :value:.
+    """
+    from pprof.experiment import Experiment
+    from pprof.project import Project
+    from pprof.settings import config
+
+    if value is config:
+        return {"__config__": {k: encode(config[k]) for k in config}}
+    if isinstance(value, (Project, Ref)) and hasattr(value, "run_uuid"):
+        return {"__project__": {attr: encode(getattr(value, attr, None))
+                                for attr in PROJECT_ATTRS}}
+    if isinstance(value, (Experiment, Ref)):
+        return {"__experiment__": {attr: encode(getattr(value, attr, None))
+                                   for attr in EXPERIMENT_ATTRS}}
+    if isinstance(value, (list, tuple)):
+        return [encode(elem) for elem in value]
+    if isinstance(value, dict):
+        return {"__dict__": {k: encode(value[k]) for k in value}}
+    if isinstance(value, UUID):
+        return str(value)
+    if value is None or isinstance(value, (bool, int, float, str)):
+        return value
+    return str(value)
+
+
+def decode(value):
+    """
+    Convert plain data back to a parameter of a runner.
+
+    Nested values, e.g., dict or list entries of the config, are decoded
+    as well:
+
+    >>> from pprof.settings import config
+    >>> config["nested"] = {"groups": ["CLOCK", {"MEM": [1, 2]}]}
+    >>> decode(encode(config))["nested"]
+    {'groups': ['CLOCK', {'MEM': [1, 2]}]}
+    >>> del config["nested"]
+    """
+    if isinstance(value, list):
+        return [decode(elem) for elem in value]
+    if not isinstance(value, dict):
+        return value
+    if "__config__" in value:
+        return {k: decode(v) for k, v in value["__config__"].items()}
+    if "__project__" in value:
+        return Ref(**value["__project__"])
+    if "__experiment__" in value:
+        return Ref(**value["__experiment__"])
+    return {k: decode(v) for k, v in value["__dict__"].items()}
+
+
+def to_spec(func):
+    """
+    Describe a runner as plain data.
+
+    Args:
+        func: A registered runner, or a pprof.utils.run.partial of one.
+
+    Returns (dict):
+        The spec of the runner.
+
+    Raises:
+        RegistryError: If :func: is not a registered runner.
+    """
+    args, kwargs = [], {}
+    target = func
+    while hasattr(target, "func") and hasattr(target, "args"):
+        args = list(target.args) + args
+        kwargs = dict(target.kwargs, **kwargs)
+        target = target.func
+
+    name = getattr(target, "runner_name", None)
+    if name is None:
+        raise RegistryError(
+            "{} is not a registered runner, decorate it with "
+            "pprof.utils.registry.runner".format(func))
+
+    spec = {"runner": name,
+            "args": encode(args),
+            "kwargs": {k: encode(kwargs[k]) for k in kwargs}}
+    if hasattr(func, "compile_flags"):
+        spec["compile_flags"] = func.compile_flags
+    return spec
+
+
+def from_spec(spec):
+    """
+    Rebuild a runner from its spec.
+
+    Args:
+        spec (dict): A spec, see to_spec.
+
+    Returns:
+        The runner, with all its parameters bound.
+    """
+    from pprof.utils.run import partial
+
+    func = partial(resolve(spec["runner"]), *decode(spec["args"]),
+                   **{k: decode(v) for k, v in spec["kwargs"].items()})
+    if "compile_flags" in spec:
+        func.compile_flags = spec["compile_flags"]
+    return func
+
+
+def dump_runner(func, spec_path):
+    """ Store the spec of a runner in a file. """
+    with open(spec_path, 'w') as spec_f:
+        json.dump(to_spec(func), spec_f)
+
+
+def load_runner(spec_path):
+    """ Load a runner from a file, written by dump_runner. """
+    with open(spec_path, 'r') as spec_f:
+        return from_spec(json.load(spec_f))
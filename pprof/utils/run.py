@@ -1,10 +1,9 @@
 """
 Experiment helpers
 """
-from plumbum.cmd import mkdir  # pylint: disable=E0401
 
 
-def partial(func, *args, **kwargs):
+class partial(object):  # pylint: disable=C0103
     """
     Partial function application.
 
@@ -12,28 +11,29 @@ def partial(func, *args, **kwargs):
     we do not check if parameter values in args and kwargs collide with each
     other.
 
-    Args:
-        func: The original function.
-        *args: Positional arguments that should be applied partially.
-        **kwargs: Keyword arguments that should be applied partially.
+    Unlike a closure, a partial keeps the function and the bound arguments
+    accessible (``func``, ``args``, ``kwargs``). This allows us to store
+    a partial of a registered runner as plain data, see
+    pprof.utils.registry.
+    """
 
-    Returns:
-        A new function that has all given args and kwargs bound.
-    """
-    frozen_args = args
-    frozen_kwargs = kwargs
-
-    def partial_func(*args, **kwargs):
-        """ The partial function with pre-bound arguments. """
-        nonlocal frozen_args
-        nonlocal frozen_kwargs
-        nonlocal func
-        thawed_args = frozen_args + args
-        thawed_kwargs = frozen_kwargs.copy()
+    def __init__(self, func, *args, **kwargs):
+        """
+        Args:
+            func: The original function.
+            *args: Positional arguments that should be applied partially.
+            **kwargs: Keyword arguments that should be applied partially.
+        """
+        self.func = func
+        self.args = args
+        self.kwargs = kwargs
+
+    def __call__(self, *args, **kwargs):
+        """ Call the function with all pre-bound arguments. """
+        thawed_args = self.args + args
+        thawed_kwargs = self.kwargs.copy()
         thawed_kwargs.update(kwargs)
-        func(*thawed_args, **thawed_kwargs)
-
-    return partial_func
+        return self.func(*thawed_args, **thawed_kwargs)
 
 
 def handle_stdin(cmd, kwargs):
@@ -47,7 +47,8 @@ def handle_stdin(cmd, kwargs):
     Args:
         cmd (plumbum.cmd): Command to wrap a stdin handler around.
         kwargs: Dictionary containing the kwargs.
-            We check for they key `has_stdin`
+            We check for they key `has_stdin`. If the stdin has been
+            buffered already (see buffer_stdin), we feed the buffer instead.
 
     Returns:
         A new plumbum command that deals with stdin redirection, if needed.
@@ -56,7 +57,9 @@ def handle_stdin(cmd, kwargs):
     import sys
 
     has_stdin = kwargs.get("has_stdin", False)
-    if has_stdin:
+    if "stdin_data" in kwargs:
+        run_cmd = (cmd << kwargs["stdin_data"])
+    elif has_stdin:
         run_cmd = (cmd < sys.stdin)
     else:
         run_cmd = cmd
@@ -64,23 +67,102 @@ def handle_stdin(cmd, kwargs):
     return run_cmd
 
 
-def fetch_time_output(marker, format_s, ins):
+def buffer_stdin(kwargs):
     """
-    Fetch the output /usr/bin/time from a.
+    Read our stdin into a buffer, if we have to pass it on.
+
+    This allows to feed the same stdin into more than one execution of a
+    binary. The buffer is stored as `stdin_data` in kwargs, handle_stdin
+    picks it up from there.
 
     Args:
-        marker: The marker that limits the time output
-        format_s: The format string used to parse the timings
-        ins: A list of lines we look for the output.
+        kwargs: Dictionary containing the kwargs.
+            We check for they key `has_stdin`
+    """
+    import sys
 
-    Returns:
-        A list of timing tuples
+    if kwargs.get("has_stdin", False) and "stdin_data" not in kwargs:
+        kwargs["stdin_data"] = sys.stdin.read()
+
+
+# Two-sided 95% quantiles of Student's t-distribution for 1..30 degrees of
+# freedom. Beyond that, we use the quantile of the normal distribution.
+T_QUANTILES_95 = [12.706, 4.303, 3.182, 2.776, 2.571, 2.447, 2.365, 2.306,
+                  2.262, 2.228, 2.201, 2.179, 2.160, 2.145, 2.131, 2.120,
+                  2.110, 2.101, 2.093, 2.086, 2.080, 2.074, 2.069, 2.064,
+                  2.060, 2.056, 2.052, 2.048, 2.045, 2.042]
+
+
+def sample_statistics(samples):
+    """
+    Get the summary statistics of a list of samples.
+
+    Args:
+        samples (list(float)): The samples.
+
+    Returns (dict(str, float)):
+        The mean, the standard deviation and the relative half width of the
+        95% confidence interval of the mean ('ci').
     """
-    from parse import parse
+    from math import sqrt
+
+    num = len(samples)
+    mean = sum(samples) / num
+    if num < 2:
+        return {"mean": mean, "stddev": 0.0, "ci": float("inf")}
+
+    stddev = sqrt(sum([(x - mean) ** 2 for x in samples]) / (num - 1))
+    quantile = T_QUANTILES_95[num - 2] if num - 2 < len(T_QUANTILES_95) \
+        else 1.960
+    half_width = quantile * stddev / sqrt(num)
+    if mean == 0:
+        rel_ci = 0.0 if half_width == 0 else float("inf")
+    else:
+        rel_ci = half_width / abs(mean)
+    return {"mean": mean, "stddev": stddev, "ci": rel_ci}
 
-    timings = [x for x in ins if marker in x]
-    res = [parse(format_s, t) for t in timings]
-    return [_f for _f in res if _f]
+
+def repeat_until_stable(measure):
+    """
+    Repeat a measurement until its confidence interval is tight enough.
+
+    We stop, as soon as the relative half width of the 95% confidence
+    interval falls below ``config["repeat_ci"]``, after at least
+    ``config["repeat_min"]`` samples. In any case, we stop after
+    ``config["repeat_max"]`` samples or after ``config["repeat_budget"]``
+    seconds.
+
+    Args:
+        measure (callable): Takes one measurement and returns the sample.
+            If it returns None, the measurement failed and we stop.
+
+    Returns (list(float)):
+        All samples we took.
+    """
+    from time import monotonic
+    from pprof.settings import config
+
+    threshold = float(config["repeat_ci"])
+    min_reps = int(config["repeat_min"])
+    max_reps = int(config["repeat_max"])
+    budget = float(config["repeat_budget"])
+
+    samples = []
+    start = monotonic()
+    while True:
+        sample = measure()
+        if sample is None:
+            break
+        samples.append(sample)
+
+        if len(samples) >= max_reps:
+            break
+        if monotonic() - start >= budget:
+            break
+        if len(samples) >= min_reps and \
+                sample_statistics(samples)["ci"] <= threshold:
+            break
+    return samples
 
 
 class GuardedRunException(Exception):
@@ -203,6 +285,25 @@ def begin(command, pname, ename, group):
     return db_run, session
 
 
+def run_log(db_run, session):
+    """
+    Get the log entry of a run.
+
+    Args:
+        db_run: The ``run`` schema object we belong to
+        session: The db transaction we belong to.
+
+    Returns:
+        The ``log`` schema object of the run.
+    """
+    from pprof.utils.schema import RunLog
+    from pprof.utils.spool import SpoolSession
+
+    if isinstance(session, SpoolSession):
+        return session.find(RunLog, run_id=db_run.id)
+    return session.query(RunLog).filter(RunLog.run_id == db_run.id).one()
+
+
 def end(db_run, session, stdout, stderr):
     """
     End a run in the database log (Successfully).
@@ -216,9 +317,8 @@ def end(db_run, session, stdout, stderr):
         stdout: The stdout we captured of the run.
         stderr: The stderr we capture of the run.
     """
-    from pprof.utils.schema import RunLog
     from datetime import datetime
-    log = session.query(RunLog).filter(RunLog.run_id == db_run.id).one()
+    log = run_log(db_run, session)
     log.stderr = stderr
     log.stdout = stdout
     log.status = 0
@@ -243,9 +343,8 @@ def fail(db_run, session, retcode, stdout, stderr):
         stdout: The stdout we captured of the run.
         stderr: The stderr we capture of the run.
     """
-    from pprof.utils.schema import RunLog
     from datetime import datetime
-    log = session.query(RunLog).filter(RunLog.run_id == db_run.id).one()
+    log = run_log(db_run, session)
     log.stderr = stderr
     log.stdout = stdout
     log.status = retcode
@@ -256,15 +355,235 @@ def fail(db_run, session, retcode, stdout, stderr):
     session.commit()
 
 
-def guarded_exec(cmd, pname, ename, run_group):
+def record_exec(cmd, pname, ename, run_group, retcode, stdout, stderr):
+    """
+    Record a command in the database, that has been executed already.
+
+    This is the counterpart of guarded_exec for commands we did not execute
+    ourselves, e.g., the compiler invocation a compiler extension is
+    called for.
+
+    Args:
+        cmd: the command that has been executed.
+        pname: the project name we belong to.
+        ename: the experiment name we belong to.
+        run_group: the run group this execution will belong to.
+        retcode: the return code of the command.
+        stdout: the stdout of the command.
+        stderr: the stderr of the command.
+
+    Returns:
+        (run, session), where run is the recorded run and session the
+        associated transaction for later use.
+    """
+    db_run, session = begin(cmd, pname, ename, run_group)
+    if retcode == 0:
+        end(db_run, session, stdout, stderr)
+    else:
+        fail(db_run, session, retcode, stdout, stderr)
+    return (db_run, session)
+
+
+def with_compile_flags(func, *flags):
+    """
+    Declare the flags a compiler extension needs in the compilation.
+
+    The wrapped compiler adds :flags: to the compilation itself and hands
+    the outcome to the extension (as ``retcode``, ``stdout`` and ``stderr``
+    keyword arguments). This way the extension does not have to compile
+    the translation unit a second time, e.g., to get LLVM's statistics.
+
+    Args:
+        func: The compiler extension.
+        *flags: The flags we add to the compilation.
+
+    Returns:
+        The compiler extension.
+    """
+    func.compile_flags = list(flags)
+    return func
+
+
+def parallel_batches(func):
+    """
+    Declare that a runner may execute the invocations of a batch in parallel.
+
+    Only runners that do not measure anything should declare this, the
+    invocations of a parallel batch compete for the same cores.
+
+    Args:
+        func: The runner.
+
+    Returns:
+        The runner.
+    """
+    func.parallel_batches = True
+    return func
+
+
+def run_invocations(runner, invocations, keep_going=False):
+    """
+    Execute a list of invocations with a runner, one after another.
+
+    Args:
+        runner: The runner of the experiment, it gets called as
+            ``runner(binary, args, **kwargs)``.
+        invocations (list(pprof.project.Invocation)): The invocations.
+        keep_going (bool): Continue with the next invocation, if one fails.
+
+    Returns (int):
+        The number of failed invocations.
+
+    Raises:
+        GuardedRunException: If an invocation fails and not :keep_going:.
+    """
+    failed = 0
+    for invocation in invocations:
+        kwargs = {}
+        if invocation.stdin is not None:
+            with open(invocation.stdin, 'r') as stdin_f:
+                kwargs["stdin_data"] = stdin_f.read()
+        try:
+            runner(invocation.binary, list(invocation.args), **kwargs)
+        except GuardedRunException:
+            if not keep_going:
+                raise
+            failed += 1
+    return failed
+
+
+def read_excerpt(log_path, limit):
+    """
+    Read the head and the tail of a captured output.
+
+    Args:
+        log_path (str): The file that captured the output.
+        limit (int): Number of bytes we keep of the head and of the tail.
+
+    Returns (tuple(str, bool)):
+        The excerpt and True, if we had to omit a part of the output.
+    """
+    from os import path
+
+    size = path.getsize(log_path)
+    with open(log_path, 'rb') as log_f:
+        if size <= 2 * limit:
+            return (log_f.read().decode("utf-8", errors="replace"), False)
+        head = log_f.read(limit)
+        log_f.seek(size - limit)
+        tail = log_f.read(limit)
+
+    marker = "\n[... {:d} bytes omitted ...]\n".format(size - 2 * limit)
+    return (head.decode("utf-8", errors="replace") + marker +
+            tail.decode("utf-8", errors="replace"), True)
+
+
+def monotonic_ns():
+    """ Read the monotonic clock, in nanoseconds. """
+    import time
+
+    if hasattr(time, "monotonic_ns"):
+        return time.monotonic_ns()
+    return int(time.monotonic() * 1000000000)
+
+
+def rusage_metrics(rusage, wall_ns, maxrss_floor):
+    """
+    Convert the resource usage of a child process to metrics.
+
+    Linux keeps the peak resident set size of the process that spawned the
+    child in the child's ru_maxrss, when the child calls exec. So the
+    maximum resident set size of a binary is never below the peak resident
+    set size of the pprof process that started it. We record this floor
+    as rusage.maxrss_floor_kib. A rusage.maxrss_kib equal to the floor
+    tells nothing about the binary, only that it stayed below the floor.
+
+    Args:
+        rusage: The resource usage of the child, as returned by os.wait4.
+        wall_ns (int): The wall clock time of the child in nanoseconds.
+        maxrss_floor (int): The peak resident set size of our process in
+            KiB, right before we spawned the child.
+
+    Returns (dict(str, float)):
+        Maps the metric names to their values. The maximum resident set size
+        is reported in KiB, as Linux does.
+    """
+    return {
+        "time.user_s": rusage.ru_utime,
+        "time.system_s": rusage.ru_stime,
+        "time.real_s": wall_ns / 1000000000.0,
+        "rusage.maxrss_kib": rusage.ru_maxrss,
+        "rusage.maxrss_floor_kib": maxrss_floor,
+        "rusage.minflt": rusage.ru_minflt,
+        "rusage.majflt": rusage.ru_majflt,
+        "rusage.nvcsw": rusage.ru_nvcsw,
+        "rusage.nivcsw": rusage.ru_nivcsw,
+        "rusage.inblock": rusage.ru_inblock,
+        "rusage.oublock": rusage.ru_oublock
+    }
+
+
+def capture(cmd, usage=None):
+    """
+    Execute a command and capture its output in temporary files.
+
+    The output is streamed to disk, it does not have to fit into memory.
+
+    Args:
+        cmd: The plumbum command we execute.
+        usage (dict): If given, we reap the command with os.wait4 and add
+            its resource usage to this dictionary, see rusage_metrics.
+
+    Returns (tuple(int, str, str)):
+        The return code and the paths of the files that captured stdout and
+        stderr. The caller is responsible for removing them.
+    """
+    from tempfile import mkstemp
+    import os
+    import resource
+
+    out_fd, out_path = mkstemp(prefix="pprof-", suffix=".stdout")
+    err_fd, err_path = mkstemp(prefix="pprof-", suffix=".stderr")
+    try:
+        with os.fdopen(out_fd, 'wb') as out_f, \
+                os.fdopen(err_fd, 'wb') as err_f:
+            maxrss_floor = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+            start = monotonic_ns()
+            proc = cmd.popen(stdout=out_f, stderr=err_f)
+            if usage is None:
+                retcode = proc.wait()
+            else:
+                _, status, rusage = os.wait4(proc.pid, 0)
+                wall_ns = monotonic_ns() - start
+                if os.WIFEXITED(status):
+                    retcode = os.WEXITSTATUS(status)
+                else:
+                    retcode = -os.WTERMSIG(status)
+                proc.returncode = retcode
+                usage.update(rusage_metrics(rusage, wall_ns, maxrss_floor))
+    except BaseException:
+        os.remove(out_path)
+        os.remove(err_path)
+        raise
+    return (retcode, out_path, err_path)
+
+
+def guarded_exec(cmd, pname, ename, run_group, usage=None):
     """
     Guard the execution of the given command.
 
+    The output of the command is captured in temporary files. The log of the
+    run, as well as the stdout/stderr we return, keep the head and the tail
+    of the output (``config["log_limit"]`` KiB each). Longer outputs are
+    stored completely as compressed blob, see ``pprof log``.
+
     Args:
         cmd: the command we guard.
         pname: the database run we run under.
         ename: the database session this run belongs to.
         run_group: the run group this execution will belong to.
+        usage (dict): If given, the resource usage of the command is added
+            to this dictionary, see capture.
 
     Raises:
         RunException: If the ``cmd`` encounters an error we wrap the exception
@@ -273,21 +592,38 @@ def guarded_exec(cmd, pname, ename, run_group):
     from plumbum.commands import ProcessExecutionError
     from plumbum import local
     from warnings import warn
+    from pprof.settings import config
+    from pprof.utils.db import persist_log_blob
+    import os
 
+    limit = int(config["log_limit"]) * 1024
     db_run, session = begin(cmd, pname, ename, run_group)
     try:
         with local.env(PPROF_DB_RUN_ID=db_run.id):
-            retcode, stdout, stderr = cmd.run()
-        end(db_run, session, stdout, stderr)
-        return (db_run, session, retcode, stdout, stderr)
-    except ProcessExecutionError as proc_ex:
-        fail(db_run, session, proc_ex.retcode, proc_ex.stdout, proc_ex.stderr)
-        raise GuardedRunException(proc_ex, db_run, session)
+            retcode, out_path, err_path = capture(cmd, usage)
     except KeyboardInterrupt as key_int:
         fail(db_run, session, -1, "", "KeyboardInterrupt")
         warn("Interrupted by user input")
         raise key_int
 
+    try:
+        stdout, out_truncated = read_excerpt(out_path, limit)
+        stderr, err_truncated = read_excerpt(err_path, limit)
+        if out_truncated:
+            persist_log_blob(db_run, session, "stdout", out_path)
+        if err_truncated:
+            persist_log_blob(db_run, session, "stderr", err_path)
+    finally:
+        os.remove(out_path)
+        os.remove(err_path)
+
+    if retcode != 0:
+        fail(db_run, session, retcode, stdout, stderr)
+        proc_ex = ProcessExecutionError([str(cmd)], retcode, stdout, stderr)
+        raise GuardedRunException(proc_ex, db_run, session)
+    end(db_run, session, stdout, stderr)
+    return (db_run, session, retcode, stdout, stderr)
+
 
 def run(command, retcode=0):
     """
@@ -320,6 +656,7 @@ def uchroot(*args):
     """
     from pprof.settings import config
     from plumbum import local
+    from plumbum.cmd import mkdir  # pylint: disable=E0401
 
     mkdir("-p", "llvm")
     uchroot_cmd = local["./uchroot"]
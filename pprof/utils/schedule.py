@@ -0,0 +1,247 @@
+"""
+Resource aware scheduling of independent tasks.
+
+The scheduler in this module executes a list of tasks in forked worker
+processes. Every task declares how many cores and how much memory (in MiB) it
+needs. A task is only started, if the remaining budget of the host can satisfy
+its request. This allows us to pack several small projects onto a single
+node, without overcommitting it.
+
+A scheduler can pin its workers to disjoint sets of cpus. Every worker gets
+as many cpus as it requested cores, taken topology-aware from the cpus that
+are still free (see pprof.utils.affinity). Everything a worker spawns
+inherits its affinity, so the cpus runners select (``cpu_affinity``, likwid's
+``-C``) always lie within the worker's own set.
+
+Each worker redirects its stdout/stderr into a private log file. The log is
+replayed on the stdout of the scheduler as soon as the task finished. This
+keeps the phase/step output of concurrent tasks from interleaving.
+"""
+import os
+import sys
+
+
+def available_memory():
+    """
+    Get the amount of memory available on this host.
+
+    Returns (int):
+        The available memory in MiB, or 0, if we cannot determine it.
+    """
+    try:
+        with open("/proc/meminfo") as meminfo:
+            for line in meminfo:
+                if line.startswith("MemAvailable:"):
+                    return int(line.split()[1]) // 1024
+    except (IOError, ValueError):
+        pass
+
+    try:
+        return os.sysconf("SC_PAGE_SIZE") * os.sysconf("SC_PHYS_PAGES") \
+            // (1024 * 1024)
+    except (AttributeError, ValueError):
+        return 0
+
+
+class Budget(object):
+    """ Bookkeeping of the cores & memory we can hand out to tasks. """
+
+    def __init__(self, cores, memory):
+        """
+        Create a new budget.
+
+        Args:
+            cores (int): Number of cores we may use.
+            memory (int): Amount of memory (MiB) we may use.
+        """
+        self.cores = cores
+        self.memory = memory
+        self.free_cores = cores
+        self.free_memory = memory
+
+    def clamp(self, cores, memory):
+        """
+        Limit a resource request to the total budget.
+
+        A request that exceeds the total budget could never be satisfied,
+        we hand out the whole budget instead.
+
+        Returns (tuple(int, int)):
+            The clamped (cores, memory) request.
+        """
+        return (min(cores, self.cores), min(memory, self.memory))
+
+    def fits(self, cores, memory):
+        """ Check, if the given request fits into the remaining budget. """
+        return cores <= self.free_cores and memory <= self.free_memory
+
+    def acquire(self, cores, memory):
+        """ Take the given request from the remaining budget. """
+        self.free_cores -= cores
+        self.free_memory -= memory
+
+    def release(self, cores, memory):
+        """ Give the given request back to the remaining budget. """
+        self.free_cores += cores
+        self.free_memory += memory
+
+
+def _execute(func, log_path, cpus):
+    """
+    Execute a task inside a forked worker process.
+
+    Args:
+        func (callable): The task.
+        log_path (str): All output of the task gets redirected to this file.
+        cpus (list(int)): Pin the worker to these cpus. Empty, if we do not
+            pin the worker.
+    """
+    from logging import error
+    import traceback
+
+    if cpus:
+        try:
+            os.sched_setaffinity(0, cpus)
+        except AttributeError:
+            pass
+
+    log_fd = os.open(log_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o644)
+    sys.stdout.flush()
+    sys.stderr.flush()
+    os.dup2(log_fd, 1)
+    os.dup2(log_fd, 2)
+    os.close(log_fd)
+
+    retcode = 0
+    try:
+        func()
+    except SystemExit as sys_exit:
+        retcode = sys_exit.code if isinstance(sys_exit.code, int) else 1
+    except Exception as ex:  # pylint: disable=W0703
+        error("{}".format(ex))
+        traceback.print_exc()
+        retcode = 1
+    finally:
+        sys.stdout.flush()
+        sys.stderr.flush()
+    os._exit(retcode)  # pylint: disable=W0212
+
+
+class Scheduler(object):
+    """
+    Run tasks concurrently in worker processes, as far as the budget allows.
+
+    Tasks are started in submission order. If the next task does not fit into
+    the remaining budget, we try to fill the gap with one of the later tasks.
+    """
+
+    def __init__(self, budget, slots, pin=False):
+        """
+        Create a new scheduler.
+
+        Args:
+            budget (Budget): The resources we may hand out.
+            slots (int): Maximum number of concurrently running tasks.
+            pin (bool): Pin every worker to a disjoint set of cpus.
+        """
+        from pprof.utils.affinity import select_cpus
+
+        self.budget = budget
+        self.slots = max(1, slots)
+        self.pending = []
+        self.cpus = select_cpus(budget.cores) if pin else []
+        self.free_cpus = list(self.cpus)
+
+    def take_cpus(self, cores):
+        """ Take the first :cores: free cpus, in topology order. """
+        cpus = self.free_cpus[:cores]
+        self.free_cpus = self.free_cpus[cores:]
+        return cpus
+
+    def return_cpus(self, cpus):
+        """ Give cpus back, keeping the topology order of the free cpus. """
+        self.free_cpus = [cpu for cpu in self.cpus
+                          if cpu in cpus or cpu in self.free_cpus]
+
+    def submit(self, name, cores, memory, func):
+        """
+        Submit a new task.
+
+        Args:
+            name (str): Name of the task, used for reporting.
+            cores (int): Number of cores the task needs.
+            memory (int): Amount of memory (MiB) the task needs.
+            func (callable): The task itself.
+        """
+        cores, memory = self.budget.clamp(cores, memory)
+        self.pending.append((name, cores, memory, func))
+
+    def __start(self, task):
+        """ Fork a new worker for the given task. """
+        from multiprocessing import get_context
+        from tempfile import mkstemp
+
+        name, cores, memory, func = task
+        log_fd, log_path = mkstemp(prefix="pprof-{}-".format(name),
+                                   suffix=".log")
+        os.close(log_fd)
+
+        # Close our idle database connections before we fork, the worker must
+        # not share them. Connections we still use are left alone, the worker
+        # never checks them out (see pprof.utils.schema.guard_fork).
+        from pprof.utils.schema import ENGINE
+        ENGINE.dispose()
+
+        self.budget.acquire(cores, memory)
+        cpus = self.take_cpus(cores)
+        worker = get_context("fork").Process(target=_execute,
+                                             args=(func, log_path, cpus),
+                                             name=name)
+        worker.start()
+        return (worker, log_path, cpus, task)
+
+    def __finish(self, running):
+        """ Collect a finished worker and replay its output. """
+        worker, log_path, cpus, task = running
+        name, cores, memory, _ = task
+
+        worker.join()
+        self.budget.release(cores, memory)
+        self.return_cpus(cpus)
+        with open(log_path, 'r', errors='replace') as log:
+            sys.stdout.write(log.read())
+        sys.stdout.flush()
+        os.remove(log_path)
+        return worker.exitcode == 0
+
+    def wait(self):
+        """
+        Execute all submitted tasks and wait for them to finish.
+
+        Returns (list(str)):
+            The names of all tasks that failed.
+        """
+        from multiprocessing.connection import wait
+
+        failed = []
+        running = []
+        while self.pending or running:
+            for task in list(self.pending):
+                if len(running) >= self.slots:
+                    break
+                _, cores, memory, _ = task
+                if self.budget.fits(cores, memory):
+                    self.pending.remove(task)
+                    running.append(self.__start(task))
+
+            if not running:
+                # Nothing fits, although all resources are free. Force the
+                # next task onto the node.
+                running.append(self.__start(self.pending.pop(0)))
+
+            ready = wait([worker.sentinel for worker, _, _, _ in running])
+            for task in [t for t in running if t[0].sentinel in ready]:
+                running.remove(task)
+                if not self.__finish(task):
+                    failed.append(task[3][0])
+        return failed
@@ -1,18 +1,129 @@
-"""Database schema for pprof."""
-
-from sqlalchemy import create_engine
+"""
+Database schema for pprof.
+
+The schema supports two storage backends, selected by ``config["db_backend"]``:
+
+    postgresql: A PostgreSQL server, configured by the ``db_*`` settings.
+    sqlite: An embedded SQLite database in the file ``config["db_path"]``.
+        Requires no server, which makes it a good fit for studies on a
+        single machine. The database runs in WAL mode, so readers do not
+        block the (many, short-lived) writers of a study.
+"""
+import uuid
+from sqlalchemy import create_engine, event
 from sqlalchemy import Column, ForeignKey, Integer, String, DateTime, Enum
+from sqlalchemy import BigInteger, Float, LargeBinary, Numeric, SmallInteger
 from sqlalchemy.dialects import postgresql
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker
+from sqlalchemy.types import TypeDecorator, CHAR
 from pprof.settings import config
 
-ENGINE = create_engine(
-    "postgresql+psycopg2://{u}:{p}@{h}:{P}/{db}".format(u=config["db_user"],
-                                                        h=config["db_host"],
-                                                        P=config["db_port"],
-                                                        p=config["db_pass"],
-                                                        db=config["db_name"]))
+
+class GUID(TypeDecorator):
+    """
+    A platform independent UUID type.
+
+    Uses PostgreSQL's UUID type, otherwise a CHAR(36) with the canonical
+    string representation of the UUID.
+    """
+
+    impl = CHAR
+
+    def __init__(self, as_uuid=False):
+        """
+        Args:
+            as_uuid (bool): Return values as uuid.UUID, not as str.
+        """
+        super(GUID, self).__init__()
+        self.as_uuid = as_uuid
+
+    def load_dialect_impl(self, dialect):
+        if dialect.name == 'postgresql':
+            return dialect.type_descriptor(postgresql.UUID())
+        return dialect.type_descriptor(CHAR(36))
+
+    def process_bind_param(self, value, dialect):
+        if value is None:
+            return value
+        return str(uuid.UUID(str(value)))
+
+    def process_result_value(self, value, dialect):
+        if value is None or not self.as_uuid:
+            return value
+        return uuid.UUID(str(value))
+
+
+# Use the native types of PostgreSQL. SQLite generates keys only for
+# INTEGER PRIMARY KEY columns, not for BIGINT ones.
+DOUBLE = Float(precision=53).with_variant(postgresql.DOUBLE_PRECISION,
+                                          "postgresql")
+BIGINT = BigInteger().with_variant(Integer, "sqlite")
+
+
+def engine_url():
+    """ Get the database url of the configured storage backend. """
+    if config["db_backend"] == "sqlite":
+        return "sqlite:///{}".format(config["db_path"])
+    return "postgresql+psycopg2://{u}:{p}@{h}:{P}/{db}".format(
+        u=config["db_user"],
+        h=config["db_host"],
+        P=config["db_port"],
+        p=config["db_pass"],
+        db=config["db_name"])
+
+
+def guard_fork(engine):
+    """
+    Keep forked workers from using the pooled connections of their parent.
+
+    A connection that was opened by another process is dropped from the pool
+    without closing it. Closing it would terminate the connection the parent
+    still uses. The pool opens a fresh connection instead.
+
+    Args:
+        engine: The engine we guard.
+    """
+    import os
+    from sqlalchemy import exc
+
+    @event.listens_for(engine, "connect")
+    def remember_pid(_, connection_record):
+        """ Remember the process that opened the connection. """
+        connection_record.info["pid"] = os.getpid()
+
+    @event.listens_for(engine, "checkout")
+    def check_pid(_, connection_record, connection_proxy):
+        """ Refuse connections that were opened by another process. """
+        if connection_record.info["pid"] != os.getpid():
+            connection_record.connection = connection_proxy.connection = None
+            raise exc.DisconnectionError(
+                "Connection belongs to pid {:d}, not to pid {:d}".format(
+                    connection_record.info["pid"], os.getpid()))
+
+
+def create_pprof_engine():
+    """ Create the engine for the configured storage backend. """
+    if config["db_backend"] != "sqlite":
+        engine = create_engine(engine_url())
+        guard_fork(engine)
+        return engine
+
+    engine = create_engine(engine_url(), connect_args={"timeout": 60})
+    guard_fork(engine)
+
+    @event.listens_for(engine, "connect")
+    def tune_sqlite(dbapi_connection, _):
+        """ Tune SQLite for many concurrent writers. """
+        cursor = dbapi_connection.cursor()
+        cursor.execute("PRAGMA journal_mode=WAL")
+        cursor.execute("PRAGMA synchronous=NORMAL")
+        cursor.close()
+
+    return engine
+
+
+ENGINE = create_pprof_engine()
 Session = sessionmaker(bind=ENGINE)
 Base = declarative_base()
 
@@ -26,8 +137,8 @@ class Run(Base):
     command = Column(String)
     project_name = Column(String, ForeignKey("project.name"), index=True)
     experiment_name = Column(String, index=True)
-    run_group = Column(postgresql.UUID, index=True)
-    experiment_group = Column(postgresql.UUID,
+    run_group = Column(GUID, index=True)
+    experiment_group = Column(GUID,
                               ForeignKey("experiment.id"),
                               index=True)
     begin = Column(DateTime(timezone=False))
@@ -40,10 +151,10 @@ class RunGroup(Base):
 
     __tablename__ = 'rungroup'
 
-    id = Column(postgresql.UUID(as_uuid=True), primary_key=True, index=True)
+    id = Column(GUID(as_uuid=True), primary_key=True, index=True)
     project = Column(String, ForeignKey("project.name"), index=True)
     experiment = Column(
-        postgresql.UUID(as_uuid=True),
+        GUID(as_uuid=True),
         ForeignKey("experiment.id",
                    ondelete="CASCADE",
                    onupdate="CASCADE"),
@@ -61,7 +172,7 @@ class Experiment(Base):
 
     name = Column(String)
     description = Column(String)
-    id = Column(postgresql.UUID(as_uuid=True), primary_key=True)
+    id = Column(GUID(as_uuid=True), primary_key=True)
     begin = Column(DateTime(timezone=False))
     end = Column(DateTime(timezone=False))
 
@@ -73,7 +184,7 @@ class Likwid(Base):
 
     metric = Column(String, primary_key=True, index=True)
     region = Column(String, primary_key=True, index=True)
-    value = Column(postgresql.DOUBLE_PRECISION)
+    value = Column(DOUBLE)
     core = Column(String, primary_key=True)
     run_id = Column(Integer,
                     ForeignKey("run.id",
@@ -89,7 +200,7 @@ class Metric(Base):
     __tablename__ = 'metrics'
 
     name = Column(String, primary_key=True, index=True, nullable=False)
-    value = Column(postgresql.DOUBLE_PRECISION)
+    value = Column(DOUBLE)
     run_id = Column(Integer,
                     ForeignKey("run.id",
                                onupdate="CASCADE",
@@ -104,11 +215,11 @@ class Event(Base):
     __tablename__ = 'pprof_events'
 
     name = Column(String, index=True)
-    start = Column(postgresql.NUMERIC, primary_key=True)
-    duration = Column(postgresql.NUMERIC)
+    start = Column(Numeric, primary_key=True)
+    duration = Column(Numeric)
     id = Column(Integer, primary_key=True)
-    type = Column(postgresql.SMALLINT)
-    tid = Column(postgresql.BIGINT)
+    type = Column(SmallInteger)
+    tid = Column(BigInteger)
     run_id = Column(Integer,
                     ForeignKey("run.id",
                                onupdate="CASCADE",
@@ -135,10 +246,10 @@ class CompileStat(Base):
 
     __tablename__ = 'compilestats'
 
-    id = Column(postgresql.BIGINT, primary_key=True)
+    id = Column(BIGINT, primary_key=True)
     name = Column(String, index=True)
     component = Column(String, index=True)
-    value = Column(postgresql.NUMERIC)
+    value = Column(Numeric)
     run_id = Column(Integer,
                     ForeignKey("run.id",
                                onupdate="CASCADE",
@@ -170,6 +281,42 @@ class RunLog(Base):
     stdout = Column(String)
 
 
+class Blob(Base):
+    """
+    Store large, compressed objects out of line.
+
+    Blobs are addressed by the hash of their uncompressed content, equal
+    contents are stored only once.
+    """
+
+    __tablename__ = 'blob'
+
+    id = Column(String, primary_key=True)
+    size = Column(BigInteger)
+    encoding = Column(String)
+    data = Column(LargeBinary)
+
+
+class LogBlob(Base):
+    """
+    Reference the full output of a run.
+
+    The ``log`` relation only keeps the head and the tail of long outputs,
+    the complete output is stored as a blob.
+    """
+
+    __tablename__ = 'logblob'
+
+    run_id = Column(Integer,
+                    ForeignKey("run.id",
+                               onupdate="CASCADE",
+                               ondelete="CASCADE"),
+                    index=True,
+                    primary_key=True)
+    stream = Column(String, primary_key=True)
+    blob_id = Column(String, ForeignKey("blob.id"), index=True)
+
+
 class Metadata(Base):
     """
     Store metadata information for every run.
@@ -221,7 +368,7 @@ class GlobalConfig(Base):
     __tablename__ = 'globalconfig'
 
     experiment_group = Column(
-        postgresql.UUID(as_uuid=True),
+        GUID(as_uuid=True),
         ForeignKey("experiment.id",
                    onupdate="CASCADE",
                    ondelete="CASCADE"),
@@ -252,4 +399,5 @@ class RegressionTest(Base):
     project_name = Column(String)
 
 
-Base.metadata.create_all(ENGINE, checkfirst=True)
+if str(config["db_create"]).lower() not in ["false", "0", "no"]:
+    Base.metadata.create_all(ENGINE, checkfirst=True)
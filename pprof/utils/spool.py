@@ -0,0 +1,314 @@
+"""
+Offline result spool for the pprof study.
+
+If ``config["spool_dir"]`` is set, runs do not talk to the database at all.
+Every row a run would write to the database is appended as a compact JSON
+record to a node-local, append-only spool file instead. After the job,
+``pprof import`` merges the spool files into the database in bulk.
+
+The spool mirrors the interface of a database session, as far as pprof uses
+it (add, commit, rollback, ...). Objects added to a SpoolSession are written
+as a snapshot of their columns on every commit, rows inserted in bulk are
+written exactly once. Runs get a local id in the spool, all rows that
+reference a run get remapped to the id of the imported run.
+"""
+import base64
+import json
+import os
+from datetime import datetime
+from decimal import Decimal
+from os import path
+from uuid import UUID, uuid4
+from pprof.settings import config
+
+SPOOL_F_EXT = ".spool"
+SPOOL_ID_CONFIG = "spool.id"
+
+
+def spool_enabled():
+    """ Check, if we write our results to the spool. """
+    return bool(config["spool_dir"])
+
+
+def spool_file():
+    """ Get the spool file of this node. """
+    import socket
+    return path.join(config["spool_dir"], socket.gethostname() + SPOOL_F_EXT)
+
+
+def local_run_id():
+    """ Create a new id for a run in the spool. """
+    return "spool-" + uuid4().hex
+
+
+def encode(value):
+    """ Convert a column value to its JSON representation. """
+    if isinstance(value, datetime):
+        return value.isoformat()
+    if isinstance(value, UUID):
+        return str(value)
+    if isinstance(value, Decimal):
+        return float(value)
+    if isinstance(value, bytes):
+        return base64.b64encode(value).decode("ascii")
+    return value
+
+
+def to_row(obj):
+    """
+    Get the columns of a mapped object as a dictionary.
+
+    Args:
+        obj: An instance of a class in pprof.utils.schema.
+
+    Returns (dict):
+        Maps the column names to JSON compatible values.
+    """
+    return {column.key: encode(getattr(obj, column.key))
+            for column in obj.__table__.columns}
+
+
+def append_records(records):
+    """
+    Append records to the spool file of this node.
+
+    All records are written with a single write while we hold an exclusive
+    lock on the file, records of concurrent runs never interleave.
+
+    Args:
+        records (list(dict)): The records we append.
+    """
+    import fcntl
+
+    if not records:
+        return
+    if not path.exists(config["spool_dir"]):
+        os.makedirs(config["spool_dir"], exist_ok=True)
+
+    data = "".join([json.dumps(record, separators=(',', ':')) + "\n"
+                    for record in records])
+    with open(spool_file(), 'a') as spool:
+        fcntl.flock(spool, fcntl.LOCK_EX)
+        try:
+            spool.write(data)
+            spool.flush()
+        finally:
+            fcntl.flock(spool, fcntl.LOCK_UN)
+
+
+class SpoolSession(object):
+    """ A database session that writes to the spool of this node. """
+
+    def __init__(self, deferred=False):
+        """
+        Args:
+            deferred (bool): Ignore all commits until ``deferred`` is reset,
+                see pprof.utils.db.batch_session.
+        """
+        self.objects = []
+        self.rows = []
+        self.deferred = deferred
+
+    def add(self, obj):
+        """ Track a mapped object, it will be written on every commit. """
+        if not any([obj is tracked for tracked in self.objects]):
+            self.objects.append(obj)
+
+    def insert(self, table, rows):
+        """ Queue rows for the given (mapped) table. """
+        self.rows += [{"table": table.__tablename__,
+                       "row": {k: encode(row[k]) for k in row},
+                       "bulk": 1} for row in rows]
+
+    def find(self, table, **keys):
+        """
+        Find a tracked object.
+
+        Args:
+            table: The mapped class of the object.
+            **keys: Column values the object has to match.
+
+        Returns:
+            The first tracked object that matches, or None.
+        """
+        for obj in self.objects:
+            if isinstance(obj, table) and \
+                    all([getattr(obj, k) == keys[k] for k in keys]):
+                return obj
+        return None
+
+    def commit(self):
+        """ Write all tracked objects and all queued rows to the spool. """
+        if self.deferred:
+            return
+        records = [{"table": obj.__tablename__, "row": to_row(obj)}
+                   for obj in self.objects] + self.rows
+        self.rows = []
+        append_records(records)
+
+    def flush(self):
+        """ Nothing to do, everything is written on commit. """
+        pass
+
+    def rollback(self):
+        """ Drop all queued rows. """
+        self.rows = []
+
+    def close(self):
+        """ Nothing to do, the spool file is closed after every commit. """
+        pass
+
+
+def read_records(spool_path):
+    """
+    Read all records from a spool file.
+
+    Args:
+        spool_path (str): The spool file.
+
+    Returns:
+        A generator over all records in the file.
+    """
+    with open(spool_path, 'r') as spool:
+        for line in spool:
+            line = line.strip()
+            if line:
+                yield json.loads(line)
+
+
+def decode_row(table, row):
+    """
+    Convert a spooled row back to the column types of its table.
+
+    Args:
+        table: The mapped class of the row.
+        row (dict): The row as it was spooled.
+
+    Returns (dict):
+        The row, ready to be passed to the mapped class.
+    """
+    from sqlalchemy import DateTime, LargeBinary
+
+    decoded = dict(row)
+    for column in table.__table__.columns:
+        value = decoded.get(column.key)
+        if value is None:
+            continue
+        if isinstance(column.type, DateTime):
+            fmt = "%Y-%m-%dT%H:%M:%S.%f" if "." in value \
+                else "%Y-%m-%dT%H:%M:%S"
+            decoded[column.key] = datetime.strptime(value, fmt)
+        elif isinstance(column.type, LargeBinary):
+            decoded[column.key] = base64.b64decode(value)
+        elif getattr(column.type, "as_uuid", False):
+            decoded[column.key] = UUID(value)
+    return decoded
+
+
+def new_blobs(session, blobs):
+    """
+    Drop all blobs that exist in the database already.
+
+    Args:
+        session: The db transaction we import into.
+        blobs (list(dict)): The blob rows of the spool.
+
+    Returns (list(dict)):
+        The blobs we have to insert, each one only once.
+    """
+    from pprof.utils import schema as s
+
+    unique = {}
+    for blob in blobs:
+        unique[blob["id"]] = blob
+    known = session.query(s.Blob.id).filter(s.Blob.id.in_(list(unique)))
+    for (blob_id, ) in known:
+        del unique[blob_id]
+    return list(unique.values())
+
+
+# Tables are imported in this order, to satisfy the foreign keys.
+IMPORT_ORDER = ["project", "experiment", "rungroup", "run", "blob"]
+
+
+def import_spool(spool_path):
+    """
+    Import a spool file into the database.
+
+    The import is idempotent: Every imported run remembers its spool id in
+    its config (``spool.id``). Runs we imported before, and every row that
+    belongs to them, are skipped. The whole file is imported in a single
+    transaction.
+
+    Args:
+        spool_path (str): The spool file.
+
+    Returns (tuple(int, int)):
+        The number of imported and the number of skipped runs.
+    """
+    from pprof.utils import schema as s
+    from pprof.utils.db import bulk_insert
+
+    tables = {cls.__tablename__: cls
+              for cls in s.Base._decl_class_registry.values()
+              if hasattr(cls, "__tablename__")}
+
+    snapshots = {}
+    rows = {}
+    for record in read_records(spool_path):
+        table = tables[record["table"]]
+        row = record["row"]
+        if record.get("bulk"):
+            rows.setdefault(record["table"], []).append(row)
+        else:
+            pkey = tuple([row.get(c.key)
+                          for c in table.__table__.primary_key.columns])
+            snapshots.setdefault(record["table"], {})[pkey] = row
+
+    session = s.Session()
+    run_ids = {}
+    skipped = set()
+    order = IMPORT_ORDER + sorted(set(list(snapshots) + list(rows)) -
+                                  set(IMPORT_ORDER))
+    for name in order:
+        table = tables[name]
+        for row in snapshots.get(name, {}).values():
+            row = decode_row(table, row)
+            if name == "run":
+                local_id = row.pop("id")
+                known = session.query(s.Config).filter(
+                    s.Config.name == SPOOL_ID_CONFIG,
+                    s.Config.value == local_id).first()
+                if known is not None:
+                    run_ids[local_id] = known.run_id
+                    skipped.add(local_id)
+                    continue
+                db_run = s.Run(**row)
+                session.add(db_run)
+                session.flush()
+                run_ids[local_id] = db_run.id
+                session.add(s.Config(name=SPOOL_ID_CONFIG,
+                                     value=local_id,
+                                     run_id=db_run.id))
+                continue
+
+            if "run_id" in row:
+                if row["run_id"] in skipped:
+                    continue
+                row["run_id"] = run_ids.get(row["run_id"], row["run_id"])
+            session.merge(table(**row))
+
+        new_rows = []
+        for row in rows.get(name, []):
+            if "run_id" in row:
+                if row["run_id"] in skipped:
+                    continue
+                row["run_id"] = run_ids.get(row["run_id"], row["run_id"])
+            new_rows.append(decode_row(table, row))
+        if name == "blob":
+            new_rows = new_blobs(session, new_rows)
+        session.flush()
+        bulk_insert(session, table, new_rows)
+
+    session.commit()
+    return (len(run_ids) - len(skipped), len(skipped))
@@ -7,9 +7,10 @@ setup(
     packages=find_packages(exclude=["docs", "extern", "filters", "linker",
                                     "src", "statistics", "tests", "results"]),
     install_requires=
-    ["lazy==1.2", "SQLAlchemy==1.0.4", "dill==0.2.4", "plumbum>=1.5.0",
+    ["lazy==1.2", "SQLAlchemy==1.0.4", "plumbum>=1.5.0",
      "regex==2015.5.28", "wheel==0.24.0", "parse==1.6.6", "virtualenv==13.1.0",
-     "sphinxcontrib-napoleon", "psycopg2", "sqlalchemy-migrate", "six>=1.7.0"],
+     "sphinxcontrib-napoleon", "psycopg2", "sqlalchemy-migrate", "six>=1.7.0",
+     "numpy>=1.9"],
     author="Andreas Simbuerger",
     author_email="simbuerg@fim.uni-passau.de",
     description="This is the experiment driver for the pprof study",